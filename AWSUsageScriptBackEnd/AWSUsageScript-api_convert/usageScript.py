@@ -4,7 +4,7 @@ from botocore.exceptions import ClientError
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
-import subprocess
+import configparser
 import os
 
 app = FastAPI()
@@ -71,45 +71,46 @@ async def aws_configure(credentials: AWSCredentials):
             "message": f"Error with authentication: {e}",
         }
         
+# Write the default profile the way `aws configure set` does, without starting the CLI once per setting
+def write_aws_profile(path: str, section: str, values: dict):
+    path = os.path.expanduser(path)
+    config = configparser.RawConfigParser()
+    config.read(path)
+    
+    if not config.has_section(section):
+        config.add_section(section)
+    for key, value in values.items():
+        config.set(section, key, value)
+    
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    
+    # Write next to the file and swap it in, a reader never sees a half written file
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w") as f:
+        config.write(f)
+    os.chmod(tmp_path, 0o600)
+    os.replace(tmp_path, path)
+
 def configure_aws_cli (credentials: AWSCredentials):
     try:
-        # check=True: will raise a CalledProcessError if the command fails.
-
-        # capture_output=True: captures stdout and stderr instead of printing them.
-
-        # text=True: returns output as a string rather than bytes.
-
-        # Configure AWS CLI access key
-        subprocess.run([
-            'aws', 'configure', 'set', 'aws_access_key_id', credentials.access_key
-        ], check = True, capture_output=True, text=True)
-        
-        # Configure AWS CLI secret key
-        subprocess.run([
-            'aws', 'configure', 'set', 'aws_secret_access_key', credentials.secret_access_key
-        ], check=True, capture_output=True, text=True)
-        
-        # Configure AWS CLI region
-        subprocess.run([
-            'aws', 'configure', 'set', 'region', credentials.region
-        ], check=True, capture_output=True, text=True)
-
-        # Configure output format to json
-        subprocess.run([
-            'aws', 'configure', 'set', 'output', 'json'
-        ], check=True, capture_output=True, text=True)
+        # Configure AWS CLI access key and secret key
+        write_aws_profile(os.environ.get('AWS_SHARED_CREDENTIALS_FILE', '~/.aws/credentials'), 'default', {
+            'aws_access_key_id': credentials.access_key,
+            'aws_secret_access_key': credentials.secret_access_key,
+        })
+        
+        # Configure AWS CLI region and output format to json
+        write_aws_profile(os.environ.get('AWS_CONFIG_FILE', '~/.aws/config'), 'default', {
+            'region': credentials.region,
+            'output': 'json',
+        })
         
         print("AWS CLI configured successfully")
         
-    # If there is CalledProcessError, raise exception
-    except subprocess.CalledProcessError as e:
+    # If the files cannot be written, raise exception
+    except (OSError, configparser.Error) as e:
         print(f"Error configuring AWS CLI: {e}")
         raise Exception(f"Failed to configure AWS CLI: {e}")
-    
-    # If there is FileNotFoundError, raise exception
-    except FileNotFoundError:
-        print(f"AWS CLI not found. Please install AWS CLI.")
-        raise Exception("AWS CLI not installed")
 
 @app.get("/")
 async def root():
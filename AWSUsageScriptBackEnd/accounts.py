@@ -0,0 +1,135 @@
+import asyncio
+import os
+import threading
+from datetime import datetime, timedelta, timezone
+import aws_clients
+import aws_executor
+from aws_clients import AWSContext
+
+# Member accounts reached through STS AssumeRole.
+# A logged in account can register role ARNs of member accounts. The roles are assumed in
+# parallel and their temporary credentials are cached until shortly before they expire, so
+# dashboard loads reuse them instead of calling AssumeRole again.
+
+# Role ARNs used when /configure does not send any, comma separated
+DEFAULT_ROLE_ARNS = [arn.strip() for arn in os.environ.get("AWS_MEMBER_ROLE_ARNS", "").split(",") if arn.strip()]
+# Cached credentials are renewed when they expire within this many seconds.
+# botocore refreshes its credentials 15 minutes before expiry, so this must not be shorter.
+ASSUME_ROLE_REFRESH_SECONDS = int(os.environ.get("ASSUME_ROLE_REFRESH_SECONDS", "900"))
+ASSUME_ROLE_DURATION_SECONDS = int(os.environ.get("ASSUME_ROLE_DURATION_SECONDS", "3600"))
+
+class InvalidAccounts(Exception):
+    pass
+
+# Logged in account id -> {member account id: role ARN}
+member_roles = {}
+
+# (source account id, role ARN) -> credential metadata in the format botocore refreshes from
+assumed_credentials = {}
+assume_locks = {}
+assume_locks_lock = threading.Lock()
+assume_role_calls = 0
+
+def account_id_from_role_arn(role_arn: str):
+    # arn:aws:iam::123456789012:role/Name
+    parts = role_arn.split(":")
+    if len(parts) < 6 or parts[2] != "iam" or not parts[5].startswith("role/") or not parts[4].isdigit():
+        raise InvalidAccounts(f"Not an IAM role ARN: {role_arn}")
+
+    return parts[4]
+
+def expires_soon(metadata: dict):
+    expiry = datetime.fromisoformat(metadata["expiry_time"])
+    return expiry - datetime.now(timezone.utc) < timedelta(seconds=ASSUME_ROLE_REFRESH_SECONDS)
+
+# Temporary credentials of a member role, only calling AssumeRole when the cached ones are about to expire
+def assume_role(source: AWSContext, role_arn: str):
+    global assume_role_calls
+    key = (source.account_id, role_arn)
+
+    cached = assumed_credentials.get(key)
+    if cached is not None and not expires_soon(cached):
+        return cached
+
+    with assume_locks_lock:
+        lock = assume_locks.setdefault(key, threading.Lock())
+
+    # Only one thread renews a role, the others wait and reuse its credentials
+    with lock:
+        cached = assumed_credentials.get(key)
+        if cached is not None and not expires_soon(cached):
+            return cached
+
+        response = source.client('sts').assume_role(
+            RoleArn=role_arn,
+            RoleSessionName=f"aws-resource-monitor-{source.account_id}",
+            DurationSeconds=ASSUME_ROLE_DURATION_SECONDS,
+        )
+        assume_role_calls += 1
+        credentials = response['Credentials']
+
+        metadata = {
+            "access_key": credentials['AccessKeyId'],
+            "secret_key": credentials['SecretAccessKey'],
+            "token": credentials['SessionToken'],
+            "expiry_time": credentials['Expiration'].astimezone(timezone.utc).isoformat(),
+        }
+        assumed_credentials[key] = metadata
+
+        return metadata
+
+# Remember the member roles of a logged in account and let the client pool reach them
+def register_member_roles(source: AWSContext, role_arns):
+    roles = {account_id_from_role_arn(role_arn): role_arn for role_arn in role_arns}
+
+    for member_id, role_arn in roles.items():
+        aws_clients.register_credential_provider(
+            member_id,
+            lambda role_arn=role_arn: assume_role(source, role_arn),
+            source = source.account_id,
+        )
+
+    member_roles[source.account_id] = roles
+
+    return roles
+
+# Assume every member role of an account at the same time.
+# Returns the accounts whose role could not be assumed with the reason.
+async def assume_all(source: AWSContext):
+    roles = member_roles.get(source.account_id, {})
+
+    results = await asyncio.gather(
+        *(aws_executor.run("sts", assume_role, source, role_arn) for role_arn in roles.values()),
+        return_exceptions=True,
+    )
+
+    return {
+        member_id: f"Error assuming {roles[member_id]}: {result}"
+        for member_id, result in zip(roles, results)
+        if isinstance(result, Exception)
+    }
+
+# Turn the "accounts" query parameter into the tenant contexts to scan.
+# Nothing means the logged in account, "all" adds every registered member account.
+def resolve_accounts(aws: AWSContext, accounts: str = None):
+    if not accounts:
+        return [aws]
+
+    members = member_roles.get(aws.account_id, {})
+    requested = [account.strip() for account in accounts.split(",") if account.strip()]
+
+    if requested == ["all"]:
+        requested = [aws.account_id] + sorted(members)
+
+    unknown = [account for account in requested if account != aws.account_id and account not in members]
+    if unknown:
+        raise InvalidAccounts(f"Accounts not registered for this login: {', '.join(unknown)}")
+
+    return [aws if account == aws.account_id else aws.for_account(account) for account in dict.fromkeys(requested)]
+
+def stats():
+    return {
+        "member_accounts": sum(len(roles) for roles in member_roles.values()),
+        "cached_credentials": len(assumed_credentials),
+        "assume_role_calls": assume_role_calls,
+    }
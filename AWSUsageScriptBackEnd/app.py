@@ -1,15 +1,57 @@
+import asyncio
+import logging
+import os
+import time
+from contextlib import asynccontextmanager
 import boto3
 from datetime import datetime, timedelta
 from botocore.exceptions import ClientError
-from fastapi import FastAPI, Depends, HTTPException, status, Request
+from fastapi import FastAPI, Depends, HTTPException, Query, status, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, PlainTextResponse, Response, StreamingResponse
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from pydantic import BaseModel
-import subprocess
-import os
 from jose import JWTError, jwt
+import accounts
+import aws_clients
+import aws_executor
+import breakers
+import cassettes
+import coalescing
+import collectors
+import cost_cache
+import cost_ledger
+import deadlines
+import encoding
+import events
+import fanout
+import history
+import logs
+import metrics
+import rate_limits
+import snapshots
+
+# Start and stop the background parts of the backend together with the app
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    logs.setup()
+    scheduler = asyncio.create_task(snapshots.store.run())
+    yield
+    scheduler.cancel()
+    aws_executor.shutdown()
+    logs.shutdown()
+
+# Responses are written by orjson when it is installed
+app = FastAPI(lifespan=lifespan, default_response_class=encoding.FastJSONResponse)
+
+# Every scan of the collectors is recorded in ./data and its changes are pushed to subscribers
+snapshots.store.history = history.store
+snapshots.store.listeners.append(events.broker.snapshot_taken)
 
-app = FastAPI()
+log = logging.getLogger("app")
+
+# Scan every collector of an account in the background right after its login
+WARM_UP_ON_LOGIN = os.environ.get("WARM_UP_ON_LOGIN", "true").lower() not in ("0", "false", "no")
 
 # JWT Configuration
 SECRET_KEY = "123"
@@ -20,16 +62,48 @@ ACCESS_TOKEN_EXPIRE_MINUTES = 30
 # “I expect clients to send an Authorization: Bearer <token> header with requests.”
 security = HTTPBearer(auto_error=False)
 
+# Route template of the request (e.g. /diff/{service}) so metric labels stay few, set once the router matched it
+def route_label(request: Request):
+    route = request.scope.get("route")
+    return route.path if route is not None else "unmatched"
+
+# Start the time budget of the request, from ?deadline_ms=1500 or REQUEST_DEADLINE_MS
 @app.middleware("http")
-async def log_requests(request: Request, call_next):
-    print(f"🔍 {request.method} {request.url.path}")
-    print(f"🔍 Origin: {request.headers.get('origin', 'NO ORIGIN')}")
-    print(f"🔍 Headers: {dict(request.headers)}")
+async def apply_deadline(request: Request, call_next):
+    try:
+        budget_ms = deadlines.parse_budget(request.query_params.get("deadline_ms"))
+    except deadlines.InvalidDeadline as e:
+        return JSONResponse(status_code = status.HTTP_400_BAD_REQUEST, content = {"detail": str(e)})
     
-    response = await call_next(request)
+    # Set in the task of the request, the endpoint and its AWS worker threads see it
+    deadlines.start(budget_ms)
+    return await call_next(request)
+
+# One structured line and the metrics per request, headers are left out so tokens never reach the logs.
+# Streamed responses (NDJSON, events) are measured until their headers are sent.
+@app.middleware("http")
+async def log_requests(request: Request, call_next):
+    started = time.perf_counter()
+    metrics.http_in_flight.inc()
+    try:
+        response = await call_next(request)
+    except Exception:
+        metrics.http_requests.inc(request.method, route_label(request), 500)
+        log.exception("Request failed", extra = {"method": request.method, "path": request.url.path})
+        raise
+    finally:
+        metrics.http_in_flight.dec()
     
-    print(f"📤 Response Status: {response.status_code}")
-    print(f"📤 Response Headers: {dict(response.headers)}")
+    route = route_label(request)
+    metrics.http_request_seconds.observe(time.perf_counter() - started, request.method, route)
+    metrics.http_requests.inc(request.method, route, response.status_code)
+    log.info("Request", extra = {
+        "method": request.method,
+        "path": request.url.path,
+        "status": response.status_code,
+        "duration_ms": round((time.perf_counter() - started) * 1000, 1),
+        "origin": request.headers.get('origin'),
+    })
     
     return response
 
@@ -51,6 +125,8 @@ class AWSCredentials(BaseModel):
     access_key: str
     secret_access_key: str
     region: str = "ap-southeast-2"
+    # Roles in member accounts to assume from this login (AWS_MEMBER_ROLE_ARNS when empty)
+    role_arns: list[str] = []
     
 class Token(BaseModel):
     access_token: str
@@ -61,7 +137,7 @@ class Token(BaseModel):
 
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run("app:app", host="0.0.0.0", port=5001, reload=True)
+    uvicorn.run("app:app", host="0.0.0.0", port=5001, reload=True, access_log=False)
 
 # JWT helper
 def create_access_token(data: dict, expires_delta: timedelta = None):
@@ -91,7 +167,7 @@ def create_access_token(data: dict, expires_delta: timedelta = None):
 def verify_token(credentials: HTTPAuthorizationCredentials = Depends(security)):
     try:
         if credentials is None:
-            print("--- No credentials provided")
+            log.debug("No credentials provided")
             raise HTTPException(
                 status_code=status.HTTP_401_UNAUTHORIZED,
                 detail="No authorization token provided",
@@ -116,55 +192,116 @@ def verify_token(credentials: HTTPAuthorizationCredentials = Depends(security)):
             detail = "Invalid authentication credentials",
             headers = {"WWW-Authenticate": "Bearer"},
         )
+
+# FastAPI dependency giving the collectors pooled AWS clients for the account and region of the token
+def get_aws_context(current_user: dict = Depends(verify_token)):
+    try:
+        aws_clients.get_credentials(current_user["account_id"])
+    except aws_clients.CredentialsNotFound:
+        # The backend restarted or evicted the login, the user has to configure the credentials again
+        raise HTTPException(
+            status_code = status.HTTP_401_UNAUTHORIZED,
+            detail = "AWS credentials are no longer available, please log in again",
+            headers = {"WWW-Authenticate": "Bearer"},
+        )
+    
+    return aws_clients.AWSContext(current_user["account_id"], current_user["region"])
         
 @app.get('/health')
 async def aws_health():
     try:
-        print("--- Health check called ---")
-        print
         return {
             'success': True,
             'message': f'Backend is accessible!'
         }
     except Exception as e:
-        print(f"--- Health check error: {e} ---")
+        log.error("Health check error", extra = {"error": str(e)})
         return {
             'success': False,
             'message': f'Backend is NOT accessible: {e}'
         }
         
+# Per-account entries of a stats dict reduced to their number. /health/pools needs no token, its
+# keys hold account ids and the scan errors are raw AWS messages with ARNs in them.
+def counted(stats: dict, *fields):
+    return {name: len(value) if name in fields else value for name, value in stats.items()}
+
+# Report how busy the AWS worker pools are
+@app.get('/health/pools')
+async def aws_pool_health():
+    stats = aws_executor.pool_stats()
+    saturated = [service for service, pool in stats.items() if pool["queued"] > 0]
+    
+    return {
+        'success': True,
+        'message': f'{len(saturated)} of {len(stats)} AWS pools are saturated',
+        'saturated': saturated,
+        'pools': stats,
+        'sessions': aws_clients.session_pool.stats(),
+        'identities': aws_clients.identity_cache.stats(),
+        'cost_cache': cost_cache.costs.stats(),
+        'cost_ledger': cost_ledger.ledger.stats(),
+        'snapshots': counted(snapshots.store.stats(), 'errors'),
+        'events': events.broker.stats(),
+        'logs': logs.stats(),
+        'rate_limits': counted(rate_limits.limiter.stats(), 'slowed'),
+        'breakers': counted(breakers.breakers.stats(), 'open'),
+        'coalescing': coalescing.flights.stats(),
+        'cassettes': cassettes.cassette.stats(),
+    }
+
+# Prometheus text format, scraped without a token like /health
+@app.get('/metrics', response_class = PlainTextResponse)
+async def prometheus_metrics():
+    return PlainTextResponse(metrics.render(), media_type = "text/plain; version=0.0.4; charset=utf-8")
+
 @app.post('/configure')
 async def aws_configure(credentials: AWSCredentials):
     try:
-        print(f"--- COFIGURING AWS CREDENTIALS ---")
-        print(f"Region RECIEVED: {credentials.region}")
-        print(f"Access Key ID RECIEVED: {credentials.access_key[:4]}****")
-        
-        # Create a test session to retrieve info about the current user using the passed credentials
-        test_session = boto3.Session(
-            aws_access_key_id = credentials.access_key,
-            aws_secret_access_key = credentials.secret_access_key,
-            region_name = credentials.region
+        log.info("Configuring AWS credentials", extra = {"region": credentials.region})
+        
+        # Logins with the same access key and secret as a recent one skip STS
+        identity = aws_clients.identity_cache.get(credentials.access_key, credentials.secret_access_key)
+        if identity is None:
+            # Create a test session to retrieve info about the current user using the passed credentials
+            test_session = boto3.Session(
+                aws_access_key_id = credentials.access_key,
+                aws_secret_access_key = credentials.secret_access_key,
+                region_name = credentials.region
+            )
+            
+            # Test credentials with a simple STS call
+            sts_client = aws_clients.instrument(test_session.client('sts'))
+            
+            # Specify the user's identity from the current test session
+            response = await aws_executor.run("sts", sts_client.get_caller_identity)
+            identity = {"Account": response.get('Account'), "Arn": response.get('Arn')}
+            aws_clients.identity_cache.put(credentials.access_key, credentials.secret_access_key, identity)
+        
+        log.info("AWS identity", extra = {"account_id": identity.get('Account'), "user_arn": identity.get('Arn')})
+        
+        # Keep the credentials for this account only, so users of different accounts never share them
+        aws_clients.register_credentials(
+            identity.get('Account'),
+            credentials.access_key,
+            credentials.secret_access_key,
         )
-                
-        # Test credentials with a simple STS call
-        sts_client = test_session.client('sts')
-                
-        # Specify the user's identity from the current test session
-        identity = sts_client.get_caller_identity()
         
-        print(f"AWS Account ID: {identity.get('Account')}")
-        print(f"User ARN: {identity.get('Arn')}")
-
-        # configure_aws_cli(credentials)
+        # Assume the member account roles in parallel so their credentials are cached before the first scan
+        aws = aws_clients.AWSContext(identity.get('Account'), credentials.region)
+        try:
+            member_roles = accounts.register_member_roles(aws, credentials.role_arns or accounts.DEFAULT_ROLE_ARNS)
+        except accounts.InvalidAccounts as e:
+            return {
+                "success": False,
+                "message": f"Error with member accounts: {e}",
+            }
+        failed_members = await accounts.assume_all(aws)
         
-        # Specify the os env os it can be used by CLI or SDK from now on
-        os.environ['AWS_ACCESS_KEY_ID'] = credentials.access_key
-        os.environ['AWS_SECRET_ACCESS_KEY'] = credentials.secret_access_key
-        os.environ['AWS_DEFAULT_REGION'] = credentials.region
+        for member_id, error in failed_members.items():
+            log.warning("Error assuming member account role", extra = {"member_account": member_id, "error": error})
         
         # Create JWT Token once authenthication has been passed
-        print(f"----- Creating JWT Token")
         access_token_expires = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
         response = create_access_token(
             data={
@@ -177,8 +314,11 @@ async def aws_configure(credentials: AWSCredentials):
         
         access_token = response['encoded_jwt']
         
-        # If there is no exception has been caught, print the message of success
-        print(f"AWS credentials configured sucessfully!")
+        # If there is no exception has been caught, log the success
+        log.info("AWS credentials configured", extra = {"account_id": identity.get('Account')})
+        
+        # The dashboard loaded right after the login finds the snapshots ready or in flight
+        warming_up = start_warm_up(aws)
         
         return {
             "success": True,
@@ -189,50 +329,20 @@ async def aws_configure(credentials: AWSCredentials):
                 "expires_in": ACCESS_TOKEN_EXPIRE_MINUTES * 60,
                 "account_id": identity.get('Account'),
                 "region": credentials.region
-            }
+            },
+            "member_accounts": sorted(member_roles),
+            "failed_member_accounts": failed_members,
+            "warming_up": warming_up,
         }
         
     
-    # Raise any exception if there is or has been raised by configure_aws_cli()
+    # The credentials were rejected by STS
     except ClientError as e:
         return {
             "success": False,
             "message": f"Error with authentication: {e}",
         }
         
-def configure_aws_cli (credentials: AWSCredentials):
-    try:
-        subprocess.run([
-            'aws', 'configure', 'set', 'aws_access_key_id', credentials.access_key
-        ], check = True, capture_output=True, text=True)
-        
-        # Configure AWS CLI secret key
-        subprocess.run([
-            'aws', 'configure', 'set', 'aws_secret_access_key', credentials.secret_access_key
-        ], check=True, capture_output=True, text=True)
-        
-        # Configure AWS CLI region
-        subprocess.run([
-            'aws', 'configure', 'set', 'region', credentials.region
-        ], check=True, capture_output=True, text=True)
-
-        # Configure output format to json
-        subprocess.run([
-            'aws', 'configure', 'set', 'output', 'json'
-        ], check=True, capture_output=True, text=True)
-        
-        print("AWS CLI configured successfully")
-        
-    # If there is CalledProcessError, raise exception
-    except subprocess.CalledProcessError as e:
-        print(f"Error configuring AWS CLI: {e}")
-        raise Exception(f"Failed to configure AWS CLI: {e}")
-    
-    # If there is FileNotFoundError, raise exception
-    except FileNotFoundError:
-        print(f"AWS CLI not found. Please install AWS CLI.")
-        raise Exception("AWS CLI not installed")
-
 @app.get("/")
 async def root():
     return {"message": "Hello word"}
@@ -240,11 +350,7 @@ async def root():
 @app.get("/region")
 async def aws_get_region(current_user: dict = Depends(verify_token)):
     try:
-        session = boto3.Session()
-        current_region = session.region_name
-        print('----- CURRENT REGION -----------')
-        print(f"Current AWS region: {current_region}")
-        
+        current_region = current_user["region"]
         return {
             "success": True,
             "message": f"Current region: {current_region}",
@@ -258,650 +364,440 @@ async def aws_get_region(current_user: dict = Depends(verify_token)):
             "current_region": "Cannot retrieve current region",
         }
     
+# Get the total cost of the month
 @app.get("/costs")
-def get_aws_costs(current_user: dict = Depends(verify_token)):
+async def get_aws_costs(aws: aws_clients.AWSContext = Depends(get_aws_context)):
     try:
-        # Get the Cost Explorer client
-        cost_client = boto3.client('ce')
-        # Specify today
-        today = datetime.now()
-        # Specify the start day as the first day of the month
-        start_date = today.replace(day = 1).strftime("%Y-%m-%d")
-        # Specify the end day as the tomorrow so today can be inclusive
-        end_date = (today + timedelta(days = 1)).strftime("%Y-%m-%d")
-
-        response = cost_client.get_cost_and_usage(
-            TimePeriod = {
-                'Start': start_date,
-                'End': end_date,
-            },
-            # The detail for cost data is set to MONTHLY (Ex: DAILY, HOURLY)
-            Granularity = 'MONTHLY',
-            # UnblendedCost refers to the raw cost without any discounts for credits applied
-            Metrics = ['UnblendedCost']
-        )
-        # Filter the neccessery values from the 
-        cost = float(response['ResultsByTime'][0]['Total']['UnblendedCost']['Amount'])
-        # Print the result
-        print(f"\nTotal AWS costs from {start_date} to {end_date}: {cost: .2f}")
-        
-        return {
-            "sucess": True,
-            "message": f"Total cost: {cost:.2f}",
-            "totalCost": cost
-        }
+        return await deadlines.within(collectors.collect_total_cost(aws))
+    except deadlines.DeadlineExceeded:
+        return partial_result("costs")
 
-    except ClientError as e:
-        print(f"\nError getting AWS costs: {e}")
-        
-        return {
-            "sucess": False,
-            "message": f"Error getting cost: {e}",
-            "totalCost": cost
-        }
+# Costs of any date range from the local daily ledger, e.g. /costs/daily?start=2024-01-01&end=2024-04-01&group_by=service,region
+# Defaults to month to date grouped by service. The end date is exclusive.
+@app.get("/costs/daily")
+async def get_daily_costs(start: str = None, end: str = None, group_by: str = "service", aws: aws_clients.AWSContext = Depends(get_aws_context)):
+    today = cost_ledger.utc_today()
+    start = start or today.replace(day = 1).isoformat()
+    end = end or (today + timedelta(days = 1)).isoformat()
+    dimensions = [dimension.strip() for dimension in group_by.split(",") if dimension.strip()]
+    
+    try:
+        return await deadlines.within(aws_executor.run("ce", collectors.collect_cost_ledger, aws, start, end, dimensions))
+    except deadlines.DeadlineExceeded:
+        return partial_result("costs")
+    except cost_ledger.InvalidDateRange as e:
+        raise HTTPException(status_code = status.HTTP_400_BAD_REQUEST, detail = str(e))
+
+# Answer of a service that did not finish within the deadline of the request.
+# Collectors are still scanned in the background, the next request gets their snapshot.
+def partial_result(name: str, spec: dict = None):
+    result = {
+        "success": False,
+        "partial": True,
+        "message": f"{name} did not answer within the deadline of the request",
+    }
+    if spec is not None and spec["items"]:
+        result[spec["items"]] = []
+    result["total_count"] = 0
+    
+    return result
+
+# Clients opt into streaming with "Accept: application/x-ndjson"
+def wants_ndjson(request: Request):
+    return "application/x-ndjson" in request.headers.get("accept", "")
+
+# Encoding of the response asked for with the Accept header (JSON, MessagePack or Arrow)
+def response_encoding(request: Request, offered):
+    try:
+        return encoding.negotiate(request.headers.get("accept"), offered)
+    except encoding.NotAcceptable as e:
+        raise HTTPException(status_code = status.HTTP_406_NOT_ACCEPTABLE, detail = str(e))
+
+# MessagePack or Arrow body of a snapshot, built per request on a worker thread.
+# Arrow streams hold the resources as a table, the rest of the response is in the schema metadata.
+def encode_snapshot(snapshot, spec: dict, media_type: str):
+    if media_type == encoding.MSGPACK:
+        return encoding.packb({**snapshot.data, "snapshot": snapshot.info()})
+    
+    metadata = {key: value for key, value in snapshot.data.items() if key != spec["items"]}
+    metadata["snapshot"] = snapshot.info()
+    return encoding.arrow_stream(snapshot.data.get(spec["items"]) or [], metadata)
+
+# Resolve the "accounts" and "regions" query parameters into the (account, region) contexts a collector scans.
+# Unknown accounts or regions are a client error.
+async def requested_targets(spec: dict, aws: aws_clients.AWSContext, accounts_param: str = None, regions: str = None):
+    try:
+        account_contexts = accounts.resolve_accounts(aws, accounts_param)
+        return await fanout.resolve_targets(spec, account_contexts, regions)
+    except (accounts.InvalidAccounts, fanout.InvalidRegions) as e:
+        raise HTTPException(status_code = status.HTTP_400_BAD_REQUEST, detail = str(e))
+
+# Scan one collector on all of its targets.
+# A single account wide scan keeps the collector's own response.
+async def scan_collector(spec: dict, targets):
+    if not spec["regional"] and len(targets) == 1:
+        return await aws_executor.call(spec["service"], spec["collect"], targets[0])
+    
+    return await fanout.scan_targets(spec, targets)
+
+# Latest snapshot of a collector for the login, accounts and regions of the request.
+# Only the first request of a scope scans AWS, the scheduler keeps it fresh afterwards.
+# With fresh set the scope is scanned again first (sharing a scan already in flight).
+async def read_snapshot(name: str, spec: dict, aws: aws_clients.AWSContext, targets, accounts_param: str = None, regions: str = None, fresh: bool = False):
+    key = snapshot_key(name, aws, accounts_param, regions)
+    return await snapshots.store.read(key, name, lambda: scan_collector(spec, targets), fresh)
+
+# Clients skip the snapshots with "Cache-Control: no-cache"
+def wants_fresh(request: Request):
+    return "no-cache" in request.headers.get("cache-control", "")
+
+def snapshot_key(name: str, aws: aws_clients.AWSContext, accounts_param: str = None, regions: str = None):
+    return (name, aws.account_id, aws.region, accounts_param or "", regions or "")
+
+# Warm-up scans in flight, kept so they are not garbage collected before they finish
+warm_ups = set()
+
+async def warm_up_collector(name: str, spec: dict, aws: aws_clients.AWSContext):
+    try:
+        await read_snapshot(name, spec, aws, await requested_targets(spec, aws))
+    except Exception as e:
+        log.warning("Error warming up collector", extra = {"service": name, "error": str(e)})
 
+# Take the first snapshot of every collector in the scope the dashboard reads (no accounts or regions given).
+# Scopes that already have a snapshot are not scanned again.
+def start_warm_up(aws: aws_clients.AWSContext):
+    if not WARM_UP_ON_LOGIN:
+        return []
+    
+    for name, spec in collectors.COLLECTORS.items():
+        task = asyncio.create_task(warm_up_collector(name, spec, aws))
+        warm_ups.add(task)
+        task.add_done_callback(warm_ups.discard)
+    
+    return list(collectors.COLLECTORS)
+
+# True when one of the ETags in If-None-Match is the current one
+def etag_matches(request: Request, etag: str):
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    
+    # Weak and strong validators compare the same here
+    candidates = [candidate.strip().removeprefix("W/") for candidate in header.split(",")]
+    return "*" in candidates or etag in candidates
+
+# Only the resources added, changed or removed since the version the client already has
+async def snapshot_delta(name: str, aws: aws_clients.AWSContext, snapshot, since: int, accounts_param: str = None, regions: str = None):
+    if not history.store.tracks(name):
+        raise HTTPException(status_code = status.HTTP_400_BAD_REQUEST, detail = f"No history for: {name}")
+    
+    scope = history.store.scope(snapshot_key(name, aws, accounts_param, regions))
+    try:
+        delta = await asyncio.to_thread(scope.delta, since, snapshot.version)
+    except history.InvalidVersion as e:
+        raise HTTPException(status_code = status.HTTP_400_BAD_REQUEST, detail = str(e))
+    
+    return {
+        "success": True,
+        "message": f"{len(delta['upserts'])} upserts and {len(delta['deletes'])} deletes since version {since}",
+        "since": since,
+        **delta,
+        "total_count": len(delta["upserts"]) + len(delta["deletes"]),
+        "snapshot": snapshot.info(),
+    }
+
+# Answer a collector endpoint as a streamed NDJSON body or as the regular JSON document
+# (MessagePack or Arrow when the Accept header asks for them).
+# Collectors are scanned in every requested account (and region when regional) and merged.
+# JSON answers carry the ETag of the snapshot (304 when the client has it already), with
+# since=<version> only the changes after that version are sent.
+async def collector_response(request: Request, name: str, aws: aws_clients.AWSContext, accounts_param: str = None, regions: str = None, since: int = None):
+    spec = collectors.COLLECTORS[name]
+    try:
+        targets = await deadlines.within(requested_targets(spec, aws, accounts_param, regions))
+    except deadlines.DeadlineExceeded:
+        return partial_result(name, spec)
+    
+    # Streams always scan live, page by page
+    if wants_ndjson(request):
+        return StreamingResponse(fanout.stream_targets(spec, targets), media_type="application/x-ndjson")
+    
+    media_type = response_encoding(request, (encoding.JSON, encoding.MSGPACK, encoding.ARROW) if spec["items"] else (encoding.JSON, encoding.MSGPACK))
+    
+    try:
+        snapshot = await deadlines.within(read_snapshot(name, spec, aws, targets, accounts_param, regions, wants_fresh(request)))
+    except deadlines.DeadlineExceeded:
+        return partial_result(name, spec)
+    
+    if since is not None:
+        return await snapshot_delta(name, aws, snapshot, since, accounts_param, regions)
+    
+    # The browser keeps the response but asks again every time, getting a 304 while the snapshot is unchanged.
+    # Every encoding of a snapshot has its own ETag.
+    etag = snapshot.etag if media_type == encoding.JSON else f'{snapshot.etag[:-1]}-{encoding.LIBRARIES[media_type]}"'
+    headers = {"ETag": etag, "Cache-Control": "private, no-cache", "Vary": "Accept"}
+    if etag_matches(request, etag):
+        return Response(status_code = status.HTTP_304_NOT_MODIFIED, headers = headers)
+    
+    if media_type == encoding.JSON:
+        content = snapshot.body()
+    else:
+        content = await asyncio.to_thread(encode_snapshot, snapshot, spec, media_type)
+    
+    return Response(content = content, media_type = media_type, headers = headers)
 
 # Check RDS
 @app.get("/rds")
-async def check_rds_services(current_user: dict = Depends(verify_token)):
-    try:
-        print("---RDS Databases---")
-        rds_client = boto3.client('rds')
-        
-        instances = rds_client.describe_db_instances()
-        
-        # Collect all of the tables datas
-        tables_data = []
-        
-        # If there is no tables, return
-        if not instances['DBInstances']:
-            print("No RDS istances found")
-            return {
-                "success": True,
-                "message": f"Found {len(tables_data)} tables",
-                "rdsInstances": [],
-                "total_count": 0,
-            }
-        
-        for db in instances['DBInstances']:
-            tables_info = {
-                "identifier": db['DBInstanceIdentifier'],
-                "engine": db['Engine'],
-                "class": db['DBInstanceClass'],
-                "status": db['DBInstanceStatus'],
-                "storage": db.get('AllocatedStorage', 'N/A')
-            }
-            
-            tables_data.append(tables_info)
-            
-            print(f"DB Instance: {db['DBInstanceIdentifier']}")
-            print(f" Engine: {db['Engine']} {db.get('EngineVersion', 'N/A')}")
-            print(f" Class: {db['DBInstanceClass']}")
-            print(f" Status: {db['DBInstanceStatus']}")
-            print(f" Storage: {db.get('AllocatedStorage', 'N/A')} GB")
-            
-        print(f"Found {len(tables_data)} tables")
-            
-        return {
-            "success": True,
-            "message": f"Found {len(tables_data)} tables",
-            "rdsInstances": tables_data,
-            "total_count": len(tables_data),
-        }
-    except ClientError as err:
-        print(f"Error checking RDS: {err}")
-        
-        return {
-            "success": False,
-            "message": f"Error getting RDS databases: {err}",
-            "rdsInstances": [],
-            "total_count": 0,
-        }
-    return
+async def check_rds_services(request: Request, accounts: str = None, regions: str = None, since: int = None, aws: aws_clients.AWSContext = Depends(get_aws_context)):
+    return await collector_response(request, "rds", aws, accounts, regions, since)
 
 # Check S3
 @app.get("/s3")
-async def check_s3_services(current_user: dict = Depends(verify_token)):
-    try:
-        print("--- S3 Buckers ---")
-        s3_client = boto3.client('s3')
-        
-        # List buckets
-        buckets = s3_client.list_buckets()
-        
-        # Collect all of the buckets
-        buckets_data = []
-        
-        # If there is no S3 bucket
-        if not buckets['Buckets']:
-            print('No S3 buckets found')
-            return {
-                "sucess": True,
-                "message": f"Found {len(buckets_data)} buckets",
-                "buckets": buckets_data,
-                "total_count": len(buckets_data)
-            }
-        
-        for bucket in buckets['Buckets']:
-            bucket_name = bucket['Name']
-            print(f"Buckets: {bucket_name}")
-            
-            try:
-                # Get bucket size using CloudWatch
-                cloudwatch = boto3.client('cloudwatch')
-                response = cloudwatch.get_metric_statistics(
-                    Namespace = 'AWS/S3',
-                    MetricName = 'BucketSizeBytes',
-                    Dimensions = [
-                        {'Name': 'BucketName', 'Value': bucket_name},
-                        {'Name': 'StorageType', 'Value': 'StandardStorage'}
-                    ],
-                    # Set the start time as the current time subtracting one day to get the last 24 hours
-                    StartTime = datetime.now() - timedelta(days = 1),
-                    # Set the end time as the current time
-                    EndTime = datetime.now(),
-                    # Period of 86400 secs which is 24 hours / 1 day
-                    Period = 86400,
-                    # Set the statistic to average
-                    Statistics = ['Average']
-                )
-                
-                if response['Datapoints']:
-                    size_bytes = response['Datapoints'][-1]['Average']
-                    size_gb = size_bytes / (1024**3)
-                    print(f"    Size: {size_gb:.2f} GB")
-                    
-                    bucket_info = {
-                        "name": bucket_name,
-                        "size": size_gb,
-                    }
-                    
-                    buckets_data.append(bucket_info)
-                else:
-                    print(f"    Size: Unable to determine")
-                    
-                    bucket_info = {
-                        "name": bucket_name,
-                        "size": None,
-                    }
-                    
-                    buckets_data.append(bucket_info)
-                    
-            except Exception as e:
-                print(f" Error occurs: {e}")
-                
-                bucket_info = {
-                    "name": bucket_name,
-                    "size": None,
-                }
-                
-                buckets_data.append(bucket_info)
-                
-        return {
-            "success": True,
-            "message": f"Found {len(buckets_data)} buckets",
-            "s3Buckets": buckets_data,
-            "total_count": len(buckets_data)
-        }
-        
-    except ClientError as error:
-        print(f"Error checking S3: {error}")
-        
-        return {
-            "sucess": False,
-            "message": f"Error getting S3 Buckets: {error}",
-            "s3Buckets": [],
-            "total_count": 0,
-        }
-        
+async def check_s3_services(request: Request, accounts: str = None, since: int = None, aws: aws_clients.AWSContext = Depends(get_aws_context)):
+    return await collector_response(request, "s3", aws, accounts, since = since)
+
 # Check Lambda service
 @app.get("/lambda")
-async def check_lambda_services(current_user: dict = Depends(verify_token)):
-    try:
-        # Collect all of the lambda functions
-        lambda_data = []
-        
-        # Create the lambda client
-        lambda_client = boto3.client('lambda')
-        
-        # List all the functions
-        functions = lambda_client.list_functions()
-        
-        # If there is no function
-        if not functions['Functions']:
-            print("No Lambda functions found")
-            return {
-                "success": True,
-                "message": f"Found {len(lambda_data)} functions",
-                "functions": lambda_data,
-                "total_count": len(lambda_data),
-            }
-        
-        
-        # Iterate through each function in the dictionary to retrieve its metadata
-        for func in functions['Functions']:
-            
-            lambda_info = {
-                "name": func['FunctionName'],
-                "runtime": func['RunTime'],
-                "memory": func['MemorySize'],
-                "timeout": func['Timeout'],
-                "lastModified": func['LastModified'],
-            }
-            
-            print(f"Function: {func['FunctionName']}")
-            print(f"    Runtime: {func['RunTime']}")
-            print(f"    Memory: {func['MemorySize']} MB")
-            print(f"    Timeout: {func['Timeout']} seconds")
-            print(f"    Last Modified: {func['LastModified']}")
-        
-            lambda_data.append(lambda_info)
-        
-        return {
-            "sucess": True,
-            "message": f"Found {len(lambda_data)} functions",
-            "lambdaFunctions": lambda_data,
-            "total_count": len(lambda_data),
-        }
+async def check_lambda_services(request: Request, accounts: str = None, regions: str = None, since: int = None, aws: aws_clients.AWSContext = Depends(get_aws_context)):
+    return await collector_response(request, "lambda", aws, accounts, regions, since)
 
-    except ClientError as error:
-        print(f"Error checking Lambda: {error}")
-        
-        return {
-            "sucess": False,
-            "message": f"Error getting Lambda functions: {error}",
-            "lambdaFunctions": [],
-            "total_count": 0,
-        }
-        
 # Check load balancers
 @app.get("/elb")
-def check_load_balancers(current_user: dict = Depends(verify_token)):
-    try:
-        # Collect all of the load balancers
-        elb_data = []
-        
-        # Create the Classic Load Balancer client
-        elb_client = boto3.client('elb')
-        
-        # Retrieve all of the Classic load balancers
-        classic_lbs = elb_client.describe_load_balancers()
-        
-        # Create the Modern Load Balancers (ALB/NLB)
-        elbv2_client = boto3.client('elbv2')
-        modern_lbs = elbv2_client.describe_load_balancers()
-        
-        # Calculate the total number of load balancers
-        total_lbs = len(classic_lbs['LoadBalancerDescriptions']) + len(modern_lbs['LoadBalancers'])
-        
-        if total_lbs == 0:
-            print("No load balancers found")
-            
-            return {
-                "sucess": True,
-                "message": f"Found 0 load balancers",
-                "loadBalancers": [], 
-                "total_count": 0,
-            }
-        
-        # Show Classic LBs
-        for lb in classic_lbs['LoadBalancerDescriptions']:
-            print(f"Class LB: {lb['LoadBalancerName']}")
-            
-            # Scheme --> type of load balancer --> internet-facing / internal. 
-            # internet-facing load balancer --> routes requests from clients over the internet
-            # internal load balancer --> routes requests within a private network
-            print(f"    Scheme: {lb['Scheme']}")
-            print(f"    Instances: {len(lb['Instances'])}")
-            
-            classic_lbs_info = {
-                "name": lb['LoadBalancerName'],
-                "type": "Classic LB",
-                "scheme": lb['Scheme'],
-                "state": "",
-            }
-            
-            elb_data.append(classic_lbs_info)
-            
-        # Show Modern LBs
-        for lb in modern_lbs['LoadBalancers']:
-            print(f"{lb['Type'].upper()}: {lb['LoadBalancerName']}")
-            
-            # The line print(f" State: {lb['State']['Code']}") --> State dictionary within each modern load balancer (lb) to retrieve the Code value --> (e.g., "active", "provisioning").
-            print(f"    State: {lb['State']['Code']}")
-            
-            # Scheme --> type of load balancer --> internet-facing / internal. 
-            # internet-facing load balancer --> routes requests from clients over the internet
-            # internal load balancer --> routes requests within a private network
-            print(f"    Scheme: {lb['Scheme']}")
-            print()
-            
-            modern_lbs_info = {
-                "name": lb['LoadBalancerName'],
-                "type": lb['Type'].upper(),
-                "scheme": lb['Scheme'],
-                "state": lb['State']['Code'],
-            }
-            
-            elb_data.append(modern_lbs_info)
-        
-        return {
-            "sucess": True,
-            "message": f"Found {total_lbs} load balancers",
-            "loadBalancers": elb_data,
-            "total_count": len(elb_data),
-        }
-        
-    except ClientError as error:
-        print(f"Error checking load balancers: {error}")
-        
-        return {
-            "sucess": False,
-            "message": f"Error getting Load Balancers: {error}",
-            "loadBalancers": [],
-            "total_count": 0,
-        }
+async def check_load_balancers(request: Request, accounts: str = None, regions: str = None, since: int = None, aws: aws_clients.AWSContext = Depends(get_aws_context)):
+    return await collector_response(request, "elb", aws, accounts, regions, since)
 
 # Check EC2
 @app.get("/ec2")
-async def check_ec2_services(current_user: dict = Depends(verify_token)):
-    try:
-        # Collect all the instance data
-        instance_data = []
-        
-        # Get the EC2 client
-        ec2_client = boto3.client('ec2')
-        response = ec2_client.describe_instances()
-        
-        # If no instance found return immediately
-        if not response.get('Reservations'):
-            print('No EC2 instances found')
-            return {
-                "success": True,
-                "message": f"Found {len(instance_data)} instances",
-                "ec2Instances": instance_data,
-                "total_count": len(instance_data)
-            }
-        
-        # Extract andn print instance details
-        for reservation in response['Reservations']:
-            for instance in reservation['Instances']:
-                
-                instance_info = {
-                    "instance_id": instance['InstanceId'],
-                    "instance_type": instance['InstanceType'],
-                    "launch_time": instance['LaunchTime']
-                }
-                
-                instance_data.append(instance_info)
-                
-                
-                print(f"Instance ID: {instance_info['instance_id']}, Type: {instance_info['instance_type']}, Launch Time: {instance_info['launch_time']}")
+async def check_ec2_services(request: Request, accounts: str = None, regions: str = None, since: int = None, aws: aws_clients.AWSContext = Depends(get_aws_context)):
+    return await collector_response(request, "ec2", aws, accounts, regions, since)
 
-        return {
-            "success": True,
-            "message": f"Found {len(instance_data)} instances",
-            "ec2Instances": instance_data,
-            "total_count": len(instance_data),
-        }
-        
-    except ClientError as e:
-        print(f"Error checking services: {e}")
-        
-        return {
-            "success": False,
-            "error": f"Error checking EC2 services: {e}",
-            "ec2Instances": [],
-            "total_count": 0,
-        }
-        
 # Check EBS Volumes
 @app.get("/ebs")
-async def check_ebs_volume(current_user: dict = Depends(verify_token)):
-    try:
-        # Collect all of the ebs volumes
-        ebs_data = []
-        
-        print("--- EBS volumes ---")
-        
-        # Create the ec2 client to retrieve their volumes
-        ec2_client = boto3.client('ec2')
-        
-        volumes = ec2_client.describe_volumes()
-        
-        # If no volumes can be found
-        if not volumes['Volumes']:
-            print("No EBS volumes found")
-            
-            return {
-                "success": True,
-                "message": f"Found 0 volumes",
-                "ebsVolumes": [],
-                "total_count": 0,
-                "total_size": 0,
-            }
-        
-        # Keep track of the total size accross all of the volumes
-        total_size = 0
-        
-        # Interate through each volume in the dictionary to retrieve the metadata
-        for volume in volumes['Volumes']:
-            size = volume['Size']
-            total_size += size
-            print(f"Volume: {volume['VolumeId']}")
-            print(f"    Size: {size} GB")
-            print(f"    Type: {volume['VolumeType']}")
-            print(f"    State: {volume['State']}")
-            if volume['Attachments']:
-                print(f"    Attached to: {volume['Attachmeent'][0]['InstanceId']}")
-                
-                ebs_info = {
-                    "id": volume['VolumeId'],
-                    "size": volume['Size'],
-                    "type": volume['VolumeType'],
-                    "state": volume['State'],
-                    "attachedTo": volume['Attachments']
-                }
-                
-                ebs_data.append(ebs_info)
-            print()
-            
-            ebs_info = {
-                "id": volume['VolumeId'],
-                "size": volume['Size'],
-                "type": volume['VolumeType'],
-                "state": volume['State'],
-                "attachedTo": "No attachment"
-            }
-            
-            ebs_data.append(ebs_info)
-            
-        print(f"Total EBS storage: {total_size} GB")
-        
-        return {
-            "success": True,
-            "message": f"Found {len(ebs_data)} volumes",
-            "ebsVolumes": ebs_data,
-            "total_count": len(ebs_data),
-            "total_size": total_size,
-        }
-        
-    except ClientError as error:
-        print(f"Error checking EBS volumes: {error}")
-        
-        return {
-            "success": False,
-            "message": f"Error getting EBS volumes: {error}",
-            "ebsVolumes": [],
-            "total_count": 0,
-            "total_size": 0,
-        }
-        
+async def check_ebs_volume(request: Request, accounts: str = None, regions: str = None, since: int = None, aws: aws_clients.AWSContext = Depends(get_aws_context)):
+    return await collector_response(request, "ebs", aws, accounts, regions, since)
+
 # Check Elastic IPs
 @app.get("/eip")
-async def check_elastic_ips(current_user: dict = Depends(verify_token)):
-    try:
-        # Collect all of the elastic ips
-        eips_data = []
-        
-        print("--- Elastic IPs ---")
-        ec2_client = boto3.client('ec2')
-        
-        eips = ec2_client.describe_addresses()
-        
-        # If no Elastic ip can be found
-        if not eips['Addresses']:
-            print("No Elastic IPs found")
-            return {
-                "success": True,
-                "message": f"Found 0 IPs",
-                "ebsVolumes": [],
-                "total_count": 0,
-            }
-        
-        # Interate through each ip in the dictionary to retrieve the metadata
-        for eip in eips['Addresses']:
-            print(f"Elastic IP: {eip['PublicIp']}")
-            
-            # These lines check if an Elastic IP (EIP) is associated with an EC2 instance by looking for the 'InstanceId' key in the EIP dictionary. If it is present, it prints the instance ID to which the EIP is attached. If not, it indicates that the EIP is unattached, which can incur charges. This helps in identifying and managing costs associated with unused EIPs.
-            
-            if 'InstanceId' in eip:
-                print(f"    Attached to: {eip['InstanceId']}")
-                
-                eips_info = {
-                    "ip": eip['PublicIp'],
-                    "attachedTo": eip['InstanceId'],
-                    "status": "attached",
-                }
-                
-                eips_data.append(eips_info)
-            else:
-                print(f"    Status: Unattached (incurring charges)")
-                
-                eips_info = {
-                    "ip": eip['PublicIp'],
-                    "attachedTo": None,
-                    "status": "unattached",
-                }
-                
-                eips_data.append(eips_info)
-        
-        print()
-        
-        return {
-            "success": True,
-            "message": f"Found {len(eips_data)} IPs",
-            "elasticIPs": eips_data,
-            "total_count": len(eips_data),
-        }
-    except ClientError as error:
-        print(f"Error checking Elastic IPs: {error}")
-        
-        return {
-            "success": False,
-            "message": f"Error getting Elastic IPs: {error}",
-            "elasticIPs": [],
-            "total_count": 0,
-        }
-        
-def check_vpc_resources(current_user: dict = Depends(verify_token)):
+async def check_elastic_ips(request: Request, accounts: str = None, regions: str = None, since: int = None, aws: aws_clients.AWSContext = Depends(get_aws_context)):
+    return await collector_response(request, "eip", aws, accounts, regions, since)
+
+def check_vpc_resources(aws: aws_clients.AWSContext = Depends(get_aws_context)):
     try:
-        print("--- VPC Resources ---")
         # Create the EC2 clients
-        ec2_client = boto3.client('ec2')
+        ec2_client = aws.client('ec2')
 
         # Get the VPCs
         vpcs = ec2_client.describe_vpcs()
-        print(f"VPCs: {len(vpcs['Vpcs'])}")
+        log.info("VPCs", extra = {"total_count": len(vpcs['Vpcs'])})
         
         # NAT Gateways
         nat_gws = ec2_client.describe_nat_gateways()
         active_nats = [nat for nat in nat_gws['NatGateways'] if nat['State'] == 'available']
         
         if active_nats:
-            print(f"NAT Gateways: {len(active_nats)} (incurring hourly charges)")
+            # NAT gateways are incurring hourly charges
+            log.info("NAT gateways", extra = {"total_count": len(active_nats)})
         else:
-            print("NAT gateways: None")
+            log.info("NAT gateways", extra = {"total_count": 0})
             
         # Get the Internet Gateways
         igws = ec2_client.describe_internet_gateways()
-        print(f"Internet Gateways: {len(igws['InternetGateways'])}")
+        log.info("Internet gateways", extra = {"total_count": len(igws['InternetGateways'])})
         
     except ClientError as error:
-        print(f"Error checking VPC resources: {error}")
+        log.warning("Error checking VPC resources", extra = {"error": str(error)})
 
 # Getting total service cost
 @app.get("/cost")
-async def get_service_costs(current_user: dict = Depends(verify_token)):
+async def get_service_costs(aws: aws_clients.AWSContext = Depends(get_aws_context)):
     try:
-        print("=== COSTS BY SERVICE ===")
-        
-        # Create the cost explorer client
-        cost_client = boto3.client('ce')
-        
-        # Specify today
-        today = datetime.now()
-        
-        # Specify start date as the first day of the month
-        start_date = today.replace(day = 1).strftime("%Y-%m-%d")
-        # Specify end date as today
-        end_date = today.strftime("%Y-%m-%d")
-        
-        # Create the response of cost and usage from cost explorer
-        response = cost_client.get_cost_and_usage(
-            # Specify the time period
-            TimePeriod = {
-                'Start': start_date,
-                'End': end_date,
-            },
-            # Specify the granularity of monthly
-            Granularity = 'MONTHLY',
-            Metrics = ['UnblendedCost'],
-            GroupBy = [
-                {
-                    'Type': 'DIMENSION',
-                    'Key': 'SERVICE'
-                }
-            ]
-        )
-        
-        if response['ResultsByTime']:
-            # Get the service costs from the dictionary
-            service_costs = response['ResultsByTime'][0]['Groups']
-            
-            # Sort by cost (descending order)
-            service_costs.sort(key = lambda x: float(x['Metrics']['UnblendedCost']['Amount']), reverse = True)
-            
-            # Keep track of the total cost
-            total_cost = 0
-        
-            print(f"Service costs for {start_date} to {end_date}:")
-            print("-" * 50)
-            
-            # Interate through each service in the service costs to retrieve the metadata and increment the total cost
-            for service in service_costs:
-                service_name = service['Keys'][0]
-                cost = float(service['Metrics']['UnblendedCost']['Amount'])
-                total_cost += cost
-                
-                if cost > 0.01: # Only show services with significant costs
-                    print(f"{service_name:<30} ${cost:>8.2f}")
-                
-                    
-        print("-" * 50)
-        print(f"{'TOTAL':<30} ${total_cost:>8.2f}")
+        return await deadlines.within(collectors.collect_service_costs(aws))
+    except deadlines.DeadlineExceeded:
+        return partial_result("costs")
+
+# Collectors bundled by the /inventory endpoint, keyed by the name used in its response
+INVENTORY_COLLECTORS = collectors.COLLECTORS
+
+# Resolve the targets of one collector and read its snapshot within the deadline of the request.
+# Returns the per-service status and the snapshot, whose data goes into the response as it was encoded.
+# The targets are added to the given dict for the accounts and regions of the response.
+async def run_inventory_collector(name: str, spec: dict, aws: aws_clients.AWSContext, targets: dict, accounts_param: str = None, regions: str = None, fresh: bool = False):
+    started = time.perf_counter()
+    
+    async def read():
+        targets[name] = await requested_targets(spec, aws, accounts_param, regions)
+        return await read_snapshot(name, spec, aws, targets[name], accounts_param, regions, fresh)
+    
+    try:
+        snapshot = await deadlines.within(read())
         
         return {
-            "success": True,
-            "message": f"Total cost: {total_cost:.2f}",
-            "total_cost": round(total_cost, 2),
-        }
-        
-    except ClientError as error:
-        print(f"Error getting service costs: {error}")
+            "status": "ok" if snapshot.succeeded else "error",
+            "duration_ms": snapshot.duration_ms,
+            "snapshot": snapshot.info(),
+        }, snapshot
+    except deadlines.DeadlineExceeded:
+        return {
+            "status": "partial",
+            "partial": True,
+            "duration_ms": round((time.perf_counter() - started) * 1000, 1),
+            "message": f"{name} did not answer within the deadline of the request",
+            "data": partial_result(name, spec),
+        }, None
+    except HTTPException:
+        # Unknown accounts or regions
+        raise
+    except Exception as e:
+        log.warning("Error collecting inventory service", extra = {"service": name, "error": str(e)})
         
         return {
-            "success": False,
-            "message": f"Error getting service costs: {error}",
-            "total_cost": total_cost,
-        }
+            "status": "error",
+            "duration_ms": 0,
+            "message": f"Error collecting {name}: {e}",
+            "data": None,
+        }, None
+
+# Get every service in one call
+@app.get("/inventory")
+async def get_inventory(request: Request, accounts: str = None, regions: str = None, aws: aws_clients.AWSContext = Depends(get_aws_context)):
+    started = time.perf_counter()
+    media_type = response_encoding(request, (encoding.JSON, encoding.MSGPACK))
+    targets = {}
+    
+    # Start every collector at once so the total time is close to the slowest one
+    outcomes = await asyncio.gather(*(
+        run_inventory_collector(name, spec, aws, targets, accounts, regions, wants_fresh(request))
+        for name, spec in INVENTORY_COLLECTORS.items()
+    ))
+    services = {name: service for name, (service, snapshot) in zip(INVENTORY_COLLECTORS, outcomes)}
+    failed = [name for name, result in services.items() if result["status"] == "error"]
+    partial = [name for name, result in services.items() if result["status"] == "partial"]
+    
+    result = {
+        "success": not failed and not partial,
+        "message": f"Collected {len(services) - len(failed) - len(partial)} of {len(services)} services",
+        "failed": failed,
+        "partial": partial,
+        "accounts": sorted({target.account_id for service_targets in targets.values() for target in service_targets}),
+        "regions": sorted({target.region for name, service_targets in targets.items() if INVENTORY_COLLECTORS[name]["regional"] for target in service_targets}),
+        "duration_ms": round((time.perf_counter() - started) * 1000, 1),
+    }
+    
+    if media_type == encoding.MSGPACK:
+        for service, snapshot in outcomes:
+            if snapshot is not None:
+                service["data"] = snapshot.data
+        result["services"] = services
+        # Thousands of resources, encoded on a worker thread so the event loop keeps serving other requests
+        content = await asyncio.to_thread(encoding.packb, result)
+    else:
+        # Every snapshot is already encoded, the response only joins them
+        content = encoding.dumps_with(result, {"services": encoding.dumps_with({}, {
+            name: encoding.dumps_with(service, {"data": snapshot.encode()}) if snapshot is not None else encoding.dumps(service)
+            for name, (service, snapshot) in zip(INVENTORY_COLLECTORS, outcomes)
+        })})
+    
+    return Response(content = content, media_type = media_type, headers = {"Vary": "Accept"})
+
+# Drop the cached snapshots and costs of the account of the token, e.g. after changing resources outside the dashboard.
+# DELETE /cache?services=ec2,ebs only drops those collectors; the next read scans them again.
+@app.delete("/cache")
+async def invalidate_cache(services: str = None, aws: aws_clients.AWSContext = Depends(get_aws_context)):
+    names = None
+    if services:
+        names = {name.strip() for name in services.split(",") if name.strip()}
+        unknown = sorted(names - set(collectors.COLLECTORS))
+        if unknown:
+            raise HTTPException(status_code = status.HTTP_400_BAD_REQUEST, detail = f"Unknown services: {', '.join(unknown)}")
+    
+    invalidated = snapshots.store.invalidate(aws.account_id, names)
+    if names is None or "cost" in names:
+        cost_cache.costs.invalidate(aws.account_id)
+    
+    log.info("Cache invalidated", extra = {"account_id": aws.account_id, "services": services, "total_count": invalidated})
+    
+    return {
+        "success": True,
+        "message": f"Invalidated {invalidated} snapshots",
+        "services": sorted(names) if names else sorted(collectors.COLLECTORS),
+        "total_count": invalidated,
+    }
+
+# Collectors compared by /diff when no services are given
+DIFF_COLLECTORS = ["ec2", "ebs", "eip", "rds", "lambda", "elb"]
+
+def diff_collector(key, from_value: str = None, to_value: str = None):
+    scope = history.store.scope(key)
+    to_version = scope.resolve(to_value)
+    # Without a from version compare with the scan before
+    from_version = scope.resolve(from_value) if from_value is not None else max(0, to_version - 1)
+    changes = scope.diff(from_version, to_version)
+    
+    return {
+        "from_version": from_version,
+        "to_version": to_version,
+        **changes,
+        "total_count": sum(len(resources) for resources in changes.values()),
+    }
+
+# Resources added, removed and changed between two recorded scans, without scanning AWS.
+# from and to are scan versions or ISO 8601 times (e.g. /diff?from=2024-03-09T12:00&services=ec2,ebs),
+# to defaults to the latest scan. accounts and regions pick the same scans as the collector endpoints.
+@app.get("/diff")
+async def get_diff(from_: str = Query(None, alias = "from"), to: str = None, services: str = None, accounts: str = None, regions: str = None, aws: aws_clients.AWSContext = Depends(get_aws_context)):
+    names = [name.strip() for name in services.split(",") if name.strip()] if services else DIFF_COLLECTORS
+    unknown = [name for name in names if not history.store.tracks(name)]
+    if unknown:
+        raise HTTPException(status_code = status.HTTP_400_BAD_REQUEST, detail = f"No history for: {', '.join(unknown)}")
+    
+    try:
+        results = await asyncio.gather(*(
+            asyncio.to_thread(diff_collector, snapshot_key(name, aws, accounts, regions), from_, to)
+            for name in names
+        ))
+    except history.InvalidVersion as e:
+        raise HTTPException(status_code = status.HTTP_400_BAD_REQUEST, detail = str(e))
+    
+    diffs = dict(zip(names, results))
+    total = sum(diff["total_count"] for diff in diffs.values())
+    
+    return {
+        "success": True,
+        "message": f"Found {total} changed resources",
+        "services": diffs,
+        "total_count": total,
+    }
+
+# Live changes of the snapshots as Server-Sent Events, e.g.
+# new EventSource("/events?services=ec2,eip,elb,cost&access_token=<jwt>").
+# Every message holds the changed records of one service of the token's account.
+# EventSource cannot send an Authorization header, so the token can be given as access_token.
+@app.get("/events")
+async def stream_events(services: str = None, accounts: str = None, regions: str = None, access_token: str = None, credentials: HTTPAuthorizationCredentials = Depends(security)):
+    if credentials is None and access_token:
+        credentials = HTTPAuthorizationCredentials(scheme = "Bearer", credentials = access_token)
+    aws = get_aws_context(verify_token(credentials))
+    
+    names = [name.strip() for name in services.split(",") if name.strip()] if services else list(collectors.COLLECTORS)
+    unknown = [name for name in names if name not in collectors.COLLECTORS]
+    if unknown:
+        raise HTTPException(status_code = status.HTTP_400_BAD_REQUEST, detail = f"Unknown services: {', '.join(unknown)}")
+    
+    # Reading the snapshots makes sure every scope exists and is refreshed by the scheduler
+    async def watch(name: str):
+        spec = collectors.COLLECTORS[name]
+        await read_snapshot(name, spec, aws, await requested_targets(spec, aws, accounts, regions), accounts, regions)
+        return snapshot_key(name, aws, accounts, regions)
+    
+    keys = await asyncio.gather(*(watch(name) for name in names))
+    subscriber = events.broker.subscribe(keys)
+    
+    def touch():
+        for key in keys:
+            snapshots.store.touch(key)
+    
+    return StreamingResponse(
+        events.broker.stream(subscriber, touch),
+        media_type = "text/event-stream",
+        headers = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
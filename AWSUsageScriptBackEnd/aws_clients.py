@@ -0,0 +1,258 @@
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+import boto3
+import botocore.session
+from botocore.config import Config
+from botocore.credentials import DeferredRefreshableCredentials
+
+# Pooled boto3 sessions and clients for every logged in tenant.
+# Credentials are kept per account instead of in the process-wide os.environ, and each
+# (account_id, region) gets one session whose clients are reused between requests, so
+# client construction and TLS handshakes only happen on the first call.
+
+# Connections kept open per client (botocore defaults to 10)
+MAX_POOL_CONNECTIONS = int(os.environ.get("AWS_MAX_POOL_CONNECTIONS", "32"))
+# Number of (account_id, region) sessions kept before the least recently used one is evicted
+MAX_SESSIONS = int(os.environ.get("AWS_SESSION_POOL_SIZE", "64"))
+# Sessions unused for this long are evicted
+SESSION_IDLE_SECONDS = int(os.environ.get("AWS_SESSION_IDLE_SECONDS", "1800"))
+# A login validated with STS is trusted this long before its credentials are checked again
+IDENTITY_CACHE_SECONDS = int(os.environ.get("AWS_IDENTITY_CACHE_SECONDS", "43200"))
+IDENTITY_CACHE_SIZE = 1024
+
+CLIENT_CONFIG = Config(
+    max_pool_connections=MAX_POOL_CONNECTIONS,
+    # Keep idle connections alive so reused clients skip the TCP and TLS handshake
+    tcp_keepalive=True,
+    connect_timeout=int(os.environ.get("AWS_CONNECT_TIMEOUT", "5")),
+    read_timeout=int(os.environ.get("AWS_READ_TIMEOUT", "30")),
+    retries={"max_attempts": 3, "mode": "standard"},
+)
+
+class CredentialsNotFound(Exception):
+    pass
+
+# Functions called with every new client and the account it belongs to, e.g. to register botocore
+# event handlers on it. (priority, hook) pairs, lower priorities are applied first so their handlers run first.
+client_hooks = []
+
+def register_client_hook(hook, priority: int = 100):
+    client_hooks.append((priority, hook))
+    client_hooks.sort(key=lambda entry: entry[0])
+
+# Apply the hooks to a client created outside of the pool, the account is None when it is not known yet
+def instrument(client, account_id: str = None):
+    for priority, hook in client_hooks:
+        hook(client, account_id)
+
+    return client
+
+# Credentials of every account that has logged in, keyed by account id.
+# Member accounts reached through a login are keyed by (login account id, member account id):
+# two logins reaching the same account, or a login and a role into its account, never share or
+# replace each other's credentials.
+credentials_by_account = {}
+credentials_lock = threading.Lock()
+
+def register_credentials(account_id: str, access_key: str, secret_access_key: str, session_token: str = None):
+    credentials = {
+        "aws_access_key_id": access_key,
+        "aws_secret_access_key": secret_access_key,
+        "aws_session_token": session_token,
+    }
+
+    with credentials_lock:
+        previous = credentials_by_account.get(account_id)
+        credentials_by_account[account_id] = credentials
+
+    # Sessions built with replaced credentials must not be used again
+    if previous is not None and previous != credentials:
+        session_pool.evict_account(account_id)
+
+# Temporary credentials (e.g. an assumed member role) are registered as a function returning
+# botocore credential metadata, which the sessions call again whenever the credentials near expiry
+def register_credential_provider(account_id: str, refresh, source: str = None):
+    key = credentials_key(account_id, source)
+    credentials = {"refresh": refresh}
+
+    with credentials_lock:
+        previous = credentials_by_account.get(key)
+        credentials_by_account[key] = credentials
+
+    if previous is not None and previous.get("refresh") is not refresh:
+        session_pool.evict_account(key)
+
+def credentials_key(account_id: str, source: str = None):
+    return account_id if source is None else (source, account_id)
+
+def get_credentials(account_id: str, source: str = None):
+    credentials = credentials_by_account.get(credentials_key(account_id, source))
+    if credentials is None:
+        via = f" through {source}" if source is not None else ""
+        raise CredentialsNotFound(f"No AWS credentials registered for account {account_id}{via}")
+
+    return credentials
+
+class TenantSession:
+    def __init__(self, account_id: str, region: str, source: str = None):
+        self.account_id = account_id
+        self.region = region
+        credentials = get_credentials(account_id, source)
+
+        if "refresh" in credentials:
+            # The credentials are only fetched on the first call, not while the pool is locked
+            core_session = botocore.session.get_session()
+            core_session._credentials = DeferredRefreshableCredentials(
+                refresh_using=credentials["refresh"],
+                method="sts-assume-role",
+            )
+            self.session = boto3.Session(botocore_session=core_session, region_name=region)
+        else:
+            self.session = boto3.Session(region_name=region, **credentials)
+        self.clients = {}
+        # boto3 sessions are not thread safe when creating clients, the clients themselves are
+        self.lock = threading.Lock()
+        self.last_used = time.monotonic()
+
+    def client(self, service: str):
+        client = self.clients.get(service)
+        if client is None:
+            with self.lock:
+                client = self.clients.get(service)
+                if client is None:
+                    client = instrument(self.session.client(service, config=CLIENT_CONFIG), self.account_id)
+                    self.clients[service] = client
+
+        return client
+
+class SessionPool:
+    def __init__(self, max_sessions: int, idle_seconds: int):
+        self.max_sessions = max_sessions
+        self.idle_seconds = idle_seconds
+        self.sessions = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, account_id: str, region: str, source: str = None) -> TenantSession:
+        key = (credentials_key(account_id, source), region)
+        now = time.monotonic()
+
+        with self.lock:
+            entry = self.sessions.get(key)
+            if entry is not None:
+                self.sessions.move_to_end(key)
+                self.hits += 1
+            else:
+                entry = TenantSession(account_id, region, source)
+                self.sessions[key] = entry
+                self.misses += 1
+            entry.last_used = now
+
+            # The least recently used session is always first, drop it while it is over the limit or idle too long.
+            # Evicted clients are only dereferenced, a request still holding one can finish with it.
+            while self.sessions:
+                oldest = next(iter(self.sessions.values()))
+                if len(self.sessions) <= self.max_sessions and now - oldest.last_used <= self.idle_seconds:
+                    break
+                self.sessions.popitem(last=False)
+                self.evictions += 1
+
+        return entry
+
+    # Sessions of one credentials key, an account id or (login account id, member account id)
+    def evict_account(self, key):
+        with self.lock:
+            for session in [session for session in self.sessions if session[0] == key]:
+                del self.sessions[session]
+                self.evictions += 1
+
+    def clear(self):
+        with self.lock:
+            self.sessions.clear()
+
+    def stats(self):
+        return {
+            "sessions": len(self.sessions),
+            "max_sessions": self.max_sessions,
+            "max_pool_connections": MAX_POOL_CONNECTIONS,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
+
+session_pool = SessionPool(MAX_SESSIONS, SESSION_IDLE_SECONDS)
+
+# Caller identities of logins that were validated with STS.
+# Keyed by a hash of the access key and the secret together, so only the exact same credentials
+# skip STS: a wrong secret is never accepted from the cache. Only the hash is kept in memory.
+class IdentityCache:
+    def __init__(self, ttl: int, max_entries: int):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        # digest -> (monotonic time of the validation, {"Account", "Arn"})
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def digest(access_key: str, secret_key: str):
+        return hashlib.blake2b(f"{access_key}:{secret_key}".encode("utf-8"), digest_size=32).hexdigest()
+
+    def get(self, access_key: str, secret_key: str):
+        key = self.digest(access_key, secret_key)
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None or time.monotonic() - entry[0] > self.ttl:
+                self.entries.pop(key, None)
+                self.misses += 1
+                return None
+
+            self.hits += 1
+            return entry[1]
+
+    def put(self, access_key: str, secret_key: str, identity: dict):
+        with self.lock:
+            self.entries[self.digest(access_key, secret_key)] = (time.monotonic(), identity)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def stats(self):
+        return {
+            "identities": len(self.entries),
+            "hits": self.hits,
+            "misses": self.misses,
+        }
+
+identity_cache = IdentityCache(IDENTITY_CACHE_SECONDS, IDENTITY_CACHE_SIZE)
+
+# Everything a collector needs to talk to AWS on behalf of one tenant
+class AWSContext:
+    def __init__(self, account_id: str, region: str, source: str = None):
+        self.account_id = account_id
+        self.region = region
+        # Logged in account a member account is reached through, None for the login itself
+        self.source = source
+
+    def client(self, service: str, region: str = None):
+        return session_pool.get(self.account_id, region or self.region, self.source).client(service)
+
+    # The same tenant pointed at another region
+    def for_region(self, region: str):
+        return AWSContext(self.account_id, region, self.source)
+
+    # Another account reachable by this tenant, in the same region, with the credentials this login registered for it
+    def for_account(self, account_id: str):
+        if account_id == self.account_id:
+            return AWSContext(account_id, self.region, self.source)
+
+        return AWSContext(account_id, self.region, self.source or self.account_id)
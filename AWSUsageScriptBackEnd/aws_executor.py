@@ -0,0 +1,158 @@
+import asyncio
+import contextvars
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+# Bounded worker pools for the blocking boto3 calls.
+# Every AWS service gets its own pool so a slow Cost Explorer or CloudWatch call
+# can only use up the workers of its own service, and the event loop stays free for
+# every other request (including /health).
+
+# Pool size used for any service without its own entry
+DEFAULT_POOL_SIZE = int(os.environ.get("AWS_POOL_SIZE", "8"))
+
+# Pool size per service, each one can be overridden with AWS_POOL_SIZE_<SERVICE> (e.g. AWS_POOL_SIZE_CE=2)
+SERVICE_POOL_SIZES = {
+    "ec2": 8,
+    "rds": 4,
+    "s3": 8,
+    "cloudwatch": 8,
+    "lambda": 4,
+    "elb": 4,
+    # Cost Explorer is slow and charged per request, so keep only a few calls in flight
+    "ce": 2,
+    "sts": 4,
+}
+
+# Pools for work other than single AWS calls (e.g. the collector runs of the fan-out), sized by the module using them
+def define_pool(name: str, size: int):
+    SERVICE_POOL_SIZES.setdefault(name, size)
+
+def pool_size_for(service: str) -> int:
+    override = os.environ.get(f"AWS_POOL_SIZE_{service.upper()}")
+    if override:
+        return max(1, int(override))
+
+    return SERVICE_POOL_SIZES.get(service, DEFAULT_POOL_SIZE)
+
+class ServicePool:
+    def __init__(self, service: str, size: int):
+        self.service = service
+        self.size = size
+        self.executor = ThreadPoolExecutor(max_workers=size, thread_name_prefix=f"aws-{service}")
+
+        # Counters are only changed under the lock, the stats read them as they are
+        self.lock = threading.Lock()
+        self.in_flight = 0
+        self.running = 0
+        self.peak_in_flight = 0
+        self.completed = 0
+        self.failed = 0
+        # Number of calls that had to wait because every worker was busy
+        self.saturated = 0
+        self.total_wait_seconds = 0.0
+
+    def submitted(self):
+        with self.lock:
+            self.in_flight += 1
+            self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+            if self.in_flight > self.size:
+                self.saturated += 1
+
+    def started(self, waited: float):
+        with self.lock:
+            self.running += 1
+            self.total_wait_seconds += waited
+
+    def finished(self, ok: bool):
+        with self.lock:
+            self.running -= 1
+            self.in_flight -= 1
+            if ok:
+                self.completed += 1
+            else:
+                self.failed += 1
+
+    def cancelled(self):
+        # The call was cancelled before a worker picked it up
+        with self.lock:
+            self.in_flight -= 1
+
+    def stats(self):
+        finished = self.completed + self.failed
+
+        return {
+            "size": self.size,
+            "running": self.running,
+            "queued": max(0, self.in_flight - self.running),
+            "peak_in_flight": self.peak_in_flight,
+            "completed": self.completed,
+            "failed": self.failed,
+            "saturated": self.saturated,
+            "utilisation": round(self.running / self.size, 2),
+            "avg_wait_ms": round(self.total_wait_seconds / finished * 1000, 1) if finished else 0.0,
+        }
+
+pools = {}
+pools_lock = threading.Lock()
+
+def get_pool(service: str) -> ServicePool:
+    pool = pools.get(service)
+    if pool is None:
+        with pools_lock:
+            pool = pools.get(service)
+            if pool is None:
+                pool = ServicePool(service, pool_size_for(service))
+                pools[service] = pool
+
+    return pool
+
+# Start a blocking function on the pool of the given AWS service without waiting for it,
+# for background work such as cache refreshes. Returns the concurrent future.
+def submit(service: str, func, *args, **kwargs):
+    pool = get_pool(service)
+    submitted_at = time.perf_counter()
+
+    def worker():
+        pool.started(time.perf_counter() - submitted_at)
+        ok = False
+        try:
+            result = func(*args, **kwargs)
+            ok = True
+            return result
+        finally:
+            pool.finished(ok)
+
+    pool.submitted()
+    future = pool.executor.submit(worker)
+    future.add_done_callback(lambda done: done.cancelled() and pool.cancelled())
+
+    return future
+
+# Run a blocking function on the pool of the given AWS service and wait for it without blocking the event loop
+async def run(service: str, func, *args, **kwargs):
+    # Copy the caller's context so context variables set by the request are visible in the worker
+    context = contextvars.copy_context()
+    future = submit(service, context.run, func, *args, **kwargs)
+
+    return await asyncio.wrap_future(future)
+
+# Run a collector: a blocking function on the pool of the service, a coroutine function (which waits
+# on the event loop itself) directly
+async def call(service: str, func, *args, **kwargs):
+    if asyncio.iscoroutinefunction(func):
+        return await func(*args, **kwargs)
+
+    return await run(service, func, *args, **kwargs)
+
+# Saturation report for every pool that has been used so far
+def pool_stats():
+    return {service: pool.stats() for service, pool in sorted(pools.items())}
+
+def shutdown():
+    with pools_lock:
+        for pool in pools.values():
+            pool.executor.shutdown(wait=False, cancel_futures=True)
+        pools.clear()
@@ -0,0 +1,291 @@
+import threading
+from datetime import date, datetime, timedelta, timezone
+import botocore.session
+from botocore.awsrequest import AWSResponse
+
+# Synthetic stand-in for a large AWS account.
+# Every botocore client created while it is installed answers from generated resources instead
+# of AWS: a before-call handler returns the parsed response, so serialisation, signing and HTTP
+# are skipped while pagination, event hooks and the collectors run exactly as they do in production.
+# Resources are generated from their index on every call, a 20k volume account costs no memory.
+
+# Resources of the synthetic account, every size can be overridden from the command line
+DEFAULT_SIZES = {
+    "instances": 10000,
+    "volumes": 20000,
+    "buckets": 1000,
+    "functions": 5000,
+    "load_balancers": 500,
+    "addresses": 500,
+    "databases": 200,
+    # Cost groups on every day
+    "cost_groups": 40,
+}
+
+REGIONS = ["ap-southeast-2", "us-east-1", "eu-west-1"]
+LAUNCHED = datetime(2024, 1, 1, tzinfo=timezone.utc)
+INSTANCE_TYPES = ["t3.micro", "t3.large", "m6i.xlarge", "c6g.2xlarge", "r6i.4xlarge"]
+VOLUME_TYPES = ["gp3", "gp2", "io2", "st1"]
+RUNTIMES = ["python3.12", "nodejs20.x", "java21", None]
+ACCOUNT_ID = "123456789012"
+
+# (service, operation) -> (result key, input token, output token, limit key, default page size)
+PAGED = {
+    ("ec2", "DescribeInstances"): ("Reservations", "NextToken", "NextToken", "MaxResults", 1000),
+    ("ec2", "DescribeVolumes"): ("Volumes", "NextToken", "NextToken", "MaxResults", 500),
+    ("rds", "DescribeDBInstances"): ("DBInstances", "Marker", "Marker", "MaxRecords", 100),
+    ("s3", "ListBuckets"): ("Buckets", "ContinuationToken", "ContinuationToken", "MaxBuckets", 10000),
+    ("lambda", "ListFunctions"): ("Functions", "Marker", "NextMarker", "MaxItems", 50),
+    ("elb", "DescribeLoadBalancers"): ("LoadBalancerDescriptions", "Marker", "NextMarker", "PageSize", 400),
+    ("elbv2", "DescribeLoadBalancers"): ("LoadBalancers", "Marker", "NextMarker", "PageSize", 400),
+    ("cloudwatch", "ListMetrics"): ("Metrics", "NextToken", "NextToken", None, 500),
+}
+
+class FakeAWS:
+    def __init__(self, sizes: dict = None):
+        self.sizes = {**DEFAULT_SIZES, **(sizes or {})}
+        # (service, operation) -> number of calls answered
+        self.calls = {}
+        self.lock = threading.Lock()
+        self.original_create_client = None
+
+        classic = self.sizes["load_balancers"] // 5
+        self.counts = {
+            ("ec2", "DescribeInstances"): self.sizes["instances"],
+            ("ec2", "DescribeVolumes"): self.sizes["volumes"],
+            ("rds", "DescribeDBInstances"): self.sizes["databases"],
+            ("s3", "ListBuckets"): self.sizes["buckets"],
+            ("lambda", "ListFunctions"): self.sizes["functions"],
+            ("elb", "DescribeLoadBalancers"): classic,
+            ("elbv2", "DescribeLoadBalancers"): self.sizes["load_balancers"] - classic,
+        }
+        self.makers = {
+            ("ec2", "DescribeInstances"): self.instance,
+            ("ec2", "DescribeVolumes"): self.volume,
+            ("rds", "DescribeDBInstances"): self.database,
+            ("s3", "ListBuckets"): self.bucket,
+            ("lambda", "ListFunctions"): self.function,
+            ("elb", "DescribeLoadBalancers"): self.classic_load_balancer,
+            ("elbv2", "DescribeLoadBalancers"): self.load_balancer,
+        }
+
+    # Answer the calls of every client created from now on, including plain boto3.client() ones
+    def install(self):
+        fake = self
+        self.original_create_client = original = botocore.session.Session.create_client
+
+        def create_client(session, *args, **kwargs):
+            client = original(session, *args, **kwargs)
+            fake.attach(client)
+            return client
+
+        botocore.session.Session.create_client = create_client
+
+    def uninstall(self):
+        if self.original_create_client is not None:
+            botocore.session.Session.create_client = self.original_create_client
+            self.original_create_client = None
+
+    def attach(self, client):
+        service = client.meta.service_model.service_name
+        region = client.meta.region_name
+
+        def keep_params(params, context, **kwargs):
+            context["fake_params"] = dict(params)
+
+        def respond(model, context, **kwargs):
+            return AWSResponse(None, 200, {}, None), self.respond(service, region, model.name, context.get("fake_params", {}))
+
+        client.meta.events.register("before-parameter-build", keep_params)
+        # Last, so handlers of the app (metrics, limits) see the call before it is answered
+        client.meta.events.register_last("before-call", respond)
+
+    def total_calls(self):
+        with self.lock:
+            return sum(self.calls.values())
+
+    def respond(self, service: str, region: str, operation: str, params: dict):
+        key = (service, operation)
+        with self.lock:
+            self.calls[key] = self.calls.get(key, 0) + 1
+
+        if key in self.makers:
+            return self.page(key, params)
+
+        handler = getattr(self, f"{service}_{operation}", None)
+        if handler is None:
+            return {"ResponseMetadata": {"HTTPStatusCode": 200, "RetryAttempts": 0}}
+
+        return {**handler(region, params), "ResponseMetadata": {"HTTPStatusCode": 200, "RetryAttempts": 0}}
+
+    # One page of generated resources, the token is the index of the first resource of the next page
+    def page(self, key, params: dict):
+        result_key, input_token, output_token, limit_key, default_size = PAGED[key]
+        start = int(params.get(input_token) or 0)
+        size = int(params.get(limit_key) or default_size) if limit_key else default_size
+        end = min(start + size, self.counts[key])
+        items = [self.makers[key](index) for index in range(start, end)]
+
+        if key == ("ec2", "DescribeInstances"):
+            # Instances launched together share a reservation
+            items = [{"ReservationId": f"r-{index:017x}", "Instances": items[index:index + 5]} for index in range(0, len(items), 5)]
+
+        response = {result_key: items, "ResponseMetadata": {"HTTPStatusCode": 200, "RetryAttempts": 0}}
+        if end < self.counts[key]:
+            response[output_token] = str(end)
+
+        return response
+
+    def instance(self, index: int):
+        return {
+            "InstanceId": f"i-{index:017x}",
+            "InstanceType": INSTANCE_TYPES[index % len(INSTANCE_TYPES)],
+            "State": {"Code": 80, "Name": "stopped"} if index % 10 == 0 else {"Code": 16, "Name": "running"},
+            "LaunchTime": LAUNCHED + timedelta(minutes=index),
+        }
+
+    def volume(self, index: int):
+        attached = index % 2 == 0 and index // 2 < self.sizes["instances"]
+        return {
+            "VolumeId": f"vol-{index:017x}",
+            "Size": 8 + index % 500,
+            "VolumeType": VOLUME_TYPES[index % len(VOLUME_TYPES)],
+            "State": "in-use" if attached else "available",
+            "Attachments": [{"InstanceId": f"i-{index // 2:017x}", "Device": "/dev/xvda", "State": "attached"}] if attached else [],
+        }
+
+    def database(self, index: int):
+        return {
+            "DBInstanceIdentifier": f"db-{index}",
+            "Engine": "postgres" if index % 3 else "mysql",
+            "EngineVersion": "16.3",
+            "DBInstanceClass": "db.r6g.large",
+            "DBInstanceStatus": "available",
+            "AllocatedStorage": 100 + index,
+        }
+
+    def bucket(self, index: int):
+        return {
+            "Name": f"bucket-{index:06d}",
+            "CreationDate": LAUNCHED,
+            "BucketRegion": REGIONS[index % len(REGIONS)],
+        }
+
+    def function(self, index: int):
+        function = {
+            "FunctionName": f"function-{index:06d}",
+            "MemorySize": 128 * (1 + index % 8),
+            "Timeout": 3 + index % 900,
+            "LastModified": "2024-01-01T00:00:00.000+0000",
+        }
+        runtime = RUNTIMES[index % len(RUNTIMES)]
+        if runtime:
+            function["Runtime"] = runtime
+
+        return function
+
+    def classic_load_balancer(self, index: int):
+        return {
+            "LoadBalancerName": f"classic-{index:05d}",
+            "Scheme": "internet-facing" if index % 2 else "internal",
+            "Instances": [{"InstanceId": f"i-{index:017x}"}],
+        }
+
+    def load_balancer(self, index: int):
+        return {
+            "LoadBalancerName": f"lb-{index:05d}",
+            "Type": "network" if index % 4 == 0 else "application",
+            "Scheme": "internet-facing" if index % 2 else "internal",
+            "State": {"Code": "active"},
+        }
+
+    def ec2_DescribeAddresses(self, region: str, params: dict):
+        addresses = []
+        for index in range(self.sizes["addresses"]):
+            address = {"PublicIp": f"10.{index // 65536 % 256}.{index // 256 % 256}.{index % 256}", "AllocationId": f"eipalloc-{index:017x}"}
+            if index % 3:
+                address["InstanceId"] = f"i-{index:017x}"
+            addresses.append(address)
+
+        return {"Addresses": addresses}
+
+    def ec2_DescribeRegions(self, region: str, params: dict):
+        return {"Regions": [{"RegionName": name, "OptInStatus": "opt-in-not-required"} for name in REGIONS]}
+
+    # Two storage metrics for every bucket whose home region is the region of the client
+    def cloudwatch_ListMetrics(self, region: str, params: dict):
+        names = [
+            self.bucket(index)["Name"]
+            for index in range(self.sizes["buckets"])
+            if REGIONS[index % len(REGIONS)] == region
+        ]
+        metric_name = params.get("MetricName")
+        storage_type = "AllStorageTypes" if metric_name == "NumberOfObjects" else "StandardStorage"
+        start = int(params.get("NextToken") or 0)
+        end = min(start + 500, len(names))
+
+        response = {
+            "Metrics": [
+                {
+                    "Namespace": "AWS/S3",
+                    "MetricName": metric_name,
+                    "Dimensions": [{"Name": "BucketName", "Value": name}, {"Name": "StorageType", "Value": storage_type}],
+                }
+                for name in names[start:end]
+            ],
+        }
+        if end < len(names):
+            response["NextToken"] = str(end)
+
+        return response
+
+    def cloudwatch_GetMetricData(self, region: str, params: dict):
+        return {
+            "MetricDataResults": [
+                {"Id": query["Id"], "Label": query["Id"], "Timestamps": [LAUNCHED], "Values": [float(1024 ** 3 + index)], "StatusCode": "Complete"}
+                for index, query in enumerate(params.get("MetricDataQueries", []))
+            ],
+        }
+
+    def sts_GetCallerIdentity(self, region: str, params: dict):
+        return {"UserId": "AIDABENCHMARK", "Account": ACCOUNT_ID, "Arn": f"arn:aws:iam::{ACCOUNT_ID}:user/benchmark"}
+
+    def sts_AssumeRole(self, region: str, params: dict):
+        return {
+            "Credentials": {
+                "AccessKeyId": "ASIABENCHMARK0000000",
+                "SecretAccessKey": "benchmark",
+                "SessionToken": "benchmark",
+                "Expiration": datetime.now(timezone.utc) + timedelta(hours=1),
+            },
+        }
+
+    # The same costs on every day of the period for every group, keyed by the dimensions asked for
+    def ce_GetCostAndUsage(self, region: str, params: dict):
+        period = params["TimePeriod"]
+        start = date.fromisoformat(period["Start"])
+        end = date.fromisoformat(period["End"])
+        names = {
+            "SERVICE": lambda index: f"Service {index // 4}",
+            "REGION": lambda index: REGIONS[index % len(REGIONS)],
+            "USAGE_TYPE": lambda index: f"Usage-{index % 4}",
+        }
+        groups = [
+            {
+                "Keys": [names[group["Key"]](index) for group in params["GroupBy"]],
+                "Metrics": {"UnblendedCost": {"Amount": f"{1 + index * 0.25:.2f}", "Unit": "USD"}},
+            }
+            for index in range(self.sizes["cost_groups"])
+        ]
+
+        return {
+            "ResultsByTime": [
+                {
+                    "TimePeriod": {"Start": (start + timedelta(days=offset)).isoformat(), "End": (start + timedelta(days=offset + 1)).isoformat()},
+                    "Total": {},
+                    "Groups": groups,
+                    "Estimated": False,
+                }
+                for offset in range((end - start).days)
+            ],
+        }
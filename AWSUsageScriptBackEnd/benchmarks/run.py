@@ -0,0 +1,213 @@
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+try:
+    import resource
+except ImportError:
+    # Not available on Windows, peak RSS is left out there
+    resource = None
+
+# Benchmark of every endpoint against a synthetic large account, e.g. from AWSUsageScriptBackEnd:
+#   python -m benchmarks.run                          compare with benchmarks/baseline.json
+#   python -m benchmarks.run --save-baseline          record a new baseline
+#   python -m benchmarks.run --size instances=50000   scale one resource type
+# Endpoints that scan AWS are measured cold (nothing cached, every request scans the stand-in)
+# and warm (answered from the snapshots). The run fails when p95 latency, AWS calls per request
+# or peak RSS got worse than the baseline.
+
+BASELINE_PATH = os.path.join(os.path.dirname(__file__), "baseline.json")
+# p95 may grow this much over the baseline before it counts as a regression
+DEFAULT_TOLERANCE = 0.25
+# Latency differences below this are noise, whatever the ratio
+NOISE_MS = 5
+
+# (path, scans AWS): endpoints ordered from cheap to expensive so the peak RSS of each one means something
+ENDPOINTS = [
+    ("/", False),
+    ("/health", False),
+    ("/region", False),
+    ("/health/pools", False),
+    ("/metrics", False),
+    ("/eip", True),
+    ("/rds", True),
+    ("/elb", True),
+    ("/lambda", True),
+    ("/s3", True),
+    ("/ebs", True),
+    ("/ec2", True),
+    ("/costs", True),
+    ("/cost", True),
+    ("/costs/daily?group_by=service,region", True),
+    ("/inventory", True),
+    ("/diff", False),
+]
+
+def percentile(values, share: float):
+    ordered = sorted(values)
+    index = max(0, min(len(ordered) - 1, round(share * len(ordered) + 0.5) - 1))
+    return ordered[index]
+
+def peak_rss_mb():
+    if resource is None:
+        return None
+
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Kilobytes on Linux, bytes on macOS
+    return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+def parse_sizes(values):
+    sizes = {}
+    for value in values or []:
+        name, _, count = value.partition("=")
+        sizes[name.strip()] = int(count)
+
+    return sizes
+
+# Forget everything the backend caches in memory, the next request scans the stand-in again.
+# The cost ledger and the scan history on disk are kept, like after a restart.
+def reset_caches(backend):
+    backend.snapshots.store.clear()
+    backend.cost_cache.costs.invalidate()
+    backend.fanout.enabled_regions_cache.clear()
+
+def measure(client, fake, backend, path: str, headers: dict, iterations: int, cold: bool):
+    durations = []
+    calls = 0
+    status_codes = set()
+    for _ in range(iterations):
+        if cold:
+            reset_caches(backend)
+        before = fake.total_calls()
+        started = time.perf_counter()
+        response = client.get(path, headers=headers)
+        durations.append((time.perf_counter() - started) * 1000)
+        calls += fake.total_calls() - before
+        status_codes.add(response.status_code)
+
+    return {
+        "requests": iterations,
+        "status": sorted(status_codes),
+        "p50_ms": round(percentile(durations, 0.5), 2),
+        "p95_ms": round(percentile(durations, 0.95), 2),
+        "aws_calls": round(calls / iterations, 2),
+        "peak_rss_mb": peak_rss_mb(),
+    }
+
+def run(sizes: dict, iterations: int, cold_iterations: int):
+    # The backend reads its settings at import time: keep its data out of the working directory and its logs quiet.
+    # The login must not start background scans of every collector while the endpoints are measured.
+    data_dir = tempfile.mkdtemp(prefix="benchmark-data-")
+    os.environ["DATA_DIR"] = data_dir
+    os.environ["WARM_UP_ON_LOGIN"] = "false"
+    os.environ.setdefault("LOG_LEVEL", "WARNING")
+
+    from fastapi.testclient import TestClient
+    from benchmarks.fake_aws import FakeAWS
+    import app as backend
+
+    fake = FakeAWS(sizes)
+    fake.install()
+    results = {}
+    try:
+        with TestClient(backend.app) as client:
+            login = client.post("/configure", json={"access_key": "AKIABENCHMARK0000000", "secret_access_key": "benchmark"})
+            login.raise_for_status()
+            headers = {"Authorization": f"Bearer {login.json()['token']['access_token']}"}
+
+            for path, scans in ENDPOINTS:
+                if scans:
+                    results[f"GET {path} cold"] = measure(client, fake, backend, path, headers, cold_iterations, cold=True)
+                results[f"GET {path}"] = measure(client, fake, backend, path, headers, iterations, cold=False)
+    finally:
+        fake.uninstall()
+        shutil.rmtree(data_dir, ignore_errors=True)
+
+    return {
+        "sizes": fake.sizes,
+        "iterations": iterations,
+        "cold_iterations": cold_iterations,
+        "peak_rss_mb": peak_rss_mb(),
+        "endpoints": results,
+    }
+
+# Every measurement worse than the baseline, as readable lines
+def compare(report: dict, baseline: dict, tolerance: float):
+    regressions = []
+    for name, result in report["endpoints"].items():
+        before = baseline["endpoints"].get(name)
+        if before is None:
+            continue
+
+        limit = before["p95_ms"] * (1 + tolerance)
+        if result["p95_ms"] > limit and result["p95_ms"] - before["p95_ms"] > NOISE_MS:
+            regressions.append(f"{name}: p95 {result['p95_ms']} ms, baseline {before['p95_ms']} ms")
+        if result["aws_calls"] > before["aws_calls"]:
+            regressions.append(f"{name}: {result['aws_calls']} AWS calls per request, baseline {before['aws_calls']}")
+
+    if report["peak_rss_mb"] and baseline.get("peak_rss_mb") and report["peak_rss_mb"] > baseline["peak_rss_mb"] * (1 + tolerance):
+        regressions.append(f"peak RSS {report['peak_rss_mb']} MB, baseline {baseline['peak_rss_mb']} MB")
+
+    return regressions
+
+def print_report(report: dict, baseline: dict = None):
+    print(f"Synthetic account: {', '.join(f'{name}={count}' for name, count in report['sizes'].items())}")
+    print(f"{'endpoint':<52} {'p50 ms':>9} {'p95 ms':>9} {'base p95':>9} {'AWS calls':>10} {'RSS MB':>8}")
+    for name, result in report["endpoints"].items():
+        before = (baseline or {}).get("endpoints", {}).get(name, {})
+        print(
+            f"{name:<52} {result['p50_ms']:>9} {result['p95_ms']:>9} {before.get('p95_ms', '-'):>9} "
+            f"{result['aws_calls']:>10} {result['peak_rss_mb'] or '-':>8}"
+        )
+    print(f"Peak RSS: {report['peak_rss_mb'] or '-'} MB")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark every endpoint against a synthetic large AWS account")
+    parser.add_argument("--size", action="append", metavar="NAME=COUNT", help="resources of the synthetic account, e.g. instances=50000")
+    parser.add_argument("--iterations", type=int, default=30, help="requests per endpoint answered from the snapshots")
+    parser.add_argument("--cold-iterations", type=int, default=3, help="requests per endpoint with every cache cleared")
+    parser.add_argument("--baseline", default=BASELINE_PATH)
+    parser.add_argument("--save-baseline", action="store_true", help="write the results as the new baseline")
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE)
+    parser.add_argument("--output", help="also write the results as JSON to this file")
+    args = parser.parse_args(argv)
+
+    report = run(parse_sizes(args.size), args.iterations, args.cold_iterations)
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as file:
+            json.dump(report, file, indent=2)
+
+    if args.save_baseline:
+        with open(args.baseline, "w", encoding="utf-8") as file:
+            json.dump(report, file, indent=2)
+            file.write("\n")
+        print_report(report)
+        print(f"Baseline saved to {args.baseline}")
+        return 0
+
+    baseline = None
+    if os.path.exists(args.baseline):
+        with open(args.baseline, encoding="utf-8") as file:
+            baseline = json.load(file)
+    print_report(report, baseline)
+
+    if baseline is None:
+        print("No baseline to compare with, run with --save-baseline first")
+        return 0
+    if baseline["sizes"] != report["sizes"]:
+        print("The baseline was recorded with other sizes, not comparing")
+        return 0
+
+    regressions = compare(report, baseline, args.tolerance)
+    for regression in regressions:
+        print(f"REGRESSION {regression}")
+
+    return 1 if regressions else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
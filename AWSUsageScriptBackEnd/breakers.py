@@ -0,0 +1,168 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+from botocore.exceptions import ClientError
+import aws_clients
+import deadlines
+import rate_limits
+
+# Circuit breakers per (account, region, service).
+# After AWS_BREAKER_FAILURES failed attempts in a row (server errors, timeouts, connection errors)
+# the circuit opens and every call to that endpoint fails at once with a CircuitOpen client error,
+# instead of holding a worker until its timeouts and retries run out. Collectors answer it like any
+# other AWS error, so the snapshots keep serving the last good scan. Once AWS_BREAKER_OPEN_SECONDS
+# have passed a single probe is let through: its success closes the circuit, its failure opens it again.
+
+FAILURE_THRESHOLD = int(os.environ.get("AWS_BREAKER_FAILURES", "5"))
+OPEN_SECONDS = float(os.environ.get("AWS_BREAKER_OPEN_SECONDS", "30"))
+# Breakers kept before the least recently used one is dropped
+MAX_BREAKERS = 4096
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+class CircuitOpen(ClientError):
+    def __init__(self, key, operation: str, retry_in: float):
+        account_id, region, service = key
+        message = f"{service} in {region} is failing, calls are paused for {retry_in:.0f}s"
+        super().__init__({"Error": {"Code": "CircuitOpen", "Message": message}}, operation)
+
+# Outcome of one attempt: True for an answer from AWS, False for a failure of the endpoint, None when it never reached AWS
+def attempt_outcome(response=None, caught_exception=None):
+    if caught_exception is not None:
+        return None if isinstance(caught_exception, (CircuitOpen, deadlines.DeadlineExceeded)) else False
+
+    if response is None:
+        return None
+    status_code = response[1].get("ResponseMetadata", {}).get("HTTPStatusCode", 200)
+    # Throttles are answers, the rate limits slow down for them
+    if status_code >= 500 and not rate_limits.throttled(response):
+        return False
+
+    return True
+
+class Breaker:
+    def __init__(self):
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.probing = False
+        self.lock = threading.Lock()
+
+    # True when an attempt may be sent, the second value tells whether it is the probe of a half open circuit
+    def allow(self, now: float):
+        with self.lock:
+            if self.state == CLOSED:
+                return True, False
+            if self.state == OPEN and now - self.opened_at >= OPEN_SECONDS:
+                self.state = HALF_OPEN
+            if self.state == HALF_OPEN and not self.probing:
+                self.probing = True
+                return True, True
+
+            return False, False
+
+    def retry_in(self, now: float):
+        return max(0.0, OPEN_SECONDS - (now - self.opened_at))
+
+    # Returns True when this outcome opened the circuit
+    def record(self, outcome: bool, probe: bool, now: float):
+        with self.lock:
+            if probe:
+                self.probing = False
+            if outcome is None:
+                return False
+
+            if outcome:
+                # Any answer, also from a call sent before the circuit opened, shows the endpoint is back
+                self.state = CLOSED
+                self.failures = 0
+                return False
+
+            self.failures += 1
+            if (self.state == HALF_OPEN and probe) or (self.state == CLOSED and self.failures >= FAILURE_THRESHOLD):
+                self.state = OPEN
+                self.opened_at = now
+                return True
+
+            return False
+
+class CircuitBreakers:
+    def __init__(self, max_breakers: int):
+        self.max_breakers = max_breakers
+        # (account_id, region, service) -> Breaker, least recently used first
+        self.breakers = OrderedDict()
+        self.lock = threading.Lock()
+        # Key of the probe sent by the current worker thread
+        self.local = threading.local()
+        self.opened = 0
+        self.rejected = 0
+
+    def breaker(self, key) -> Breaker:
+        with self.lock:
+            breaker = self.breakers.get(key)
+            if breaker is None:
+                breaker = Breaker()
+                self.breakers[key] = breaker
+                while len(self.breakers) > self.max_breakers:
+                    self.breakers.popitem(last=False)
+            else:
+                self.breakers.move_to_end(key)
+
+            return breaker
+
+    def before_attempt(self, key, operation: str):
+        now = time.monotonic()
+        breaker = self.breaker(key)
+        allowed, probe = breaker.allow(now)
+        if probe:
+            self.local.probe = key
+        if not allowed:
+            with self.lock:
+                self.rejected += 1
+            raise CircuitOpen(key, operation, breaker.retry_in(now))
+
+    def after_attempt(self, key, response=None, caught_exception=None):
+        probe = getattr(self.local, "probe", None) == key
+        if probe:
+            self.local.probe = None
+        if self.breaker(key).record(attempt_outcome(response, caught_exception), probe, time.monotonic()):
+            with self.lock:
+                self.opened += 1
+
+    # Client hook: every attempt asks the breaker of its endpoint first and reports how it went
+    def attach(self, client, account_id: str = None):
+        key = (account_id, client.meta.region_name, client.meta.service_model.service_name)
+
+        def before_send(event_name, **kwargs):
+            self.before_attempt(key, event_name.rsplit(".", 1)[-1])
+
+        # Only observes, the retry decision is left to botocore and the rate limits
+        def needs_retry(response=None, caught_exception=None, **kwargs):
+            self.after_attempt(key, response, caught_exception)
+
+        client.meta.events.register("before-send", before_send, unique_id="breaker-before-send")
+        client.meta.events.register("needs-retry", needs_retry, unique_id="breaker-needs-retry")
+
+    def stats(self):
+        now = time.monotonic()
+        with self.lock:
+            tripped = {
+                "/".join(part or "" for part in key): {"state": breaker.state, "retry_in": round(breaker.retry_in(now), 1)}
+                for key, breaker in self.breakers.items()
+                if breaker.state != CLOSED
+            }
+
+            return {
+                "breakers": len(self.breakers),
+                "open": tripped,
+                "opened": self.opened,
+                "rejected": self.rejected,
+            }
+
+breakers = CircuitBreakers(MAX_BREAKERS)
+
+# After the deadline check and before the rate limits, so failing fast takes no token
+aws_clients.register_client_hook(breakers.attach, priority=15)
@@ -0,0 +1,176 @@
+import base64
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from datetime import datetime
+from botocore.awsrequest import AWSResponse
+import aws_clients
+import history
+
+# Record and replay of AWS responses.
+# In record mode every parsed botocore response is appended to a gzipped cassette per operation
+# under ./data/cassettes/<name>, in replay mode the calls are answered from those cassettes
+# without reaching AWS (or needing real credentials), so a recorded account can be served again
+# for demos, repeatable benchmarks and reproductions of customer-sized accounts.
+
+log = logging.getLogger(__name__)
+
+# off, record or replay
+CASSETTE_MODE = os.environ.get("AWS_CASSETTE_MODE", "off").lower()
+# Cassettes of different accounts or sizes are kept side by side under this name
+CASSETTE_NAME = os.environ.get("AWS_CASSETTE", "default")
+CASSETTE_DIR = os.path.join(os.environ.get("DATA_DIR", "data"), "cassettes")
+# Delay added to every replayed call: milliseconds, or "recorded" for the duration of the recorded call
+CASSETTE_LATENCY = os.environ.get("AWS_CASSETTE_LATENCY_MS", "0")
+
+# Parameters that change on every call (metric and cost periods relative to now), left out of the match
+VOLATILE_PARAMS = {"StartTime", "EndTime", "TimePeriod"}
+# Never written to disk, replayed as placeholders
+SECRET_KEYS = {"AccessKeyId", "SecretAccessKey", "SessionToken"}
+REDACTED = "REDACTED"
+
+# Parsed responses hold datetimes and bytes, tag them so they come back with their type
+def encode(value):
+    if isinstance(value, dict):
+        return {key: REDACTED if key in SECRET_KEYS else encode(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [encode(item) for item in value]
+    if isinstance(value, datetime):
+        return {"$datetime": value.isoformat()}
+    if isinstance(value, (bytes, bytearray)):
+        return {"$bytes": base64.b64encode(value).decode("ascii")}
+    if value is None or isinstance(value, (str, int, float, bool)):
+        return value
+
+    # Streaming bodies (e.g. GetObject) cannot be replayed
+    raise TypeError(f"Cannot record {type(value).__name__}")
+
+def decode(value):
+    if isinstance(value, dict):
+        if len(value) == 1 and "$datetime" in value:
+            return datetime.fromisoformat(value["$datetime"])
+        if len(value) == 1 and "$bytes" in value:
+            return base64.b64decode(value["$bytes"])
+        return {key: decode(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [decode(item) for item in value]
+
+    return value
+
+# Calls match on account, region and parameters, without the volatile ones
+def call_key(account_id: str, region: str, params: dict):
+    stable = {name: value for name, value in params.items() if name not in VOLATILE_PARAMS}
+    text = json.dumps([account_id or "", region or "", encode(stable)], sort_keys=True, separators=(",", ":"))
+    return hashlib.blake2b(text.encode("utf-8"), digest_size=16).hexdigest()
+
+def replay_delay(entry: dict):
+    if CASSETTE_LATENCY == "recorded":
+        return entry.get("duration_ms", 0) / 1000
+
+    return float(CASSETTE_LATENCY or 0) / 1000
+
+class Cassette:
+    def __init__(self, directory: str, mode: str):
+        self.directory = directory
+        self.mode = mode
+        # (service, operation) -> {call key: entry}, loaded on first use
+        self.operations = {}
+        self.lock = threading.Lock()
+        self.recorded = 0
+        self.replayed = 0
+        self.misses = 0
+
+    def path(self, service: str, operation: str):
+        return os.path.join(self.directory, service, f"{operation}.jsonl.gz")
+
+    def entries(self, service: str, operation: str):
+        key = (service, operation)
+        entries = self.operations.get(key)
+        if entries is None:
+            with self.lock:
+                entries = self.operations.get(key)
+                if entries is None:
+                    # A call recorded again replaces the earlier recording
+                    entries = {entry["key"]: entry for entry in history.read_lines(self.path(service, operation))}
+                    self.operations[key] = entries
+
+        return entries
+
+    def record(self, service: str, operation: str, key: str, status_code: int, parsed: dict, duration_ms: float):
+        try:
+            response = encode({name: value for name, value in parsed.items() if name != "ResponseMetadata"})
+        except TypeError as e:
+            log.warning("Cannot record AWS response", extra={"service": service, "operation": operation, "error": str(e)})
+            return
+
+        entry = {"key": key, "status": status_code, "duration_ms": duration_ms, "response": response}
+        entries = self.entries(service, operation)
+        with self.lock:
+            os.makedirs(os.path.dirname(self.path(service, operation)), exist_ok=True)
+            history.append_lines(self.path(service, operation), [entry])
+            entries[key] = entry
+            self.recorded += 1
+
+    # (http response, parsed response) of the recorded call, a CassetteMiss error when it was never recorded
+    def replay(self, service: str, operation: str, region: str, key: str):
+        entry = self.entries(service, operation).get(key)
+        if entry is None:
+            self.misses += 1
+            message = f"No recorded response for {service}.{operation} in {region}"
+            log.warning("Cassette miss", extra={"service": service, "operation": operation, "region": region})
+            return AWSResponse(None, 400, {}, None), {
+                "Error": {"Code": "CassetteMiss", "Message": message},
+                "ResponseMetadata": {"HTTPStatusCode": 400, "RetryAttempts": 0},
+            }
+
+        delay = replay_delay(entry)
+        if delay > 0:
+            # Calls run in the AWS worker threads, sleeping here is what a slow API would do
+            time.sleep(delay)
+
+        self.replayed += 1
+        parsed = decode(entry["response"])
+        parsed["ResponseMetadata"] = {"HTTPStatusCode": entry["status"], "RetryAttempts": 0}
+        return AWSResponse(None, entry["status"], {}, None), parsed
+
+    # Client hook: register the handlers of the mode on a new client
+    def attach(self, client, account_id: str = None):
+        service = client.meta.service_model.service_name
+        region = client.meta.region_name
+        events = client.meta.events
+
+        # The API parameters are only passed to this event, keep them for the handlers of the call
+        def keep_params(params, context, **kwargs):
+            context["cassette_key"] = call_key(account_id, region, params)
+            context["cassette_started"] = time.perf_counter()
+
+        def replay(model, context, **kwargs):
+            return self.replay(service, model.name, region, context["cassette_key"])
+
+        def record(model, context, http_response, parsed, **kwargs):
+            duration_ms = round((time.perf_counter() - context["cassette_started"]) * 1000, 1)
+            self.record(service, model.name, context["cassette_key"], http_response.status_code, parsed, duration_ms)
+
+        events.register("before-parameter-build", keep_params, unique_id="cassette-params")
+        if self.mode == "replay":
+            events.register("before-call", replay, unique_id="cassette-replay")
+        else:
+            events.register("after-call", record, unique_id="cassette-record")
+
+    def stats(self):
+        return {
+            "mode": self.mode,
+            "name": CASSETTE_NAME,
+            "operations": len(self.operations),
+            "recorded": self.recorded,
+            "replayed": self.replayed,
+            "misses": self.misses,
+        }
+
+cassette = Cassette(os.path.join(CASSETTE_DIR, CASSETTE_NAME), CASSETTE_MODE)
+
+if CASSETTE_MODE in ("record", "replay"):
+    aws_clients.register_client_hook(cassette.attach, priority=50)
@@ -0,0 +1,110 @@
+import copy
+import json
+import os
+import threading
+import aws_clients
+import deadlines
+
+# Single-flight coalescing of identical AWS calls.
+# While a call is in flight, every other call with the same account, region, operation and
+# parameters waits for it and gets a copy of its response instead of calling AWS again, so a
+# burst of dashboards loading at the same moment (after a deploy or when caches expire) makes
+# one upstream call per distinct query. Only read-only operations are coalesced.
+
+# Operations starting with these only read, sharing their result is safe
+READ_ONLY_PREFIXES = ("Describe", "List", "Get")
+# A follower waiting longer than this gives up on the call in flight and makes its own
+FLIGHT_WAIT_SECONDS = float(os.environ.get("AWS_COALESCE_WAIT_SECONDS", "120"))
+
+def coalescable(model):
+    # Streamed bodies (e.g. GetObject) can only be read once
+    return model.name.startswith(READ_ONLY_PREFIXES) and not model.has_streaming_output
+
+class Flight:
+    def __init__(self):
+        self.done = threading.Event()
+        # (http response, parsed response) or the exception of the call
+        self.response = None
+        self.error = None
+
+class SingleFlight:
+    def __init__(self):
+        # call key -> Flight of the call in flight
+        self.flights = {}
+        self.lock = threading.Lock()
+        self.leaders = 0
+        self.shared = 0
+
+    # Returns the shared (http response, parsed response) for a follower, None for the leader
+    def join(self, key, context: dict):
+        with self.lock:
+            flight = self.flights.get(key)
+            if flight is None:
+                self.flights[key] = Flight()
+                self.leaders += 1
+                context["flight_leader"] = key
+                return None
+            self.shared += 1
+
+        # Past the deadline of its request the follower's own attempt fails right away
+        if not flight.done.wait(deadlines.timeout(FLIGHT_WAIT_SECONDS)):
+            return None
+        # Tells the metrics this call did not reach AWS
+        context["flight_shared"] = True
+        if flight.error is not None:
+            raise flight.error
+
+        http_response, parsed = flight.response
+        return http_response, copy.deepcopy(parsed)
+
+    # Hand the result of the leader to its followers
+    def land(self, context: dict, response=None, error=None):
+        key = context.pop("flight_leader", None)
+        if key is None:
+            return
+
+        with self.lock:
+            flight = self.flights.pop(key)
+        if response is not None:
+            # The leader's caller may change its response while followers copy it
+            response = (response[0], copy.deepcopy(response[1]))
+        flight.response = response
+        flight.error = error
+        flight.done.set()
+
+    # Client hook
+    def attach(self, client, account_id: str = None):
+        service = client.meta.service_model.service_name
+        region = client.meta.region_name
+
+        def keep_key(params, model, context, **kwargs):
+            if coalescable(model):
+                context["flight_key"] = (account_id, region, service, model.name, json.dumps(params, sort_keys=True, default=str))
+
+        def before_call(context, **kwargs):
+            key = context.get("flight_key")
+            return self.join(key, context) if key is not None else None
+
+        def after_call(context, http_response, parsed, **kwargs):
+            self.land(context, response=(http_response, parsed))
+
+        def after_call_error(context, exception, **kwargs):
+            self.land(context, error=exception)
+
+        events = client.meta.events
+        events.register("before-parameter-build", keep_key, unique_id="coalescing-key")
+        events.register("before-call", before_call, unique_id="coalescing-before-call")
+        events.register("after-call", after_call, unique_id="coalescing-after-call")
+        events.register("after-call-error", after_call_error, unique_id="coalescing-after-call-error")
+
+    def stats(self):
+        return {
+            "in_flight": len(self.flights),
+            "upstream_calls": self.leaders,
+            "shared_calls": self.shared,
+        }
+
+flights = SingleFlight()
+
+# After the metrics and rate limits, before the cassettes so replayed calls are coalesced too
+aws_clients.register_client_hook(flights.attach, priority=30)
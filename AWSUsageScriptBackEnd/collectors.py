@@ -0,0 +1,666 @@
+import logging
+from datetime import datetime, timedelta, timezone
+from botocore.exceptions import ClientError
+from aws_clients import AWSContext
+import cost_cache
+import cost_ledger
+import records
+
+# Blocking collectors for each AWS service.
+# They are called through aws_executor so the boto3 calls never run on the event loop. The cost
+# collectors only read the cost cache, they are coroutines waiting for it on the event loop.
+
+log = logging.getLogger(__name__)
+
+# Month to date cost of every service from the daily cost ledger, shared by /costs and /cost
+def fetch_month_to_date_costs(aws: AWSContext, start_date: str, end_date: str):
+    rows, total_cost = cost_ledger.ledger.query(
+        aws,
+        cost_ledger.parse_date(start_date),
+        cost_ledger.parse_date(end_date),
+        ["service"],
+    )
+    
+    return {
+        "start_date": start_date,
+        "end_date": end_date,
+        # Rows are already sorted by cost (descending order)
+        "services": [(row["service"], row["cost"]) for row in rows],
+        "total_cost": total_cost,
+    }
+
+# Month to date costs from the cost cache, served stale while a refresh runs in the background.
+# Awaited on the event loop: requests waiting for the same fetch hold no worker of the Cost Explorer pool.
+async def month_to_date_costs(aws: AWSContext):
+    # Specify today, Cost Explorer days are in UTC
+    today = datetime.now(timezone.utc)
+    # Specify the start day as the first day of the month
+    start_date = today.replace(day = 1).strftime("%Y-%m-%d")
+    # Specify the end day as the tomorrow so today can be inclusive
+    end_date = (today + timedelta(days = 1)).strftime("%Y-%m-%d")
+    
+    return await cost_cache.costs.get_async(
+        (aws.account_id, "month-to-date-by-service", start_date, end_date),
+        lambda: fetch_month_to_date_costs(aws, start_date, end_date),
+    )
+
+# Get the total cost of the month
+async def collect_total_cost(aws: AWSContext):
+    try:
+        costs, cache = await month_to_date_costs(aws)
+        cost = costs['total_cost']
+        
+        log.info("Total AWS costs", extra = {"start_date": costs['start_date'], "end_date": costs['end_date'], "total_cost": round(cost, 2)})
+        
+        return {
+            "success": True,
+            "message": f"Total cost: {cost:.2f}",
+            "totalCost": cost,
+            "cache": cache,
+        }
+
+    except ClientError as e:
+        log.warning("Error getting AWS costs", extra = {"error": str(e)})
+        
+        return {
+            "success": False,
+            "message": f"Error getting cost: {e}",
+            "totalCost": 0,
+        }
+
+# GetMetricData accepts at most 500 metric queries per request
+METRIC_QUERIES_PER_REQUEST = 500
+
+# Find the home region of a bucket, its storage metrics only exist in that region
+def s3_bucket_region(s3_client, bucket):
+    # ListBuckets includes the region when it is called with MaxBuckets
+    if bucket.get('BucketRegion'):
+        return bucket['BucketRegion']
+    
+    location = s3_client.get_bucket_location(Bucket = bucket['Name']).get('LocationConstraint')
+    
+    # Buckets in us-east-1 have no location constraint and old eu-west-1 buckets still report "EU"
+    if not location:
+        return 'us-east-1'
+    if location == 'EU':
+        return 'eu-west-1'
+    return location
+
+# Get the latest size of every storage class and the object count of the given buckets in one region
+def s3_bucket_metrics(cloudwatch, bucket_names):
+    wanted = set(bucket_names)
+    metrics = []
+    
+    # Only ask for (bucket, storage class) pairs that have metrics, so no query is spent on unused storage classes
+    paginator = cloudwatch.get_paginator('list_metrics')
+    for metric_name in ('BucketSizeBytes', 'NumberOfObjects'):
+        for page in paginator.paginate(Namespace = 'AWS/S3', MetricName = metric_name):
+            for metric in page['Metrics']:
+                dimensions = {dimension['Name']: dimension['Value'] for dimension in metric['Dimensions']}
+                if dimensions.get('BucketName') in wanted:
+                    metrics.append((metric, dimensions))
+    
+    sizes = {name: {} for name in bucket_names}
+    objects = {}
+    
+    # S3 publishes storage metrics once a day, look back a few days so the latest datapoint is always included
+    end_time = datetime.now(timezone.utc)
+    start_time = end_time - timedelta(days = 3)
+    
+    for start in range(0, len(metrics), METRIC_QUERIES_PER_REQUEST):
+        chunk = metrics[start:start + METRIC_QUERIES_PER_REQUEST]
+        queries = [
+            {
+                'Id': f"m{index}",
+                'MetricStat': {
+                    'Metric': metric,
+                    # Period of 86400 secs which is 24 hours / 1 day
+                    'Period': 86400,
+                    'Stat': 'Average',
+                },
+            }
+            for index, (metric, dimensions) in enumerate(chunk)
+        ]
+        
+        pages = cloudwatch.get_paginator('get_metric_data').paginate(
+            MetricDataQueries = queries,
+            StartTime = start_time,
+            EndTime = end_time,
+            # Newest datapoints first, so the first value seen for a query is the latest one
+            ScanBy = 'TimestampDescending',
+        )
+        
+        for page in pages:
+            for result in page['MetricDataResults']:
+                if not result['Values']:
+                    continue
+                
+                metric, dimensions = chunk[int(result['Id'][1:])]
+                bucket_name = dimensions['BucketName']
+                value = result['Values'][0]
+                
+                if metric['MetricName'] == 'NumberOfObjects':
+                    objects.setdefault(bucket_name, int(value))
+                else:
+                    sizes[bucket_name].setdefault(dimensions['StorageType'], value / (1024**3))
+    
+    return sizes, objects
+
+# Yield every page of an AWS list call.
+# Operations without a botocore paginator (e.g. DescribeAddresses) return everything in one page.
+def aws_pages(client, operation: str, **kwargs):
+    if client.can_paginate(operation):
+        yield from client.get_paginator(operation).paginate(**kwargs)
+    else:
+        yield getattr(client, operation)(**kwargs)
+
+# Each *_pages generator below yields the resources of one AWS page at a time, so a caller can
+# stream them as they arrive without holding the whole fleet in memory.
+# The matching collect_* function gathers every page into the regular JSON response.
+
+# RDS instances page by page
+def rds_pages(aws: AWSContext):
+    rds_client = aws.client('rds')
+    
+    for page in aws_pages(rds_client, 'describe_db_instances'):
+        tables_data = []
+        debug = log.isEnabledFor(logging.DEBUG)
+        
+        for db in page['DBInstances']:
+            tables_info = records.DBInstance(
+                identifier = db['DBInstanceIdentifier'],
+                engine = db['Engine'],
+                db_class = db['DBInstanceClass'],
+                status = db['DBInstanceStatus'],
+                storage = db.get('AllocatedStorage', 'N/A'),
+            )
+            
+            tables_data.append(tables_info)
+            
+            if debug:
+                log.debug("DB instance", extra = {**tables_info, "engine_version": db.get('EngineVersion', 'N/A')})
+        
+        yield tables_data
+
+# Check RDS
+def collect_rds(aws: AWSContext):
+    try:
+        # Collect all of the tables datas
+        tables_data = [db for page in rds_pages(aws) for db in page]
+        
+        log.info("RDS databases", extra = {"total_count": len(tables_data)})
+            
+        return {
+            "success": True,
+            "message": f"Found {len(tables_data)} tables",
+            "rdsInstances": tables_data,
+            "total_count": len(tables_data),
+        }
+    except ClientError as err:
+        log.warning("Error checking RDS", extra = {"error": str(err)})
+        
+        return {
+            "success": False,
+            "message": f"Error getting RDS databases: {err}",
+            "rdsInstances": [],
+            "total_count": 0,
+        }
+
+# S3 buckets, one page per home region once its metrics are known
+def s3_pages(aws: AWSContext):
+    s3_client = aws.client('s3')
+    
+    # Group the buckets by their home region because their metrics live there
+    buckets_by_region = {}
+    for page in aws_pages(s3_client, 'list_buckets', PaginationConfig = {'PageSize': 1000}):
+        for bucket in page['Buckets']:
+            try:
+                region = s3_bucket_region(s3_client, bucket)
+            except ClientError as e:
+                log.warning("Error getting the region of a bucket", extra = {"bucket": bucket['Name'], "error": str(e)})
+                region = None
+            
+            buckets_by_region.setdefault(region, []).append(bucket['Name'])
+    
+    for region, bucket_names in buckets_by_region.items():
+        sizes, objects = {}, {}
+        buckets_data = []
+        debug = log.isEnabledFor(logging.DEBUG)
+        
+        if region is not None:
+            try:
+                # Get bucket sizes using CloudWatch in the buckets' region
+                sizes, objects = s3_bucket_metrics(aws.client('cloudwatch', region = region), bucket_names)
+            except ClientError as e:
+                log.warning("Error getting S3 metrics", extra = {"region": region, "error": str(e)})
+        
+        for bucket_name in bucket_names:
+            storage = sizes.get(bucket_name) or {}
+            size_gb = sum(storage.values()) if storage else None
+            
+            # Size is None when CloudWatch has no metrics for the bucket
+            if debug:
+                log.debug("S3 bucket", extra = {"bucket": bucket_name, "region": region, "size": size_gb})
+            
+            bucket_info = records.Bucket(
+                name = bucket_name,
+                region = region,
+                size = size_gb,
+                objects = objects.get(bucket_name),
+                storage = storage,
+            )
+            
+            buckets_data.append(bucket_info)
+        
+        yield buckets_data
+
+# Check S3
+def collect_s3(aws: AWSContext):
+    try:
+        # Collect all of the buckets
+        buckets_data = [bucket for page in s3_pages(aws) for bucket in page]
+        
+        log.info("S3 buckets", extra = {"total_count": len(buckets_data)})
+                
+        return {
+            "success": True,
+            "message": f"Found {len(buckets_data)} buckets",
+            "s3Buckets": buckets_data,
+            "total_count": len(buckets_data)
+        }
+        
+    except ClientError as error:
+        log.warning("Error checking S3", extra = {"error": str(error)})
+        
+        return {
+            "success": False,
+            "message": f"Error getting S3 Buckets: {error}",
+            "s3Buckets": [],
+            "total_count": 0,
+        }
+
+# Lambda functions page by page
+def lambda_pages(aws: AWSContext):
+    # Create the lambda client
+    lambda_client = aws.client('lambda')
+    
+    # List all the functions
+    for page in aws_pages(lambda_client, 'list_functions'):
+        lambda_data = []
+        debug = log.isEnabledFor(logging.DEBUG)
+        
+        # Iterate through each function in the dictionary to retrieve its metadata
+        for func in page['Functions']:
+            
+            lambda_info = records.LambdaFunction(
+                name = func['FunctionName'],
+                # Functions deployed as container images have no runtime
+                runtime = func.get('Runtime', 'N/A'),
+                memory = func['MemorySize'],
+                timeout = func['Timeout'],
+                last_modified = func['LastModified'],
+            )
+            
+            if debug:
+                log.debug("Lambda function", extra = {"function": func['FunctionName'], "runtime": lambda_info['runtime'], "memory": func['MemorySize'], "timeout": func['Timeout']})
+        
+            lambda_data.append(lambda_info)
+        
+        yield lambda_data
+
+# Check Lambda service
+def collect_lambda(aws: AWSContext):
+    try:
+        # Collect all of the lambda functions
+        lambda_data = [func for page in lambda_pages(aws) for func in page]
+        
+        log.info("Lambda functions", extra = {"total_count": len(lambda_data)})
+        
+        return {
+            "success": True,
+            "message": f"Found {len(lambda_data)} functions",
+            "lambdaFunctions": lambda_data,
+            "total_count": len(lambda_data),
+        }
+
+    except ClientError as error:
+        log.warning("Error checking Lambda", extra = {"error": str(error)})
+        
+        return {
+            "success": False,
+            "message": f"Error getting Lambda functions: {error}",
+            "lambdaFunctions": [],
+            "total_count": 0,
+        }
+
+# Classic, then modern load balancers page by page
+def load_balancer_pages(aws: AWSContext):
+    # Create the Classic Load Balancer client
+    elb_client = aws.client('elb')
+    
+    # Show Classic LBs
+    for page in aws_pages(elb_client, 'describe_load_balancers'):
+        elb_data = []
+        debug = log.isEnabledFor(logging.DEBUG)
+        
+        for lb in page['LoadBalancerDescriptions']:
+            # Scheme --> type of load balancer --> internet-facing / internal. 
+            # internet-facing load balancer --> routes requests from clients over the internet
+            # internal load balancer --> routes requests within a private network
+            if debug:
+                log.debug("Classic load balancer", extra = {"load_balancer": lb['LoadBalancerName'], "scheme": lb['Scheme'], "instances": len(lb['Instances'])})
+            
+            classic_lbs_info = records.LoadBalancer(
+                name = lb['LoadBalancerName'],
+                type = "Classic LB",
+                scheme = lb['Scheme'],
+                state = "",
+            )
+            
+            elb_data.append(classic_lbs_info)
+        
+        yield elb_data
+    
+    # Create the Modern Load Balancers (ALB/NLB)
+    elbv2_client = aws.client('elbv2')
+    
+    # Show Modern LBs
+    for page in aws_pages(elbv2_client, 'describe_load_balancers'):
+        elb_data = []
+        debug = log.isEnabledFor(logging.DEBUG)
+        
+        for lb in page['LoadBalancers']:
+            # lb['State']['Code'] --> State dictionary within each modern load balancer (lb) to retrieve the Code value --> (e.g., "active", "provisioning").
+            if debug:
+                log.debug("Load balancer", extra = {"load_balancer": lb['LoadBalancerName'], "type": lb['Type'].upper(), "state": lb['State']['Code'], "scheme": lb['Scheme']})
+            
+            modern_lbs_info = records.LoadBalancer(
+                name = lb['LoadBalancerName'],
+                type = lb['Type'].upper(),
+                scheme = lb['Scheme'],
+                state = lb['State']['Code'],
+            )
+            
+            elb_data.append(modern_lbs_info)
+        
+        yield elb_data
+
+# Check load balancers
+def collect_load_balancers(aws: AWSContext):
+    try:
+        # Collect all of the load balancers
+        elb_data = [lb for page in load_balancer_pages(aws) for lb in page]
+        
+        log.info("Load balancers", extra = {"total_count": len(elb_data)})
+        
+        return {
+            "success": True,
+            "message": f"Found {len(elb_data)} load balancers",
+            "loadBalancers": elb_data,
+            "total_count": len(elb_data),
+        }
+        
+    except ClientError as error:
+        log.warning("Error checking load balancers", extra = {"error": str(error)})
+        
+        return {
+            "success": False,
+            "message": f"Error getting Load Balancers: {error}",
+            "loadBalancers": [],
+            "total_count": 0,
+        }
+
+# EC2 instances page by page
+def ec2_pages(aws: AWSContext):
+    # Get the EC2 client
+    ec2_client = aws.client('ec2')
+    
+    for page in aws_pages(ec2_client, 'describe_instances', PaginationConfig = {'PageSize': 1000}):
+        instance_data = []
+        debug = log.isEnabledFor(logging.DEBUG)
+        
+        # Extract and log instance details
+        for reservation in page['Reservations']:
+            for instance in reservation['Instances']:
+                
+                instance_info = records.EC2Instance(
+                    instance_id = instance['InstanceId'],
+                    instance_type = instance['InstanceType'],
+                    state = instance['State']['Name'],
+                    launch_time = instance['LaunchTime'],
+                )
+                
+                instance_data.append(instance_info)
+                
+                if debug:
+                    log.debug("EC2 instance", extra = instance_info)
+        
+        yield instance_data
+
+# Check EC2
+def collect_ec2(aws: AWSContext):
+    try:
+        # Collect all the instance data
+        instance_data = [instance for page in ec2_pages(aws) for instance in page]
+        
+        log.info("EC2 instances", extra = {"total_count": len(instance_data)})
+
+        return {
+            "success": True,
+            "message": f"Found {len(instance_data)} instances",
+            "ec2Instances": instance_data,
+            "total_count": len(instance_data),
+        }
+        
+    except ClientError as e:
+        log.warning("Error checking EC2", extra = {"error": str(e)})
+        
+        return {
+            "success": False,
+            "error": f"Error checking EC2 services: {e}",
+            "ec2Instances": [],
+            "total_count": 0,
+        }
+
+# EBS volumes page by page
+def ebs_pages(aws: AWSContext):
+    # Create the ec2 client to retrieve their volumes
+    ec2_client = aws.client('ec2')
+    
+    for page in aws_pages(ec2_client, 'describe_volumes', PaginationConfig = {'PageSize': 500}):
+        ebs_data = []
+        debug = log.isEnabledFor(logging.DEBUG)
+        
+        # Interate through each volume in the dictionary to retrieve the metadata
+        for volume in page['Volumes']:
+            if debug:
+                log.debug("EBS volume", extra = {
+                    "volume": volume['VolumeId'],
+                    "size": volume['Size'],
+                    "type": volume['VolumeType'],
+                    "state": volume['State'],
+                    "instance": volume['Attachments'][0]['InstanceId'] if volume['Attachments'] else None,
+                })
+            
+            ebs_info = records.Volume(
+                id = volume['VolumeId'],
+                size = volume['Size'],
+                type = volume['VolumeType'],
+                state = volume['State'],
+                attached_to = volume['Attachments'] or "No attachment",
+            )
+            
+            ebs_data.append(ebs_info)
+        
+        yield ebs_data
+
+# Check EBS Volumes
+def collect_ebs_volumes(aws: AWSContext):
+    try:
+        # Collect all of the ebs volumes
+        ebs_data = [volume for page in ebs_pages(aws) for volume in page]
+        
+        # Keep track of the total size accross all of the volumes
+        total_size = sum(volume['size'] for volume in ebs_data)
+        
+        log.info("EBS volumes", extra = {"total_count": len(ebs_data), "total_size": total_size})
+        
+        return {
+            "success": True,
+            "message": f"Found {len(ebs_data)} volumes",
+            "ebsVolumes": ebs_data,
+            "total_count": len(ebs_data),
+            "total_size": total_size,
+        }
+        
+    except ClientError as error:
+        log.warning("Error checking EBS volumes", extra = {"error": str(error)})
+        
+        return {
+            "success": False,
+            "message": f"Error getting EBS volumes: {error}",
+            "ebsVolumes": [],
+            "total_count": 0,
+            "total_size": 0,
+        }
+
+# Elastic IPs, DescribeAddresses returns every address in a single page
+def elastic_ip_pages(aws: AWSContext):
+    ec2_client = aws.client('ec2')
+    
+    for page in aws_pages(ec2_client, 'describe_addresses'):
+        eips_data = []
+        debug = log.isEnabledFor(logging.DEBUG)
+        
+        # Interate through each ip in the dictionary to retrieve the metadata
+        for eip in page['Addresses']:
+            if debug:
+                log.debug("Elastic IP", extra = {"ip": eip['PublicIp'], "instance": eip.get('InstanceId')})
+            
+            # These lines check if an Elastic IP (EIP) is associated with an EC2 instance by looking for the 'InstanceId' key in the EIP dictionary. If it is present, it records the instance ID to which the EIP is attached. If not, it indicates that the EIP is unattached, which can incur charges. This helps in identifying and managing costs associated with unused EIPs.
+            
+            if 'InstanceId' in eip:
+                eips_info = records.ElasticIP(
+                    ip = eip['PublicIp'],
+                    attached_to = eip['InstanceId'],
+                    status = "attached",
+                )
+                
+                eips_data.append(eips_info)
+            else:
+                # Unattached addresses are incurring charges
+                eips_info = records.ElasticIP(
+                    ip = eip['PublicIp'],
+                    attached_to = None,
+                    status = "unattached",
+                )
+                
+                eips_data.append(eips_info)
+        
+        yield eips_data
+
+# Check Elastic IPs
+def collect_elastic_ips(aws: AWSContext):
+    try:
+        # Collect all of the elastic ips
+        eips_data = [eip for page in elastic_ip_pages(aws) for eip in page]
+        
+        log.info("Elastic IPs", extra = {"total_count": len(eips_data)})
+        
+        return {
+            "success": True,
+            "message": f"Found {len(eips_data)} IPs",
+            "elasticIPs": eips_data,
+            "total_count": len(eips_data),
+        }
+    except ClientError as error:
+        log.warning("Error checking Elastic IPs", extra = {"error": str(error)})
+        
+        return {
+            "success": False,
+            "message": f"Error getting Elastic IPs: {error}",
+            "elasticIPs": [],
+            "total_count": 0,
+        }
+        
+# Getting total service cost
+async def collect_service_costs(aws: AWSContext):
+    try:
+        costs, cache = await month_to_date_costs(aws)
+        
+        # Interate through each service in the service costs
+        if log.isEnabledFor(logging.DEBUG):
+            for service_name, cost in costs['services']:
+                if cost > 0.01: # Only show services with significant costs
+                    log.debug("Service cost", extra = {"service": service_name, "cost": round(cost, 2)})
+        
+        total_cost = costs['total_cost']
+        
+        log.info("Costs by service", extra = {"start_date": costs['start_date'], "end_date": costs['end_date'], "total_cost": round(total_cost, 2)})
+        
+        return {
+            "success": True,
+            "message": f"Total cost: {total_cost:.2f}",
+            "total_cost": round(total_cost, 2),
+            "cache": cache,
+        }
+        
+    except ClientError as error:
+        log.warning("Error getting service costs", extra = {"error": str(error)})
+        
+        return {
+            "success": False,
+            "message": f"Error getting service costs: {error}",
+            "total_cost": 0,
+        }
+
+# Costs of any date range from the daily cost ledger, grouped by date, service, region and/or usage type
+def collect_cost_ledger(aws: AWSContext, start_date: str, end_date: str, group_by):
+    try:
+        rows, total_cost = cost_ledger.ledger.query(
+            aws,
+            cost_ledger.parse_date(start_date),
+            cost_ledger.parse_date(end_date),
+            group_by,
+        )
+        
+        for row in rows:
+            row["cost"] = round(row["cost"], 2)
+        
+        return {
+            "success": True,
+            "message": f"Total cost from {start_date} to {end_date}: {total_cost:.2f}",
+            "start_date": start_date,
+            "end_date": end_date,
+            "group_by": group_by,
+            "costs": rows,
+            "total_cost": round(total_cost, 2),
+            "total_count": len(rows),
+        }
+        
+    except ClientError as error:
+        log.warning("Error getting cost ledger", extra = {"error": str(error)})
+        
+        return {
+            "success": False,
+            "message": f"Error getting cost ledger: {error}",
+            "costs": [],
+            "total_cost": 0,
+            "total_count": 0,
+        }
+
+# Every inventory collector with the AWS service whose worker pool it runs on,
+# its page generator, the key of its resource list in the response, the field (or fields) identifying
+# each resource and the totals that are added up when several accounts or regions are merged.
+# S3 and cost are account wide, the others are scanned once per region.
+# A classic and an application or network load balancer can have the same name, their type tells them apart.
+COLLECTORS = {
+    "ec2": {"service": "ec2", "collect": collect_ec2, "pages": ec2_pages, "items": "ec2Instances", "id": "instance_id", "regional": True, "totals": []},
+    "rds": {"service": "rds", "collect": collect_rds, "pages": rds_pages, "items": "rdsInstances", "id": "identifier", "regional": True, "totals": []},
+    "s3": {"service": "s3", "collect": collect_s3, "pages": s3_pages, "items": "s3Buckets", "id": "name", "regional": False, "totals": []},
+    "lambda": {"service": "lambda", "collect": collect_lambda, "pages": lambda_pages, "items": "lambdaFunctions", "id": "name", "regional": True, "totals": []},
+    "elb": {"service": "elb", "collect": collect_load_balancers, "pages": load_balancer_pages, "items": "loadBalancers", "id": ("type", "name"), "regional": True, "totals": []},
+    "ebs": {"service": "ec2", "collect": collect_ebs_volumes, "pages": ebs_pages, "items": "ebsVolumes", "id": "id", "regional": True, "totals": ["total_size"]},
+    "eip": {"service": "ec2", "collect": collect_elastic_ips, "pages": elastic_ip_pages, "items": "elasticIPs", "id": "ip", "regional": True, "totals": []},
+    "cost": {"service": "ce", "collect": collect_service_costs, "pages": None, "items": None, "id": None, "regional": False, "totals": ["total_cost"]},
+}
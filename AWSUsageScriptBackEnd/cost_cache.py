@@ -0,0 +1,154 @@
+import asyncio
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+import aws_executor
+import deadlines
+
+# Stale-while-revalidate cache for Cost Explorer results.
+# Every GetCostAndUsage request is charged and takes seconds while the data only changes a few
+# times a day, so results are kept per account and query. Once an entry is older than the TTL it
+# is still served while one background refresh fetches the new value.
+
+# Entries younger than this are served without touching Cost Explorer
+COST_CACHE_TTL_SECONDS = int(os.environ.get("COST_CACHE_TTL_SECONDS", "21600"))
+# Entries older than the TTL but younger than TTL + this are served stale while they refresh,
+# older ones are fetched again before answering
+COST_CACHE_MAX_STALE_SECONDS = int(os.environ.get("COST_CACHE_MAX_STALE_SECONDS", "86400"))
+COST_CACHE_MAX_ENTRIES = int(os.environ.get("COST_CACHE_MAX_ENTRIES", "1024"))
+
+class CacheEntry:
+    def __init__(self, value, fetched_at: float):
+        self.value = value
+        self.fetched_at = fetched_at
+
+class StaleWhileRevalidateCache:
+    def __init__(self, ttl: int, max_stale: int, max_entries: int, service: str = "ce"):
+        self.ttl = ttl
+        self.max_stale = max_stale
+        self.max_entries = max_entries
+        # AWS service whose worker pool runs the background refreshes
+        self.service = service
+        self.entries = OrderedDict()
+        # key -> Future of the fetch in flight, so concurrent misses share one upstream call
+        self.in_flight = {}
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        self.refreshes = 0
+        self.fetch_errors = 0
+
+    # Return (value, metadata) for the key, calling fetch() only when there is no usable entry
+    def get(self, key, fetch):
+        cached, future, leader = self.lookup(key, fetch)
+        if cached is not None:
+            return cached
+
+        if leader:
+            self.fetch_into(key, fetch, future)
+
+        return future.result(), {"age_seconds": 0, "stale": False}
+
+    # The same from the event loop. A miss is fetched on the worker pool and every caller waits for it
+    # on the loop, so callers sharing a fetch hold none of the (few) workers of the service.
+    async def get_async(self, key, fetch):
+        cached, future, leader = self.lookup(key, fetch)
+        if cached is not None:
+            return cached
+
+        if leader:
+            # The fetch gets what is left of the budget of the request
+            aws_executor.submit(self.service, self.fetch_into, key, fetch, future, deadlines.current.get())
+
+        return await asyncio.wrap_future(future), {"age_seconds": 0, "stale": False}
+
+    # ((value, metadata), None, False) when the entry can be served, else (None, future of the fetch,
+    # whether the caller has to run the fetch)
+    def lookup(self, key, fetch):
+        now = time.monotonic()
+
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                self.entries.move_to_end(key)
+                age = now - entry.fetched_at
+
+                if age < self.ttl:
+                    self.hits += 1
+                    return (entry.value, {"age_seconds": round(age), "stale": False}), None, False
+
+                if age < self.ttl + self.max_stale:
+                    self.stale_hits += 1
+                    if key not in self.in_flight:
+                        self.start_fetch(key, fetch, background=True)
+                    return (entry.value, {"age_seconds": round(age), "stale": True}), None, False
+
+            self.misses += 1
+            future = self.in_flight.get(key)
+            if future is None:
+                future = self.start_fetch(key, fetch, background=False)
+                leader = True
+            else:
+                leader = False
+
+        return None, future, leader
+
+    # Register a fetch for the key, the caller holds the lock.
+    # Background refreshes run on the worker pool, foreground ones in the calling thread.
+    def start_fetch(self, key, fetch, background: bool):
+        future = Future()
+        # A caller giving up at its deadline cancels its wait, never the shared fetch
+        future.set_running_or_notify_cancel()
+        self.in_flight[key] = future
+
+        if background:
+            self.refreshes += 1
+            aws_executor.submit(self.service, self.fetch_into, key, fetch, future)
+
+        return future
+
+    # Background refreshes run without a deadline. A fetch cut short by its deadline raises and is not cached.
+    def fetch_into(self, key, fetch, future: Future, deadline: float = None):
+        try:
+            with deadlines.bounded(deadline):
+                value = fetch()
+        except Exception as e:
+            with self.lock:
+                self.in_flight.pop(key, None)
+                self.fetch_errors += 1
+            # A failed background refresh keeps serving the stale value
+            future.set_exception(e)
+            return
+
+        with self.lock:
+            self.entries[key] = CacheEntry(value, time.monotonic())
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+            self.in_flight.pop(key, None)
+
+        future.set_result(value)
+
+    def invalidate(self, account_id: str = None):
+        with self.lock:
+            if account_id is None:
+                self.entries.clear()
+            else:
+                for key in [key for key in self.entries if key[0] == account_id]:
+                    del self.entries[key]
+
+    def stats(self):
+        return {
+            "entries": len(self.entries),
+            "hits": self.hits,
+            "stale_hits": self.stale_hits,
+            "misses": self.misses,
+            "refreshes": self.refreshes,
+            "fetch_errors": self.fetch_errors,
+        }
+
+# Cost Explorer results keyed by (account_id, query name, *query parameters)
+costs = StaleWhileRevalidateCache(COST_CACHE_TTL_SECONDS, COST_CACHE_MAX_STALE_SECONDS, COST_CACHE_MAX_ENTRIES)
@@ -0,0 +1,286 @@
+import gzip
+import json
+import os
+import threading
+import time
+from datetime import date, datetime, timedelta, timezone
+from aws_clients import AWSContext
+
+# Local daily ledger of Cost Explorer data.
+# The cost cells of every day are stored once per account and month under ./data, so only days
+# that are still open or were never fetched go to Cost Explorer and any date range is answered
+# from disk or memory.
+
+# Directory mounted by docker-compose, relative to the working directory of the app
+DATA_DIR = os.environ.get("DATA_DIR", "data")
+# Cost Explorer keeps revising a day for a while, days older than this are closed and never fetched again
+COST_LEDGER_SETTLE_DAYS = int(os.environ.get("COST_LEDGER_SETTLE_DAYS", "3"))
+# Open days are fetched again once their data is older than this
+COST_LEDGER_REFRESH_SECONDS = int(os.environ.get("COST_LEDGER_REFRESH_SECONDS", "21600"))
+
+# Fields a ledger query can group by
+DIMENSIONS = ("date", "service", "region", "usage_type")
+COST_EXPLORER_KEYS = {"service": "SERVICE", "region": "REGION", "usage_type": "USAGE_TYPE"}
+# GetCostAndUsage groups by at most two dimensions and every call is charged ($0.01), so a day is
+# kept as layers of dimension pairs, each fetched with one grouped query per period. Service x region
+# answers /costs and /cost, the usage type layers are only fetched for days a query groups by usage type.
+LAYERS = (("service", "region"), ("service", "usage_type"), ("region", "usage_type"))
+DEFAULT_LAYER = LAYERS[0]
+# Format of the month files on disk
+LEDGER_VERSION = 2
+
+class InvalidDateRange(Exception):
+    pass
+
+def parse_date(value: str):
+    try:
+        return date.fromisoformat(value)
+    except (TypeError, ValueError):
+        raise InvalidDateRange(f"Not a YYYY-MM-DD date: {value}")
+
+def utc_today():
+    return datetime.now(timezone.utc).date()
+
+# The layer holding every dimension of the query
+def layer_for(group_by):
+    dimensions = tuple(dimension for dimension in DIMENSIONS[1:] if dimension in group_by)
+    if len(dimensions) == len(COST_EXPLORER_KEYS):
+        raise InvalidDateRange("Costs can be grouped by at most two of service, region and usage_type")
+    if "usage_type" not in dimensions:
+        return DEFAULT_LAYER
+    if len(dimensions) == 1:
+        return ("service", "usage_type")
+
+    return dimensions
+
+def layer_name(layer):
+    return ",".join(layer)
+
+# Every day from start up to but not including end
+def days_between(start: date, end: date):
+    day = start
+    while day < end:
+        yield day
+        day += timedelta(days=1)
+
+# The cost cells of one account and month.
+# Service, region and usage type names repeat on every day, so they are stored once in a
+# string table and the cells only keep their index.
+class LedgerMonth:
+    def __init__(self):
+        self.strings = []
+        self.string_ids = {}
+        # "YYYY-MM-DD" -> {"service,region": {"fetched_at": epoch seconds, "closed": bool, "cells": [[service, region, amount]]}, ...}
+        self.days = {}
+
+    def intern(self, value: str):
+        string_id = self.string_ids.get(value)
+        if string_id is None:
+            string_id = len(self.strings)
+            self.strings.append(value)
+            self.string_ids[value] = string_id
+
+        return string_id
+
+    def get_day(self, day: str, layer):
+        return self.days.get(day, {}).get(layer_name(layer))
+
+    def set_day(self, day: str, layer, cells, fetched_at: float, closed: bool):
+        self.days.setdefault(day, {})[layer_name(layer)] = {
+            "fetched_at": fetched_at,
+            "closed": closed,
+            "cells": [[self.intern(first), self.intern(second), amount] for first, second, amount in cells],
+        }
+
+    def to_json(self):
+        return {"version": LEDGER_VERSION, "strings": self.strings, "days": self.days}
+
+    # A month in any other format is treated as missing and fetched again
+    @classmethod
+    def from_json(cls, data: dict):
+        month = cls()
+        if data.get("version") != LEDGER_VERSION:
+            return month
+
+        month.strings = data["strings"]
+        month.string_ids = {value: string_id for string_id, value in enumerate(month.strings)}
+        month.days = data["days"]
+
+        return month
+
+class CostLedger:
+    def __init__(self, data_dir: str, settle_days: int, refresh_seconds: int):
+        self.data_dir = data_dir
+        self.settle_days = settle_days
+        self.refresh_seconds = refresh_seconds
+        # (account_id, "YYYY-MM") -> LedgerMonth, loaded from disk on first use
+        self.months = {}
+        # Reads and writes of the months of an account, never held during a Cost Explorer call
+        self.locks = {}
+        self.locks_lock = threading.Lock()
+        self.cost_explorer_calls = 0
+        self.fetched_days = 0
+
+    def path(self, account_id: str, month_key: str):
+        return os.path.join(self.data_dir, "costs", account_id, f"{month_key}.json.gz")
+
+    def month(self, account_id: str, month_key: str) -> LedgerMonth:
+        key = (account_id, month_key)
+        month = self.months.get(key)
+        if month is None:
+            path = self.path(account_id, month_key)
+            if os.path.exists(path):
+                with gzip.open(path, "rt", encoding="utf-8") as file:
+                    month = LedgerMonth.from_json(json.load(file))
+            else:
+                month = LedgerMonth()
+            self.months[key] = month
+
+        return month
+
+    def save(self, account_id: str, month_key: str):
+        path = self.path(account_id, month_key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        # Write next to the file and rename, a crash never leaves half a ledger behind
+        temporary = f"{path}.tmp"
+        with gzip.open(temporary, "wt", encoding="utf-8") as file:
+            json.dump(self.months[(account_id, month_key)].to_json(), file, separators=(",", ":"))
+        os.replace(temporary, path)
+
+    # lock(account_id) guards the months of an account, lock(account_id, layer) is held while a layer is
+    # fetched so concurrent requests for the same days wait and find them in the ledger instead of paying again
+    def lock(self, *key):
+        with self.locks_lock:
+            return self.locks.setdefault(key, threading.RLock())
+
+    def needs_fetch(self, account_id: str, layer, day: date, today: date, now: float):
+        # Cost Explorer has nothing for days that have not started yet
+        if day > today:
+            return False
+
+        entry = self.month(account_id, day.strftime("%Y-%m")).get_day(day.isoformat(), layer)
+        if entry is None:
+            return True
+        if entry["closed"]:
+            return False
+
+        return now - entry["fetched_at"] > self.refresh_seconds
+
+    # Group the days that need fetching into runs of consecutive days, one Cost Explorer period each
+    def missing_periods(self, account_id: str, layer, start: date, end: date, today: date, now: float):
+        periods = []
+        for day in days_between(start, end):
+            if not self.needs_fetch(account_id, layer, day, today, now):
+                continue
+            if periods and periods[-1][1] == day:
+                periods[-1][1] = day + timedelta(days=1)
+            else:
+                periods.append([day, day + timedelta(days=1)])
+
+        return periods
+
+    # Cost cells of one layer for every day in the period, from one grouped (and paged) GetCostAndUsage
+    def fetch_period(self, aws: AWSContext, layer, start: date, end: date):
+        cost_client = aws.client('ce')
+        request = {
+            'TimePeriod': {
+                'Start': start.isoformat(),
+                'End': end.isoformat(),
+            },
+            'Granularity': 'DAILY',
+            'Metrics': ['UnblendedCost'],
+            'GroupBy': [{'Type': 'DIMENSION', 'Key': COST_EXPLORER_KEYS[dimension]} for dimension in layer],
+        }
+
+        # Days without any cost are stored too, otherwise they would be fetched again
+        cells = {day.isoformat(): [] for day in days_between(start, end)}
+        while True:
+            response = cost_client.get_cost_and_usage(**request)
+            self.cost_explorer_calls += 1
+
+            for result in response['ResultsByTime']:
+                day = result['TimePeriod']['Start']
+                for group in result['Groups']:
+                    amount = float(group['Metrics']['UnblendedCost']['Amount'])
+                    if amount != 0:
+                        first, second = group['Keys']
+                        cells.setdefault(day, []).append((first, second, amount))
+
+            if not response.get('NextPageToken'):
+                break
+            request['NextPageToken'] = response['NextPageToken']
+
+        return cells
+
+    # Bring one layer of the account's ledger up to date for the range, only fetching open or unknown days
+    def update(self, aws: AWSContext, start: date, end: date, layer=DEFAULT_LAYER, today: date = None):
+        today = today or utc_today()
+        closed_before = today - timedelta(days=self.settle_days)
+
+        with self.lock(aws.account_id):
+            if not self.missing_periods(aws.account_id, layer, start, end, today, time.time()):
+                return
+
+        with self.lock(aws.account_id, layer):
+            # Another request may have fetched the days while this one waited
+            with self.lock(aws.account_id):
+                now = time.time()
+                periods = self.missing_periods(aws.account_id, layer, start, end, today, now)
+
+            for period_start, period_end in periods:
+                cells = self.fetch_period(aws, layer, period_start, period_end)
+
+                with self.lock(aws.account_id):
+                    changed = set()
+                    for day, day_cells in cells.items():
+                        day_date = date.fromisoformat(day)
+                        month_key = day_date.strftime("%Y-%m")
+                        self.month(aws.account_id, month_key).set_day(day, layer, day_cells, now, day_date < closed_before)
+                        changed.add(month_key)
+                        self.fetched_days += 1
+
+                    for month_key in sorted(changed):
+                        self.save(aws.account_id, month_key)
+
+    # Sum the cells of the range by the requested dimensions, most expensive first.
+    # Returns (rows, total cost).
+    def query(self, aws: AWSContext, start: date, end: date, group_by, today: date = None):
+        if end <= start:
+            raise InvalidDateRange("The end date must be after the start date")
+        unknown = [dimension for dimension in group_by if dimension not in DIMENSIONS]
+        if unknown:
+            raise InvalidDateRange(f"Cannot group costs by: {', '.join(unknown)}")
+
+        layer = layer_for(group_by)
+        self.update(aws, start, end, layer, today)
+
+        totals = {}
+        with self.lock(aws.account_id):
+            for day in days_between(start, end):
+                month = self.month(aws.account_id, day.strftime("%Y-%m"))
+                entry = month.get_day(day.isoformat(), layer)
+                if entry is None:
+                    continue
+
+                strings = month.strings
+                for first, second, amount in entry["cells"]:
+                    fields = {"date": day.isoformat(), layer[0]: strings[first], layer[1]: strings[second]}
+                    key = tuple(fields[dimension] for dimension in group_by)
+                    totals[key] = totals.get(key, 0) + amount
+
+        rows = [
+            dict(zip(group_by, key), cost=cost)
+            for key, cost in sorted(totals.items(), key=lambda item: item[1], reverse=True)
+        ]
+
+        return rows, sum(totals.values())
+
+    def stats(self):
+        return {
+            "months_loaded": len(self.months),
+            "fetched_days": self.fetched_days,
+            "cost_explorer_calls": self.cost_explorer_calls,
+        }
+
+ledger = CostLedger(DATA_DIR, COST_LEDGER_SETTLE_DAYS, COST_LEDGER_REFRESH_SECONDS)
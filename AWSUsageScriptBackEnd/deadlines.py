@@ -0,0 +1,108 @@
+import asyncio
+import contextvars
+import os
+import time
+from contextlib import contextmanager
+import aws_clients
+
+# Time budgets of requests.
+# A request can set a budget with ?deadline_ms=1500 (or get REQUEST_DEADLINE_MS), the endpoints stop
+# waiting when it runs out and answer with what they have, marking the late services as partial.
+# The deadline is a context variable, so it follows the request into the AWS worker threads, where
+# every attempt of every AWS call checks it first: once it has passed no new page, retry or rate
+# limited call is started for the request. Shared work started for a request (a snapshot scan of a
+# scope without a snapshot or read fresh, a region discovery, a cost cache miss) gets what is left of
+# its budget too. Work cut short by the budget is not cached: the scheduler scans the scope again
+# without a budget and the next request fetches again. Background refreshes have no budget.
+
+# Budget of requests that do not set deadline_ms, 0 for none
+DEFAULT_DEADLINE_MS = int(os.environ.get("REQUEST_DEADLINE_MS", "0"))
+# Longest budget a request can ask for
+MAX_DEADLINE_MS = int(os.environ.get("MAX_REQUEST_DEADLINE_MS", "120000"))
+
+# time.monotonic() at which the budget of the current request runs out, None without a budget
+current = contextvars.ContextVar("deadline", default=None)
+# Calls refused for lack of time within bounded(), shared with the worker threads the work runs on
+refusals = contextvars.ContextVar("deadline_refusals", default=None)
+
+class DeadlineExceeded(Exception):
+    pass
+
+class InvalidDeadline(Exception):
+    pass
+
+# Budget in milliseconds from the deadline_ms query parameter, None for no budget
+def parse_budget(value: str = None):
+    if value is None or value == "":
+        return DEFAULT_DEADLINE_MS or None
+
+    try:
+        budget = int(value)
+    except ValueError:
+        raise InvalidDeadline(f"deadline_ms must be a number of milliseconds: {value}")
+    if budget <= 0:
+        raise InvalidDeadline(f"deadline_ms must be positive: {value}")
+
+    return min(budget, MAX_DEADLINE_MS)
+
+def start(budget_ms: int = None):
+    return current.set(time.monotonic() + budget_ms / 1000 if budget_ms else None)
+
+# Seconds left in the budget, None without a budget
+def remaining():
+    deadline = current.get()
+    if deadline is None:
+        return None
+
+    return max(0.0, deadline - time.monotonic())
+
+# The given wait, shortened to what is left of the budget
+def timeout(limit: float):
+    left = remaining()
+    return limit if left is None else min(limit, left)
+
+# The error of a call refused for lack of time, recorded for the work it belongs to
+def exceeded(message: str):
+    refused = refusals.get()
+    if refused is not None:
+        refused.append(message)
+
+    return DeadlineExceeded(message)
+
+def check(what: str):
+    if remaining() == 0:
+        raise exceeded(f"Deadline passed before {what}")
+
+# Run the body with the given deadline (a time.monotonic() value, None for no budget), e.g. the one of
+# the request shared work was started for. Yields the list of calls of the body refused by it.
+@contextmanager
+def bounded(deadline: float = None):
+    token = current.set(deadline)
+    refused_token = refusals.set([])
+    try:
+        yield refusals.get()
+    finally:
+        refusals.reset(refused_token)
+        current.reset(token)
+
+# Await the awaitable until the budget runs out, raising DeadlineExceeded after that.
+# The awaitable is cancelled, work shielded from cancellation (snapshot scans) goes on.
+async def within(awaitable):
+    left = remaining()
+    if left is None:
+        return await awaitable
+
+    try:
+        return await asyncio.wait_for(awaitable, left)
+    except asyncio.TimeoutError:
+        raise DeadlineExceeded("Deadline of the request passed")
+
+# Client hook: no attempt of a call (first try, retry or next page) starts after the deadline
+def attach(client, account_id: str = None):
+    def before_send(event_name, **kwargs):
+        check(event_name.rsplit(".", 1)[-1])
+
+    client.meta.events.register("before-send", before_send, unique_id="deadline-before-send")
+
+# Before the rate limits, a call with no budget left does not take a token
+aws_clients.register_client_hook(attach, priority=10)
@@ -0,0 +1,153 @@
+import json
+from datetime import date, datetime
+from decimal import Decimal
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+import records
+
+# Response encodings.
+# JSON is written by orjson, which serialises dicts, lists and datetimes natively instead of
+# walking every value through jsonable_encoder first. Clients can ask the large collector
+# endpoints for MessagePack or an Arrow IPC stream with the Accept header. All three libraries
+# are optional: without orjson the standard json module is used, MessagePack and Arrow are only
+# offered when msgpack and pyarrow are installed.
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+try:
+    import pyarrow
+    import pyarrow.ipc
+except ImportError:
+    pyarrow = None
+
+JSON = "application/json"
+MSGPACK = "application/msgpack"
+ARROW = "application/vnd.apache.arrow.stream"
+
+# Media types clients may send for each encoding
+MEDIA_TYPES = {
+    "application/json": JSON,
+    "application/msgpack": MSGPACK,
+    "application/x-msgpack": MSGPACK,
+    "application/vnd.apache.arrow.stream": ARROW,
+}
+# Library each binary encoding needs
+LIBRARIES = {MSGPACK: "msgpack", ARROW: "pyarrow"}
+
+class NotAcceptable(Exception):
+    pass
+
+def available(media_type: str):
+    if media_type == MSGPACK:
+        return msgpack is not None
+    if media_type == ARROW:
+        return pyarrow is not None
+
+    return media_type == JSON
+
+# Values the encoders do not know natively
+def plain(value):
+    if isinstance(value, records.Record):
+        return value.to_json()
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        return float(value)
+    if isinstance(value, (set, frozenset)):
+        return list(value)
+
+    raise TypeError(f"Cannot encode {type(value).__name__}")
+
+def dumps(data) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(data, default=plain, option=orjson.OPT_NON_STR_KEYS)
+
+    return json.dumps(jsonable_encoder(data), ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+# A JSON object of the fields followed by fields whose values are already encoded JSON, spliced in as
+# they are: a response made of cached encodings (the inventory) is joined instead of encoded again
+def dumps_with(fields: dict, encoded: dict) -> bytes:
+    body = dumps(fields)[:-1]
+    parts = [dumps(name) + b":" + value for name, value in encoded.items()]
+    if parts and body != b"{":
+        body += b","
+
+    return body + b",".join(parts) + b"}"
+
+def packb(data) -> bytes:
+    return msgpack.packb(data, default=plain, datetime=False)
+
+# One Arrow column, values of mixed or nested types (EBS attachments, "N/A" storage) are sent as JSON text
+def arrow_column(values):
+    kinds = {type(value) for value in values if value is not None}
+    if len(kinds) <= 1 or kinds <= {int, float}:
+        if not kinds & {dict, list, tuple}:
+            try:
+                return pyarrow.array(values)
+            except (pyarrow.ArrowException, TypeError, ValueError):
+                pass
+
+    return pyarrow.array([None if value is None else dumps(value).decode("utf-8") for value in values], pyarrow.string())
+
+# The resources as one record batch stream, everything else in the response goes into the schema metadata
+def arrow_stream(items, metadata: dict) -> bytes:
+    rows = [item.to_json() if isinstance(item, records.Record) else item for item in items]
+    names = {}
+    for row in rows:
+        names.update(dict.fromkeys(row))
+
+    table = pyarrow.table({name: arrow_column([row.get(name) for row in rows]) for name in names})
+    table = table.replace_schema_metadata({"response": dumps(metadata)})
+
+    sink = pyarrow.BufferOutputStream()
+    with pyarrow.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table)
+
+    return sink.getvalue().to_pybytes()
+
+# Pick the encoding of a response from the Accept header, in the client's order of preference.
+# Anything unknown gets JSON, a binary encoding whose library is missing is refused.
+def negotiate(accept: str = None, offered=(JSON, MSGPACK, ARROW)):
+    if not accept:
+        return JSON
+
+    ranges = []
+    for position, part in enumerate(accept.split(",")):
+        media_type, *params = [piece.strip() for piece in part.split(";")]
+        quality = 1.0
+        for param in params:
+            if param.startswith("q="):
+                try:
+                    quality = float(param[2:])
+                except ValueError:
+                    quality = 0.0
+        if quality > 0:
+            ranges.append((-quality, position, media_type.lower()))
+
+    missing = []
+    for _, _, media_type in sorted(ranges):
+        if media_type in ("*/*", "application/*"):
+            return JSON
+        encoding = MEDIA_TYPES.get(media_type)
+        if encoding in offered:
+            if available(encoding):
+                return encoding
+            missing.append(encoding)
+
+    if missing:
+        raise NotAcceptable(", ".join(f"{encoding} needs {LIBRARIES[encoding]} installed" for encoding in missing))
+
+    return JSON
+
+# Default response class of the app: the same JSON as before, written by orjson
+class FastJSONResponse(JSONResponse):
+    def render(self, content) -> bytes:
+        return dumps(content)
@@ -0,0 +1,109 @@
+import asyncio
+import os
+import encoding
+import history
+
+# Server-Sent Events push channel for snapshot changes.
+# Every background refresh that changes a snapshot is turned into one small message (only the
+# changed records) which is encoded once and handed to every subscriber of that scope, so
+# open dashboards cost one scan plus a message each instead of a polling loop each.
+
+# Messages queued for one subscriber before it is told to resync and disconnected
+EVENT_QUEUE_SIZE = int(os.environ.get("EVENT_QUEUE_SIZE", "256"))
+# Comment lines sent while nothing changes, keeps proxies from closing the connection
+EVENT_KEEPALIVE_SECONDS = float(os.environ.get("EVENT_KEEPALIVE_SECONDS", "15"))
+
+def sse_message(event: str, data: dict, event_id=None):
+    lines = [f"event: {event}"]
+    if event_id is not None:
+        lines.append(f"id: {event_id}")
+    lines.append(f"data: {encoding.dumps(data).decode('utf-8')}")
+
+    return "\n".join(lines) + "\n\n"
+
+class Subscriber:
+    def __init__(self, keys):
+        # Snapshot keys of the subscription, they all belong to the account of the subscriber's token
+        self.keys = set(keys)
+        self.queue = asyncio.Queue(maxsize=EVENT_QUEUE_SIZE)
+        self.overflowed = False
+
+    def send(self, message: str):
+        try:
+            self.queue.put_nowait(message)
+        except asyncio.QueueFull:
+            # A client this far behind has to fetch the endpoints again
+            self.overflowed = True
+
+class EventBroker:
+    def __init__(self):
+        self.subscribers = set()
+        self.published = 0
+        self.delivered = 0
+        self.dropped = 0
+
+    def subscribe(self, keys) -> Subscriber:
+        subscriber = Subscriber(keys)
+        self.subscribers.add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber: Subscriber):
+        self.subscribers.discard(subscriber)
+
+    def watching(self, key):
+        return [subscriber for subscriber in self.subscribers if key in subscriber.keys]
+
+    # Snapshot listener: publish what changed between the previous and the new snapshot of a scope
+    async def snapshot_taken(self, key, name: str, previous, snapshot):
+        subscribers = self.watching(key)
+        if not subscribers or (previous is not None and previous.etag == snapshot.etag):
+            return
+
+        store = history.store
+        data = {"service": name, "account_id": key[1], "version": snapshot.version}
+        if previous is None:
+            # The snapshot the subscribers followed was dropped (DELETE /cache) and there is nothing to
+            # compare with: they fetch this service again and stay connected
+            data["message"] = f"Fetch {name} again"
+            message = sse_message("resync", data, snapshot.version)
+        elif store.tracks(name) and snapshot.version > previous.version:
+            scope = store.scope(key)
+            delta = await asyncio.to_thread(scope.delta, previous.version, snapshot.version)
+            message = sse_message(name, {**data, **delta}, snapshot.version)
+        else:
+            # Collectors without resource ids (cost) send their new result as a whole
+            message = sse_message(name, {**data, "data": snapshot.data}, snapshot.version)
+
+        self.published += 1
+        for subscriber in subscribers:
+            subscriber.send(message)
+            if subscriber.overflowed:
+                self.dropped += 1
+            else:
+                self.delivered += 1
+
+    # Messages for one subscriber, with keep-alive comments while nothing changes.
+    # touch() is called on every keep-alive so the subscribed scopes keep being refreshed.
+    async def stream(self, subscriber: Subscriber, touch):
+        try:
+            yield sse_message("ready", {"services": sorted(key[0] for key in subscriber.keys)})
+            while not subscriber.overflowed:
+                try:
+                    yield await asyncio.wait_for(subscriber.queue.get(), EVENT_KEEPALIVE_SECONDS)
+                except asyncio.TimeoutError:
+                    touch()
+                    yield ": keep-alive\n\n"
+
+            yield sse_message("resync", {"message": "Too many changes queued, fetch the endpoints again"})
+        finally:
+            self.unsubscribe(subscriber)
+
+    def stats(self):
+        return {
+            "subscribers": len(self.subscribers),
+            "published": self.published,
+            "delivered": self.delivered,
+            "dropped": self.dropped,
+        }
+
+broker = EventBroker()
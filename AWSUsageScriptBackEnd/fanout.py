@@ -0,0 +1,239 @@
+import asyncio
+import os
+import time
+import aws_executor
+import deadlines
+import encoding
+import snapshots
+from aws_clients import AWSContext
+
+# Multi-account, multi-region fan-out for the collectors.
+# The enabled regions of an account are discovered once and cached, every (account, region) is
+# scanned in parallel and the results are merged into one response with "account_id" and
+# "region" fields on every resource.
+
+# Enabled regions are cached per account for this long
+REGION_CACHE_SECONDS = int(os.environ.get("REGION_CACHE_SECONDS", "21600"))
+# Collector runs in flight for one whole scan, for one account and for a single region of an account.
+# An account has up to ~30 enabled regions, all of them are scanned at once by default.
+SCAN_CONCURRENCY = int(os.environ.get("SCAN_CONCURRENCY", "64"))
+ACCOUNT_CONCURRENCY = int(os.environ.get("ACCOUNT_CONCURRENCY", "32"))
+REGION_CONCURRENCY = int(os.environ.get("REGION_CONCURRENCY", "4"))
+# Collector runs get worker pools of their own per service (AWS_POOL_SIZE_EC2_FANOUT, ...), sized for
+# the limits above: the service pools (8 EC2 workers, shared by the EC2, EBS and EIP collectors) would
+# otherwise cap every scan whatever its limits
+FANOUT_POOL_SIZE = int(os.environ.get("FANOUT_POOL_SIZE", str(SCAN_CONCURRENCY)))
+
+class InvalidRegions(Exception):
+    pass
+
+# account_id -> (time the regions were discovered, sorted list of region names)
+enabled_regions_cache = {}
+
+def describe_enabled_regions(aws: AWSContext):
+    # Without AllRegions only the regions enabled for the account are returned
+    response = aws.client('ec2').describe_regions()
+    return sorted(region['RegionName'] for region in response['Regions'])
+
+async def enabled_regions(aws: AWSContext):
+    cached = enabled_regions_cache.get(aws.account_id)
+    if cached is not None and time.monotonic() - cached[0] < REGION_CACHE_SECONDS:
+        return cached[1]
+
+    # Runs within the budget of the request, a discovery cut short raises and is not cached
+    regions = await aws_executor.run("ec2", describe_enabled_regions, aws)
+    enabled_regions_cache[aws.account_id] = (time.monotonic(), regions)
+
+    return regions
+
+# Turn the "regions" query parameter into a list of region names.
+# Nothing means the region of the token, "all" means every enabled region.
+async def resolve_regions(aws: AWSContext, regions: str = None):
+    if not regions:
+        return [aws.region]
+
+    requested = [region.strip() for region in regions.split(",") if region.strip()]
+    if requested == ["all"]:
+        return await enabled_regions(aws)
+
+    available = await enabled_regions(aws)
+    unknown = [region for region in requested if region not in available]
+    if unknown:
+        raise InvalidRegions(f"Regions not enabled for this account: {', '.join(unknown)}")
+
+    # Keep the order but drop duplicates
+    return list(dict.fromkeys(requested))
+
+# Every (account, region) context one collector has to scan.
+# Account wide collectors (S3, cost) run once per account in the account's default region.
+async def resolve_targets(spec: dict, account_contexts, regions: str = None):
+    if not spec["regional"]:
+        return list(account_contexts)
+
+    region_lists = await asyncio.gather(*(resolve_regions(aws, regions) for aws in account_contexts))
+
+    return [
+        aws.for_region(region)
+        for aws, account_regions in zip(account_contexts, region_lists)
+        for region in account_regions
+    ]
+
+# Caps shared by every collector run of one scan: the whole scan, each account and each region of an account
+class ScanLimits:
+    def __init__(self):
+        self.scan = asyncio.Semaphore(SCAN_CONCURRENCY)
+        self.accounts = {}
+        self.regions = {}
+
+    def account(self, account_id: str):
+        if account_id not in self.accounts:
+            self.accounts[account_id] = asyncio.Semaphore(ACCOUNT_CONCURRENCY)
+        return self.accounts[account_id]
+
+    def region(self, account_id: str, region: str):
+        key = (account_id, region)
+        if key not in self.regions:
+            self.regions[key] = asyncio.Semaphore(REGION_CONCURRENCY)
+        return self.regions[key]
+
+    def target(self, aws: AWSContext):
+        return (self.scan, self.account(aws.account_id), self.region(aws.account_id, aws.region))
+
+def pool(spec: dict):
+    name = f"{spec['service']}_fanout"
+    aws_executor.define_pool(name, FANOUT_POOL_SIZE)
+    return name
+
+async def run_target(spec: dict, aws: AWSContext, limits: ScanLimits):
+    scan, account, region = limits.target(aws)
+    async with scan, account, region:
+        return await aws_executor.call(pool(spec), spec["collect"], aws)
+
+# Merge the result of every (account, region) into one response of the same shape as a single one
+def merge_results(spec: dict, targets, results):
+    items_key = spec["items"]
+    items = []
+    totals = {key: 0 for key in spec["totals"]}
+    regions = {}
+    accounts = {}
+    errors = {}
+
+    for aws, result in zip(targets, results):
+        region = regions.setdefault(aws.region, {"success": True, "total_count": 0})
+        account = accounts.setdefault(aws.account_id, {"success": True, "total_count": 0})
+
+        if isinstance(result, Exception) or not snapshots.succeeded(result):
+            if isinstance(result, Exception):
+                message = f"Error scanning {aws.account_id} in {aws.region}: {result}"
+            else:
+                message = result.get("message", result.get("error"))
+            errors[f"{aws.account_id}/{aws.region}"] = message
+            region["success"] = account["success"] = False
+            continue
+
+        count = 0
+        if items_key:
+            for item in result[items_key]:
+                item["account_id"] = aws.account_id
+                # Account wide collectors (S3) already know the region of each resource
+                if spec["regional"]:
+                    item["region"] = aws.region
+                items.append(item)
+            count = len(result[items_key])
+        for key in totals:
+            totals[key] += result.get(key, 0)
+
+        region["total_count"] += count
+        account["total_count"] += count
+
+    failed = len(errors)
+    merged = {
+        # One unreachable account or region should not hide the resources of the others
+        "success": failed < len(targets),
+        "message": f"Scanned {len(targets) - failed} of {len(targets)} account regions, found {len(items)} resources",
+    }
+    if items_key:
+        merged[items_key] = items
+        merged["total_count"] = len(items)
+    for key, value in totals.items():
+        merged[key] = round(value, 2) if isinstance(value, float) else value
+
+    merged.update({
+        "regions": regions,
+        "failed_regions": [name for name, region in regions.items() if not region["success"]],
+        "accounts": accounts,
+        "failed_accounts": [name for name, account in accounts.items() if not account["success"]],
+        "errors": errors,
+    })
+
+    return merged
+
+# Run one collector on every target at the same time
+async def scan_targets(spec: dict, targets, limits: ScanLimits = None):
+    limits = limits or ScanLimits()
+    results = await asyncio.gather(
+        *(run_target(spec, aws, limits) for aws in targets),
+        return_exceptions=True,
+    )
+
+    return merge_results(spec, targets, results)
+
+def ndjson_line(data: dict):
+    return encoding.dumps(data) + b"\n"
+
+# Stream the pages of one collector from every target as they arrive.
+# The queue is bounded so a slow client holds back the scan instead of filling memory.
+async def stream_targets(spec: dict, targets):
+    limits = ScanLimits()
+    queue = asyncio.Queue(maxsize=len(targets) * 2)
+    regions = {}
+    accounts = {}
+    errors = {}
+
+    async def pump(aws: AWSContext):
+        iterator = spec["pages"](aws)
+        regions.setdefault(aws.region, 0)
+        accounts.setdefault(aws.account_id, 0)
+        try:
+            while True:
+                scan, account, region = limits.target(aws)
+                async with scan, account, region:
+                    page = await aws_executor.run(pool(spec), next, iterator, None)
+                if page is None:
+                    break
+
+                regions[aws.region] += len(page)
+                accounts[aws.account_id] += len(page)
+                for record in page:
+                    record["account_id"] = aws.account_id
+                    if spec["regional"]:
+                        record["region"] = aws.region
+                await queue.put(b"".join(ndjson_line({"type": "resource", "data": record}) for record in page))
+
+        except Exception as error:
+            errors[f"{aws.account_id}/{aws.region}"] = f"Error scanning {aws.account_id} in {aws.region}: {error}"
+
+        # Not put when the pump is cancelled: the consumer is gone and a full queue would never drain
+        await queue.put(None)
+
+    tasks = [asyncio.ensure_future(pump(aws)) for aws in targets]
+    try:
+        remaining = len(tasks)
+        while remaining:
+            chunk = await queue.get()
+            if chunk is None:
+                remaining -= 1
+            else:
+                yield chunk
+
+        yield ndjson_line({
+            "type": "summary",
+            "success": len(errors) < len(targets),
+            "total_count": sum(accounts.values()),
+            "regions": regions,
+            "accounts": accounts,
+            "errors": errors,
+        })
+    finally:
+        for task in tasks:
+            task.cancel()
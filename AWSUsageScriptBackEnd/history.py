@@ -0,0 +1,300 @@
+import gzip
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timezone
+import collectors
+import records
+
+# Append-only history of every collector scan under ./data.
+# Each resource record is stored once under the hash of its content, a scan only stores which
+# resources were added, changed (their new hash) or removed since the scan before it. Diffs
+# between two scans replay these small deltas in memory instead of scanning AWS again, starting
+# from the nearest checkpoint (the state of every resource, kept every few scans). A scope is only
+# read from disk when it is first used and is dropped from memory again once nobody uses it.
+
+# Directory mounted by docker-compose, relative to the working directory of the app
+DATA_DIR = os.environ.get("DATA_DIR", "data")
+# Scopes kept in memory, the one used least recently is dropped first and read from disk again when needed
+HISTORY_MAX_SCOPES = int(os.environ.get("HISTORY_MAX_SCOPES", "64"))
+# Scopes unused for this long are dropped from memory
+HISTORY_IDLE_SECONDS = int(os.environ.get("HISTORY_IDLE_SECONDS", "1800"))
+# The state of every resource is kept every this many scans, diffs replay the scans after the nearest one
+HISTORY_CHECKPOINT_SCANS = int(os.environ.get("HISTORY_CHECKPOINT_SCANS", "100"))
+
+class InvalidVersion(Exception):
+    pass
+
+def canonical(record: dict):
+    return json.dumps(record, sort_keys=True, separators=(",", ":"), default=records.json_default)
+
+def record_hash(record: dict):
+    return hashlib.blake2b(canonical(record).encode("utf-8"), digest_size=16).hexdigest()
+
+# Resources are identified within their account and region, the same bucket or function name can exist in several.
+# A tuple of fields identifies resources whose names are only unique within their kind (load balancers).
+def resource_id(record: dict, id_field):
+    if isinstance(id_field, tuple):
+        name = "/".join(str(record[field]) for field in id_field)
+    else:
+        name = record[id_field]
+
+    return f"{record.get('account_id', '')}/{record.get('region', '')}/{name}"
+
+# Read a gzipped JSON lines file made of appended gzip members.
+# A crash while appending can leave the last member cut off, everything before it is kept
+# and the file is rewritten without the broken tail.
+def read_lines(path: str):
+    if not os.path.exists(path):
+        return []
+
+    lines = []
+    try:
+        with gzip.open(path, "rt", encoding="utf-8") as file:
+            for line in file:
+                lines.append(json.loads(line))
+    except (EOFError, gzip.BadGzipFile, json.JSONDecodeError):
+        temporary = f"{path}.tmp"
+        with gzip.open(temporary, "wt", encoding="utf-8") as file:
+            file.writelines(json.dumps(line, separators=(",", ":"), default=str) + "\n" for line in lines)
+        os.replace(temporary, path)
+
+    return lines
+
+def append_lines(path: str, lines):
+    if not lines:
+        return
+
+    # Every append adds a new gzip member, concatenated members read back as one file
+    with gzip.open(path, "at", encoding="utf-8") as file:
+        file.writelines(json.dumps(line, separators=(",", ":"), default=str) + "\n" for line in lines)
+
+# Every scan of one scope (collector, login, accounts and regions)
+class ScopeHistory:
+    def __init__(self, directory: str):
+        self.directory = directory
+        self.objects_path = os.path.join(directory, "objects.jsonl.gz")
+        self.scans_path = os.path.join(directory, "scans.jsonl.gz")
+        # content hash -> resource record
+        self.objects = {}
+        # {"version", "taken_at", "upserts": {resource id: hash}, "deletes": [resource id]} in version order
+        self.scans = []
+        # resource id -> hash of the latest scan
+        self.current = {}
+        # version -> resource id -> hash, every HISTORY_CHECKPOINT_SCANS versions
+        self.checkpoints = {0: {}}
+        self.loaded = False
+        self.last_used = time.monotonic()
+        # Reentrant, the methods holding it read the latest version too
+        self.lock = threading.RLock()
+
+    # Read the scope from disk on its first use
+    def load(self):
+        with self.lock:
+            if self.loaded:
+                return
+
+            for content_hash, record in read_lines(self.objects_path):
+                self.objects[content_hash] = record
+            for scan in read_lines(self.scans_path):
+                self.apply(self.current, scan)
+                self.scans.append(scan)
+                self.checkpoint()
+            self.loaded = True
+
+    def checkpoint(self):
+        version = self.scans[-1]["version"]
+        if version % HISTORY_CHECKPOINT_SCANS == 0:
+            self.checkpoints[version] = dict(self.current)
+
+    @staticmethod
+    def apply(state: dict, scan: dict):
+        state.update(scan["upserts"])
+        for rid in scan["deletes"]:
+            state.pop(rid, None)
+
+    def latest_version(self):
+        self.load()
+        return self.scans[-1]["version"] if self.scans else 0
+
+    # Store a scan and return its version
+    def append(self, records, id_field: str, taken_at: float):
+        with self.lock:
+            self.load()
+            state = {}
+            new_objects = []
+            for record in records:
+                content_hash = record_hash(record)
+                state[resource_id(record, id_field)] = content_hash
+                if content_hash not in self.objects:
+                    self.objects[content_hash] = json.loads(canonical(record))
+                    new_objects.append([content_hash, self.objects[content_hash]])
+
+            scan = {
+                "version": self.latest_version() + 1,
+                "taken_at": taken_at,
+                "upserts": {rid: content_hash for rid, content_hash in state.items() if self.current.get(rid) != content_hash},
+                "deletes": [rid for rid in self.current if rid not in state],
+            }
+
+            os.makedirs(self.directory, exist_ok=True)
+            # Objects go first, a scan on disk never points at a record that is not there
+            append_lines(self.objects_path, new_objects)
+            append_lines(self.scans_path, [scan])
+
+            self.scans.append(scan)
+            self.current = state
+            self.checkpoint()
+
+            return scan["version"]
+
+    # Version of the last scan taken at or before the time, the first scan when there is none
+    def version_at(self, moment: datetime):
+        self.load()
+        if not self.scans:
+            raise InvalidVersion("No scans recorded yet")
+
+        timestamp = moment.timestamp()
+        version = self.scans[0]["version"]
+        for scan in self.scans:
+            if scan["taken_at"] > timestamp:
+                break
+            version = scan["version"]
+
+        return version
+
+    # Turn a from/to parameter (a version number or an ISO 8601 time) into a version
+    def resolve(self, value: str = None):
+        if value is None or value == "latest":
+            return self.latest_version()
+        if value.isdigit():
+            version = int(value)
+            if not 0 <= version <= self.latest_version():
+                raise InvalidVersion(f"Unknown version: {value}")
+            return version
+
+        try:
+            moment = datetime.fromisoformat(value)
+        except ValueError:
+            raise InvalidVersion(f"Not a version or ISO 8601 time: {value}")
+        if moment.tzinfo is None:
+            moment = moment.replace(tzinfo=timezone.utc)
+
+        return self.version_at(moment)
+
+    # (resource id, hash at from_version, hash at to_version) of every resource that differs, None when missing
+    def differences(self, from_version: int, to_version: int):
+        with self.lock:
+            if not 0 <= from_version <= to_version <= self.latest_version():
+                raise InvalidVersion(f"Cannot compare version {from_version} with {to_version}")
+
+            # Replay from the nearest checkpoint instead of the first scan
+            start = max(version for version in self.checkpoints if version <= from_version)
+            before = dict(self.checkpoints[start])
+            for scan in self.scans[start:from_version]:
+                self.apply(before, scan)
+
+            # Only resources touched between the two versions can differ
+            after = {}
+            for scan in self.scans[from_version:to_version]:
+                after.update(scan["upserts"])
+                for rid in scan["deletes"]:
+                    after[rid] = None
+
+            return [
+                (rid, before.get(rid), content_hash)
+                for rid, content_hash in after.items()
+                if before.get(rid) != content_hash
+            ]
+
+    def diff(self, from_version: int, to_version: int):
+        added, removed, changed = [], [], []
+        for rid, old_hash, content_hash in self.differences(from_version, to_version):
+            if old_hash is None:
+                added.append(self.objects[content_hash])
+            elif content_hash is None:
+                removed.append(self.objects[old_hash])
+            else:
+                old, new = self.objects[old_hash], self.objects[content_hash]
+                changed.append({
+                    "id": rid,
+                    "fields": sorted(field for field in old.keys() | new.keys() if old.get(field) != new.get(field)),
+                    "before": old,
+                    "after": new,
+                })
+
+        return {"added": added, "removed": removed, "changed": changed}
+
+    # What a client holding from_version needs to reach to_version: the new or changed records and the removed ids
+    def delta(self, from_version: int, to_version: int):
+        self.load()
+        # Consecutive versions are exactly what the later scan stored
+        if 0 <= from_version and to_version == from_version + 1 <= self.latest_version():
+            scan = self.scans[from_version]
+            return {"upserts": [self.objects[content_hash] for content_hash in scan["upserts"].values()], "deletes": list(scan["deletes"])}
+
+        upserts, deletes = [], []
+        for rid, old_hash, content_hash in self.differences(from_version, to_version):
+            if content_hash is None:
+                deletes.append(rid)
+            else:
+                upserts.append(self.objects[content_hash])
+
+        return {"upserts": upserts, "deletes": deletes}
+
+class HistoryStore:
+    def __init__(self, data_dir: str, max_scopes: int = HISTORY_MAX_SCOPES, idle_seconds: int = HISTORY_IDLE_SECONDS):
+        self.data_dir = data_dir
+        self.max_scopes = max_scopes
+        self.idle_seconds = idle_seconds
+        # scope key -> ScopeHistory, least recently used first
+        self.scopes = OrderedDict()
+        self.lock = threading.Lock()
+        self.evictions = 0
+
+    def directory(self, key):
+        digest = hashlib.sha1(json.dumps(list(key)).encode("utf-8")).hexdigest()[:16]
+        return os.path.join(self.data_dir, "history", key[1], f"{key[0]}-{digest}")
+
+    def scope(self, key) -> ScopeHistory:
+        now = time.monotonic()
+        with self.lock:
+            scope = self.scopes.get(key)
+            if scope is None:
+                scope = ScopeHistory(self.directory(key))
+                self.scopes[key] = scope
+            else:
+                self.scopes.move_to_end(key)
+            scope.last_used = now
+
+            # Everything is on disk, a dropped scope is only read again. A caller still holding it can finish with it.
+            while self.scopes:
+                oldest = next(iter(self.scopes.values()))
+                if len(self.scopes) <= self.max_scopes and now - oldest.last_used <= self.idle_seconds:
+                    break
+                self.scopes.popitem(last=False)
+                self.evictions += 1
+
+            return scope
+
+    # Collectors whose resources can be told apart are recorded
+    def tracks(self, name: str):
+        spec = collectors.COLLECTORS.get(name)
+        return spec is not None and spec.get("id") is not None
+
+    # Record a scan of the scope and return its version, None when the result has no resources to record
+    def append(self, key, name: str, data: dict, taken_at: float):
+        spec = collectors.COLLECTORS[name]
+        records = data.get(spec["items"])
+        if records is None:
+            return None
+
+        return self.scope(key).append(records, spec["id"], taken_at)
+
+    def latest_version(self, key):
+        return self.scope(key).latest_version()
+
+store = HistoryStore(DATA_DIR)
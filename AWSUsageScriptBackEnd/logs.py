@@ -0,0 +1,131 @@
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import re
+import sys
+import time
+
+# Structured logging written in the background.
+# Records are filtered (level, sampling) and put on a queue by the request threads, a
+# QueueListener thread redacts and formats them as JSON lines and writes them to stdout. Debug
+# events of the collectors are dropped by the level check before anything is formatted.
+
+# DEBUG, INFO, WARNING, ERROR
+LOG_LEVEL = os.environ.get("LOG_LEVEL", "INFO").upper()
+# Share of DEBUG and INFO records kept, warnings and errors are always kept
+LOG_SAMPLE_RATE = float(os.environ.get("LOG_SAMPLE_RATE", "1.0"))
+# Records waiting for the writer thread before new ones are dropped instead of blocking a request
+LOG_QUEUE_SIZE = int(os.environ.get("LOG_QUEUE_SIZE", "10000"))
+
+REDACTED = "[REDACTED]"
+# Field names whose values are never written
+SECRET_FIELDS = re.compile(r"authorization|token|secret|password|cookie|credential|access_key|session", re.IGNORECASE)
+# Secrets inside free text: bearer tokens, JWTs and AWS access key ids
+SECRET_VALUES = re.compile(
+    r"(Bearer\s+)[\w\-.~+/]+=*"
+    r"|eyJ[\w-]+\.[\w-]+\.[\w-]+"
+    r"|\b(?:AKIA|ASIA)[A-Z0-9]{16}\b"
+)
+
+# Attributes every LogRecord has, anything else was passed with extra= and is written as a field
+RECORD_ATTRIBUTES = set(vars(logging.LogRecord("", 0, "", 0, "", None, None))) | {"message", "asctime", "taskName"}
+
+def redact_text(text: str):
+    return SECRET_VALUES.sub(lambda match: (match.group(1) or "") + REDACTED, text)
+
+def redact(value, name: str = ""):
+    if name and SECRET_FIELDS.search(name):
+        return REDACTED
+    if isinstance(value, dict):
+        return {key: redact(item, str(key)) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [redact(item) for item in value]
+    if isinstance(value, str):
+        return redact_text(value)
+
+    return value
+
+class SamplingFilter(logging.Filter):
+    def __init__(self, rate: float):
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record: logging.LogRecord):
+        return record.levelno >= logging.WARNING or self.rate >= 1 or random.random() < self.rate
+
+class RedactingQueueHandler(logging.handlers.QueueHandler):
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    # Runs in the calling thread: only render what could change before the writer thread gets to it
+    def prepare(self, record: logging.LogRecord):
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+class JSONFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord):
+        entry = {
+            "ts": time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(record.created)) + f".{int(record.msecs):03d}Z",
+            "level": record.levelname,
+            "logger": record.name,
+            "event": redact_text(str(record.msg)),
+        }
+        for name in set(vars(record)) - RECORD_ATTRIBUTES:
+            entry[name] = redact(getattr(record, name), name)
+        if record.exc_text:
+            entry["exception"] = redact_text(record.exc_text)
+
+        return json.dumps(entry, default=str)
+
+log_queue = queue.Queue(maxsize=LOG_QUEUE_SIZE)
+queue_handler = RedactingQueueHandler(log_queue)
+queue_handler.addFilter(SamplingFilter(LOG_SAMPLE_RATE))
+listener = None
+
+# Route every logger of the app through the queue, called once when the app starts
+def setup():
+    global listener
+    if listener is not None:
+        return
+
+    root = logging.getLogger()
+    root.setLevel(LOG_LEVEL)
+    root.addHandler(queue_handler)
+
+    stream = logging.StreamHandler(sys.stdout)
+    stream.setFormatter(JSONFormatter())
+    listener = logging.handlers.QueueListener(log_queue, stream, respect_handler_level=True)
+    listener.start()
+
+# Write out what is still queued and stop the writer thread
+def shutdown():
+    global listener
+    if listener is None:
+        return
+
+    listener.stop()
+    logging.getLogger().removeHandler(queue_handler)
+    listener = None
+
+def stats():
+    return {
+        "level": logging.getLevelName(logging.getLogger().level),
+        "sample_rate": LOG_SAMPLE_RATE,
+        "queued": log_queue.qsize(),
+        "dropped": queue_handler.dropped,
+    }
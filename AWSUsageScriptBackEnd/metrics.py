@@ -0,0 +1,288 @@
+import bisect
+import threading
+import time
+import aws_clients
+import aws_executor
+import breakers
+import coalescing
+import cost_cache
+import rate_limits
+import snapshots
+
+# Prometheus metrics without extra dependencies.
+# Every thread counts into its own shard, so recording a value never waits for a lock and two
+# threads never write the same dict. The shards are only added up when /metrics is scraped.
+
+# Upper bounds in seconds, from a cached response up to a slow Cost Explorer call
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+def escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def label_text(names, values, extra: str = ""):
+    pairs = [f'{name}="{escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+class Metric:
+    kind = "untyped"
+
+    def __init__(self, name: str, help_text: str, labels=()):
+        self.name = name
+        self.help_text = help_text
+        self.labels = tuple(labels)
+        self.local = threading.local()
+        self.shards = []
+        self.shards_lock = threading.Lock()
+
+    # The dict of the calling thread, created once per thread
+    def shard(self):
+        values = getattr(self.local, "values", None)
+        if values is None:
+            values = {}
+            self.local.values = values
+            with self.shards_lock:
+                self.shards.append(values)
+
+        return values
+
+    def snapshot(self):
+        with self.shards_lock:
+            shards = list(self.shards)
+
+        # dict.copy() is atomic, a writer on another thread cannot change a shard while it is copied
+        return [shard.copy() for shard in shards]
+
+    def header(self):
+        return [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} {self.kind}"]
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, *labels, amount: float = 1):
+        values = self.shard()
+        values[labels] = values.get(labels, 0) + amount
+
+    def totals(self):
+        totals = {}
+        for shard in self.snapshot():
+            for labels, value in shard.items():
+                totals[labels] = totals.get(labels, 0) + value
+
+        return totals
+
+    def render(self):
+        lines = self.header()
+        for labels, value in sorted(self.totals().items()):
+            lines.append(f"{self.name}{label_text(self.labels, labels)} {value}")
+
+        return lines
+
+# Up and down counts are added per thread as well, the gauge is the sum of every shard
+class Gauge(Counter):
+    kind = "gauge"
+
+    def dec(self, *labels, amount: float = 1):
+        self.inc(*labels, amount=-amount)
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help_text: str, labels=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, help_text, labels)
+        self.buckets = tuple(buckets)
+
+    def observe(self, seconds: float, *labels):
+        values = self.shard()
+        entry = values.get(labels)
+        if entry is None:
+            # One count per bucket plus +Inf, then the sum
+            entry = [0] * (len(self.buckets) + 1) + [0.0]
+            values[labels] = entry
+
+        entry[bisect.bisect_left(self.buckets, seconds)] += 1
+        entry[-1] += seconds
+
+    def render(self):
+        totals = {}
+        for shard in self.snapshot():
+            for labels, entry in shard.items():
+                total = totals.setdefault(labels, [0] * len(entry))
+                for index, value in enumerate(list(entry)):
+                    total[index] += value
+
+        lines = self.header()
+        for labels, entry in sorted(totals.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + ("+Inf",), entry[:-1]):
+                cumulative += count
+                le = f'le="{bound}"'
+                lines.append(f"{self.name}_bucket{label_text(self.labels, labels, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{label_text(self.labels, labels)} {entry[-1]}")
+            lines.append(f"{self.name}_count{label_text(self.labels, labels)} {cumulative}")
+
+        return lines
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+        # Functions returning [(name, kind, help, label names, {labels tuple: value})], called at scrape
+        # time for numbers other modules already keep (cache and pool stats)
+        self.collectors = []
+
+    def counter(self, name: str, help_text: str, labels=()):
+        metric = Counter(name, help_text, labels)
+        self.metrics.append(metric)
+        return metric
+
+    def gauge(self, name: str, help_text: str, labels=()):
+        metric = Gauge(name, help_text, labels)
+        self.metrics.append(metric)
+        return metric
+
+    def histogram(self, name: str, help_text: str, labels=(), buckets=LATENCY_BUCKETS):
+        metric = Histogram(name, help_text, labels, buckets)
+        self.metrics.append(metric)
+        return metric
+
+    def register_collector(self, collect):
+        self.collectors.append(collect)
+
+    def render(self):
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+
+        for collect in self.collectors:
+            for name, kind, help_text, label_names, values in collect():
+                lines.append(f"# HELP {name} {help_text}")
+                lines.append(f"# TYPE {name} {kind}")
+                for labels, value in sorted(values.items()):
+                    lines.append(f"{name}{label_text(label_names, labels)} {value}")
+
+        return "\n".join(lines) + "\n"
+
+registry = Registry()
+
+http_requests = registry.counter("http_requests_total", "HTTP requests by route and status", ("method", "route", "status"))
+http_request_seconds = registry.histogram("http_request_duration_seconds", "HTTP request latency by route", ("method", "route"))
+http_in_flight = registry.gauge("http_requests_in_flight", "HTTP requests being handled")
+
+aws_calls = registry.counter("aws_api_calls_total", "AWS API calls by service and operation", ("service", "operation"))
+aws_call_seconds = registry.histogram("aws_api_call_duration_seconds", "AWS API call latency including retries", ("service", "operation"))
+aws_errors = registry.counter("aws_api_errors_total", "AWS API calls that failed, by error code", ("service", "operation", "code"))
+aws_retries = registry.counter("aws_api_retries_total", "Retried AWS API attempts", ("service", "operation"))
+aws_throttles = registry.counter("aws_api_throttles_total", "AWS API attempts rejected by rate limiting", ("service", "operation"))
+
+def operation_labels(model):
+    return model.service_model.service_name, model.name
+
+# botocore event handlers, they must return None or botocore would use the value as the response
+def before_call(model, context, **kwargs):
+    context["metrics_started"] = time.perf_counter()
+
+def after_call(model, context, http_response, parsed, **kwargs):
+    # Answered with the response of an identical call in flight, only that one is counted
+    if context.get("flight_shared"):
+        return
+
+    labels = operation_labels(model)
+    started = context.get("metrics_started")
+    if started is not None:
+        aws_call_seconds.observe(time.perf_counter() - started, *labels)
+    aws_calls.inc(*labels)
+
+    code = parsed.get("Error", {}).get("Code") if http_response.status_code >= 300 else None
+    if code:
+        aws_errors.inc(*labels, code)
+
+    retries = parsed.get("ResponseMetadata", {}).get("RetryAttempts", 0)
+    if retries:
+        aws_retries.inc(*labels, amount=retries)
+
+def after_call_error(model, context, exception, **kwargs):
+    labels = operation_labels(model)
+    started = context.get("metrics_started")
+    if started is not None:
+        aws_call_seconds.observe(time.perf_counter() - started, *labels)
+    aws_calls.inc(*labels)
+    aws_errors.inc(*labels, type(exception).__name__)
+
+# Called for every attempt, so throttled attempts that were retried successfully are counted too
+def needs_retry(operation, response=None, **kwargs):
+    if response is None:
+        return None
+
+    code = response[1].get("Error", {}).get("Code")
+    if code in rate_limits.THROTTLE_CODES:
+        aws_throttles.inc(operation.service_model.service_name, operation.name)
+
+    return None
+
+def instrument_client(client, account_id: str = None):
+    events = client.meta.events
+    events.register("before-call", before_call, unique_id="metrics-before-call")
+    events.register("after-call", after_call, unique_id="metrics-after-call")
+    events.register("after-call-error", after_call_error, unique_id="metrics-after-call-error")
+    events.register("needs-retry", needs_retry, unique_id="metrics-needs-retry")
+
+# Registered first so the timing starts before any other handler (replay, rate limits) runs
+aws_clients.register_client_hook(instrument_client, priority=0)
+
+# Cache, pool and rate limit counters the other modules keep anyway, read when /metrics is scraped
+def cache_metrics():
+    sessions = aws_clients.session_pool.stats()
+    identities = aws_clients.identity_cache.stats()
+    limits = rate_limits.limiter.stats()
+    flights = coalescing.flights.stats()
+    circuits = breakers.breakers.stats()
+    costs = cost_cache.costs.stats()
+    store = snapshots.store.stats()
+    pools = aws_executor.pool_stats()
+
+    return [
+        ("cache_requests_total", "counter", "Cache lookups by cache and result", ("cache", "result"), {
+            ("snapshots", "hit"): store["hits"],
+            ("snapshots", "miss"): store["misses"],
+            ("sessions", "hit"): sessions["hits"],
+            ("sessions", "miss"): sessions["misses"],
+            ("identities", "hit"): identities["hits"],
+            ("identities", "miss"): identities["misses"],
+            ("cost", "hit"): costs["hits"],
+            ("cost", "stale"): costs["stale_hits"],
+            ("cost", "miss"): costs["misses"],
+        }),
+        ("cache_entries", "gauge", "Entries held by each cache", ("cache",), {
+            ("sessions",): sessions["sessions"],
+            ("identities",): identities["identities"],
+            ("cost",): costs["entries"],
+            ("snapshots",): store["snapshots"],
+        }),
+        ("cache_evictions_total", "counter", "Entries dropped to keep a cache within its size", ("cache",), {
+            ("snapshots",): store["evictions"],
+        }),
+        ("cache_bytes", "gauge", "Encoded size of the entries held by each cache", ("cache",), {
+            ("snapshots",): store["bytes"],
+        }),
+        ("snapshot_scans_total", "counter", "Collector scans by result", ("result",), {
+            ("ok",): store["scans"] - store["failed_scans"],
+            ("failed",): store["failed_scans"],
+        }),
+        ("aws_coalesced_calls_total", "counter", "AWS calls answered with the response of an identical call in flight", (), {(): flights["shared_calls"]}),
+        ("aws_rate_limit_waits_total", "counter", "AWS calls that waited for a rate limit token", (), {(): limits["waits"]}),
+        ("aws_rate_limit_wait_seconds_total", "counter", "Time AWS calls spent waiting for a rate limit token", (), {(): limits["waited_seconds"]}),
+        ("aws_rate_limit_waiting", "gauge", "AWS calls waiting for a rate limit token", (), {(): limits["waiting"]}),
+        ("aws_circuit_opened_total", "counter", "Times a circuit breaker opened", (), {(): circuits["opened"]}),
+        ("aws_circuit_rejected_calls_total", "counter", "AWS calls failed fast by an open circuit breaker", (), {(): circuits["rejected"]}),
+        ("aws_circuits_open", "gauge", "Circuit breakers open or half open", (), {(): len(circuits["open"])}),
+        ("aws_pool_queued", "gauge", "AWS calls waiting for a worker of the service pool", ("service",), {
+            (service,): pool["queued"] for service, pool in pools.items()
+        }),
+    ]
+
+registry.register_collector(cache_metrics)
+
+def render():
+    return registry.render()
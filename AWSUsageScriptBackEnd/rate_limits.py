@@ -0,0 +1,209 @@
+import os
+import random
+import threading
+import time
+from collections import OrderedDict
+import aws_clients
+import deadlines
+
+# Client side rate limits for AWS calls, shared by every request.
+# Each (account, region, service, operation) has a token bucket starting at the quota of the API.
+# Every attempt takes a token first and waits in its worker thread when there is none, so bursts
+# queue instead of failing. A throttling error halves the rate of the bucket and every successful
+# attempt slowly raises it back, keeping the throughput close to the real quota of the account.
+
+# Calls per second (and burst size) used for any service without its own entry
+DEFAULT_RATE_LIMIT = float(os.environ.get("AWS_RATE_LIMIT", "20"))
+
+# Starting rate per service, each one can be overridden with AWS_RATE_LIMIT_<SERVICE> (e.g. AWS_RATE_LIMIT_CE=2)
+SERVICE_RATE_LIMITS = {
+    # Describe* calls share a bucket refilled at 20 per second
+    "ec2": 20,
+    "rds": 10,
+    "s3": 50,
+    "cloudwatch": 20,
+    "lambda": 10,
+    "elb": 10,
+    "elbv2": 10,
+    # Cost Explorer allows a few requests per second and charges for each of them
+    "ce": 5,
+    "sts": 20,
+}
+
+# Lowest rate a bucket can be slowed down to
+MIN_RATE = 0.5
+# Share of the starting rate given back after every successful attempt
+RECOVERY = 0.02
+# Waits are stretched by up to this share so callers released together do not hit AWS in lockstep
+JITTER = 0.1
+# Attempts of a throttled call, after the botocore retries are used up the call keeps being retried with backoff
+THROTTLE_MAX_ATTEMPTS = int(os.environ.get("AWS_THROTTLE_MAX_ATTEMPTS", "8"))
+THROTTLE_BACKOFF_SECONDS = 0.5
+THROTTLE_MAX_BACKOFF_SECONDS = 20
+# Buckets kept before the least recently used one is dropped
+MAX_BUCKETS = int(os.environ.get("AWS_RATE_LIMIT_BUCKETS", "4096"))
+
+THROTTLE_CODES = {
+    "Throttling",
+    "ThrottlingException",
+    "ThrottledException",
+    "RequestThrottled",
+    "RequestThrottledException",
+    "RequestLimitExceeded",
+    "TooManyRequestsException",
+    "ProvisionedThroughputExceededException",
+    "SlowDown",
+    "LimitExceededException",
+}
+
+def rate_limit_for(service: str) -> float:
+    override = os.environ.get(f"AWS_RATE_LIMIT_{service.upper()}")
+    if override:
+        return max(MIN_RATE, float(override))
+
+    return SERVICE_RATE_LIMITS.get(service, DEFAULT_RATE_LIMIT)
+
+def throttled(response):
+    return response is not None and response[1].get("Error", {}).get("Code") in THROTTLE_CODES
+
+class TokenBucket:
+    def __init__(self, rate: float):
+        self.max_rate = rate
+        self.rate = rate
+        self.capacity = max(1.0, rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+        self.throttles = 0
+
+    # Take a token and return how long the caller has to wait for it.
+    # Tokens can go negative: every waiting caller holds its own place in the queue.
+    def reserve(self):
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= 1
+
+            return 0.0 if self.tokens >= 0 else -self.tokens / self.rate
+
+    # Give back a reserved token the caller will not use
+    def release(self):
+        with self.lock:
+            self.tokens = min(self.capacity, self.tokens + 1)
+
+    def throttled(self):
+        with self.lock:
+            self.throttles += 1
+            self.rate = max(MIN_RATE, self.rate / 2)
+            # No burst until the rate has recovered
+            self.tokens = min(self.tokens, 0)
+
+    def succeeded(self):
+        if self.rate < self.max_rate:
+            with self.lock:
+                self.rate = min(self.max_rate, self.rate + self.max_rate * RECOVERY)
+
+class RateLimiter:
+    def __init__(self, max_buckets: int):
+        self.max_buckets = max_buckets
+        # (account_id, region, service, operation) -> TokenBucket, least recently used first
+        self.buckets = OrderedDict()
+        self.lock = threading.Lock()
+        self.waits = 0
+        self.waited_seconds = 0.0
+        self.waiting = 0
+        self.throttles = 0
+
+    def bucket(self, key) -> TokenBucket:
+        with self.lock:
+            bucket = self.buckets.get(key)
+            if bucket is None:
+                bucket = TokenBucket(rate_limit_for(key[2]))
+                self.buckets[key] = bucket
+                while len(self.buckets) > self.max_buckets:
+                    self.buckets.popitem(last=False)
+            else:
+                self.buckets.move_to_end(key)
+
+            return bucket
+
+    # Block the calling worker thread until the bucket of the call has a token.
+    # A call whose request would run out of time while waiting fails right away instead.
+    def acquire(self, key):
+        bucket = self.bucket(key)
+        wait = bucket.reserve()
+        if wait <= 0:
+            return
+
+        wait += random.uniform(0, wait * JITTER)
+        if wait > deadlines.timeout(wait):
+            bucket.release()
+            raise deadlines.exceeded(f"Deadline passes before a rate limit token for {key[3]}")
+
+        with self.lock:
+            self.waits += 1
+            self.waiting += 1
+        try:
+            time.sleep(wait)
+        finally:
+            with self.lock:
+                self.waiting -= 1
+                self.waited_seconds += wait
+
+    # Feed the outcome of one attempt back into its bucket.
+    # Returns the delay before retrying a throttled call the botocore retries gave up on, None otherwise.
+    def attempted(self, key, response, attempts: int):
+        bucket = self.bucket(key)
+        if not throttled(response):
+            if response is not None:
+                bucket.succeeded()
+            return None
+
+        bucket.throttled()
+        with self.lock:
+            self.throttles += 1
+        if attempts >= THROTTLE_MAX_ATTEMPTS:
+            return None
+
+        # Full jitter: anywhere between no wait and the exponential backoff of the attempt
+        return random.uniform(0, min(THROTTLE_MAX_BACKOFF_SECONDS, THROTTLE_BACKOFF_SECONDS * 2 ** attempts))
+
+    # Client hook: every attempt of every call goes through the bucket of its operation
+    def attach(self, client, account_id: str = None):
+        service = client.meta.service_model.service_name
+        region = client.meta.region_name
+
+        # Sent once per attempt, retries wait for a token as well. Must return None, anything else is used as the response.
+        def before_send(event_name, **kwargs):
+            self.acquire((account_id, region, service, event_name.rsplit(".", 1)[-1]))
+
+        # Registered for every service, so it runs after the botocore retry handler of the service
+        # and only its delay is used when botocore decided to retry
+        def needs_retry(operation, attempts, response=None, **kwargs):
+            return self.attempted((account_id, region, service, operation.name), response, attempts)
+
+        client.meta.events.register("before-send", before_send, unique_id="rate-limit-before-send")
+        client.meta.events.register("needs-retry", needs_retry, unique_id="rate-limit-needs-retry")
+
+    def stats(self):
+        with self.lock:
+            slowed = {
+                "/".join(part or "" for part in key): round(bucket.rate, 2)
+                for key, bucket in self.buckets.items()
+                if bucket.rate < bucket.max_rate
+            }
+
+            return {
+                "buckets": len(self.buckets),
+                "waiting": self.waiting,
+                "waits": self.waits,
+                "waited_seconds": round(self.waited_seconds, 2),
+                "throttles": self.throttles,
+                "slowed": slowed,
+            }
+
+limiter = RateLimiter(MAX_BUCKETS)
+
+# After the metrics so the call latency includes the time spent waiting for a token
+aws_clients.register_client_hook(limiter.attach, priority=20)
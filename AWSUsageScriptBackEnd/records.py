@@ -0,0 +1,162 @@
+import sys
+
+# Compact resource records for the collectors.
+# Snapshots keep every resource of every tenant, scope and region in memory, so each resource kind
+# gets a class with __slots__ (no dict per resource) and the fields that only take a few values
+# across a fleet (instance type, state, engine, volume type, scheme, region) are interned, every
+# record pointing at one shared string. Records still read like the dicts they replaced
+# (record["instance_type"], record.get("region"), dict(record)) and only become the JSON documents
+# of the API when a response or a history entry is encoded.
+
+def intern(value):
+    return sys.intern(value) if isinstance(value, str) else value
+
+class Record:
+    # Set by the fan-out on merged scans, absent otherwise
+    __slots__ = ("account_id", "region")
+    # JSON name of every field, in response order -> slot holding it
+    FIELDS = {}
+    EXTRAS = ("account_id", "region")
+
+    @classmethod
+    def slot(cls, name: str):
+        slot = cls.FIELDS.get(name)
+        if slot is None:
+            if name not in cls.EXTRAS:
+                raise KeyError(name)
+            slot = name
+
+        return slot
+
+    def keys(self):
+        names = list(self.FIELDS)
+        names.extend(name for name in self.EXTRAS if name not in self.FIELDS and hasattr(self, name))
+
+        return names
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __len__(self):
+        return len(self.keys())
+
+    def __contains__(self, name):
+        try:
+            return hasattr(self, self.slot(name))
+        except KeyError:
+            return False
+
+    def __getitem__(self, name: str):
+        try:
+            return getattr(self, self.slot(name))
+        except AttributeError:
+            raise KeyError(name)
+
+    def __setitem__(self, name: str, value):
+        # Only the account and the region are added after the scan, both repeat on every record
+        setattr(self, self.slot(name), intern(value))
+
+    def get(self, name: str, default=None):
+        try:
+            return self[name]
+        except KeyError:
+            return default
+
+    def items(self):
+        return [(name, self[name]) for name in self.keys()]
+
+    # The JSON document of the API, in the shape the collectors always returned
+    def to_json(self):
+        return {name: self[name] for name in self.keys()}
+
+    def __eq__(self, other):
+        if isinstance(other, (Record, dict)):
+            return self.to_json() == dict(other)
+
+        return NotImplemented
+
+    __hash__ = None
+
+    def __repr__(self):
+        return f"{type(self).__name__}({self.to_json()!r})"
+
+class EC2Instance(Record):
+    __slots__ = ("instance_id", "instance_type", "state", "launch_time")
+    FIELDS = {"instance_id": "instance_id", "instance_type": "instance_type", "state": "state", "launch_time": "launch_time"}
+
+    def __init__(self, instance_id: str, instance_type: str, state: str, launch_time):
+        self.instance_id = instance_id
+        self.instance_type = intern(instance_type)
+        self.state = intern(state)
+        self.launch_time = launch_time
+
+class DBInstance(Record):
+    __slots__ = ("identifier", "engine", "db_class", "status", "storage")
+    FIELDS = {"identifier": "identifier", "engine": "engine", "class": "db_class", "status": "status", "storage": "storage"}
+
+    def __init__(self, identifier: str, engine: str, db_class: str, status: str, storage):
+        self.identifier = identifier
+        self.engine = intern(engine)
+        self.db_class = intern(db_class)
+        self.status = intern(status)
+        self.storage = storage
+
+class Bucket(Record):
+    # The home region is a field of its own, buckets are listed account wide
+    __slots__ = ("name", "size", "objects", "storage")
+    FIELDS = {"name": "name", "region": "region", "size": "size", "objects": "objects", "storage": "storage"}
+
+    def __init__(self, name: str, region: str, size: float, objects: int, storage: dict):
+        self.name = name
+        self.region = intern(region)
+        self.size = size
+        self.objects = objects
+        self.storage = {intern(storage_type): value for storage_type, value in storage.items()}
+
+class LambdaFunction(Record):
+    __slots__ = ("name", "runtime", "memory", "timeout", "last_modified")
+    FIELDS = {"name": "name", "runtime": "runtime", "memory": "memory", "timeout": "timeout", "lastModified": "last_modified"}
+
+    def __init__(self, name: str, runtime: str, memory: int, timeout: int, last_modified: str):
+        self.name = name
+        self.runtime = intern(runtime)
+        self.memory = memory
+        self.timeout = timeout
+        self.last_modified = last_modified
+
+class LoadBalancer(Record):
+    __slots__ = ("name", "type", "scheme", "state")
+    FIELDS = {"name": "name", "type": "type", "scheme": "scheme", "state": "state"}
+
+    def __init__(self, name: str, type: str, scheme: str, state: str):
+        self.name = name
+        self.type = intern(type)
+        self.scheme = intern(scheme)
+        self.state = intern(state)
+
+class Volume(Record):
+    __slots__ = ("id", "size", "type", "state", "attached_to")
+    FIELDS = {"id": "id", "size": "size", "type": "type", "state": "state", "attachedTo": "attached_to"}
+
+    def __init__(self, id: str, size: int, type: str, state: str, attached_to):
+        self.id = id
+        self.size = size
+        self.type = intern(type)
+        self.state = intern(state)
+        self.attached_to = attached_to
+
+class ElasticIP(Record):
+    __slots__ = ("ip", "attached_to", "status")
+    FIELDS = {"ip": "ip", "attachedTo": "attached_to", "status": "status"}
+
+    def __init__(self, ip: str, attached_to: str, status: str):
+        self.ip = ip
+        self.attached_to = attached_to
+        self.status = intern(status)
+
+# json.dumps default for documents holding records
+def json_default(value):
+    if isinstance(value, Record):
+        return value.to_json()
+
+    return str(value)
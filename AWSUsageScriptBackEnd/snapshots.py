@@ -0,0 +1,327 @@
+import asyncio
+import hashlib
+import logging
+import os
+import sys
+import time
+import deadlines
+import encoding
+import records
+
+# Background scheduler keeping versioned snapshots of the collectors.
+# The first request for a scope (collector, login, accounts and regions) scans AWS once, after
+# that the scheduler refreshes the scope on the collector's own interval while it is being read,
+# and every request is answered from the latest snapshot. AWS calls grow with the refresh rate,
+# not with the number of people looking at the dashboard. The snapshots are bounded by the memory
+# they hold (the encoded bytes and the parsed data), the scopes read least recently are dropped first.
+
+log = logging.getLogger(__name__)
+
+# Seconds between two refreshes of a collector, each one can be overridden with
+# SNAPSHOT_INTERVAL_<COLLECTOR> (e.g. SNAPSHOT_INTERVAL_EC2=60)
+SNAPSHOT_INTERVALS = {
+    "ec2": 120,
+    "ebs": 300,
+    "eip": 600,
+    "rds": 600,
+    "lambda": 600,
+    "elb": 600,
+    # Bucket sizes are only published by CloudWatch once a day
+    "s3": 86400,
+    "cost": 21600,
+}
+DEFAULT_SNAPSHOT_INTERVAL = int(os.environ.get("SNAPSHOT_INTERVAL", "300"))
+# Scopes nobody has read for this long are no longer refreshed
+SNAPSHOT_IDLE_SECONDS = int(os.environ.get("SNAPSHOT_IDLE_SECONDS", "1800"))
+# A scan that failed with no good snapshot to fall back on is served and retried after this long,
+# not after the collector's interval (a day for S3)
+SNAPSHOT_RETRY_SECONDS = int(os.environ.get("SNAPSHOT_RETRY_SECONDS", "30"))
+# How often the scheduler looks for scopes that are due
+SCHEDULER_TICK_SECONDS = float(os.environ.get("SCHEDULER_TICK_SECONDS", "5"))
+# Memory held by all snapshots together, their encoded bytes and their parsed data
+SNAPSHOT_CACHE_MAX_BYTES = int(float(os.environ.get("SNAPSHOT_CACHE_MB", "256")) * 1024 * 1024)
+
+def interval_for(name: str) -> int:
+    override = os.environ.get(f"SNAPSHOT_INTERVAL_{name.upper()}")
+    if override:
+        return max(1, int(override))
+
+    return SNAPSHOT_INTERVALS.get(name, DEFAULT_SNAPSHOT_INTERVAL)
+
+def succeeded(result):
+    return result.get("success", False)
+
+# Memory held by the parsed data of a snapshot: every dict, list, record and value in it.
+# Objects shared within the data (interned strings, repeated keys) are counted once.
+def retained_size(data):
+    seen = set()
+    total = 0
+    pending = [data]
+    while pending:
+        value = pending.pop()
+        if id(value) in seen:
+            continue
+        seen.add(id(value))
+        total += sys.getsizeof(value)
+
+        if isinstance(value, dict):
+            pending.extend(value.keys())
+            pending.extend(value.values())
+        elif isinstance(value, (list, tuple)):
+            pending.extend(value)
+        elif isinstance(value, records.Record):
+            pending.extend(value[name] for name in value.keys())
+
+    return total
+
+class Snapshot:
+    def __init__(self, version: int, data: dict, taken_at: float, duration_ms: float):
+        self.version = version
+        self.data = data
+        self.succeeded = succeeded(data)
+        # Wall clock time for the responses, monotonic time for the age
+        self.taken_at = taken_at
+        self.taken_monotonic = time.monotonic()
+        self.duration_ms = duration_ms
+        self.encoded = None
+        self.etag = None
+        self.data_bytes = None
+
+    # Serialise the data once per snapshot instead of once per request, the ETag is the hash of it.
+    # The parsed data stays next to the encoded bytes (the MessagePack and Arrow encodings and the
+    # inventory read it), so its memory is measured here as well.
+    def encode(self):
+        if self.encoded is None:
+            self.encoded = encoding.dumps(self.data)
+            self.etag = f'"{hashlib.blake2b(self.encoded, digest_size=16).hexdigest()}"'
+            self.data_bytes = retained_size(self.data)
+
+        return self.encoded
+
+    # The encoded data with the snapshot field added, only the small snapshot part is serialised per request
+    def body(self):
+        encoded = self.encode()
+        info = encoding.dumps({"snapshot": self.info()})
+        if encoded == b"{}":
+            return info
+
+        return encoded[:-1] + b"," + info[1:]
+
+    def age_seconds(self):
+        return time.monotonic() - self.taken_monotonic
+
+    # Seconds the snapshot is served before its scope is scanned again
+    def refresh_after(self, interval: float):
+        return interval if self.succeeded else min(interval, SNAPSHOT_RETRY_SECONDS)
+
+    # Memory held by the snapshot, the encoded bytes and the parsed data
+    def size(self):
+        return len(self.encode()) + self.data_bytes
+
+    def info(self):
+        return {
+            "version": self.version,
+            "taken_at": self.taken_at,
+            "age_seconds": round(self.age_seconds(), 1),
+            "duration_ms": self.duration_ms,
+        }
+
+# Everything the scheduler needs to refresh one scope
+class Scope:
+    def __init__(self, name: str, scan):
+        self.name = name
+        # Coroutine function running the collector on every target of the scope
+        self.scan = scan
+        self.interval = interval_for(name)
+        self.last_read = time.monotonic()
+        self.last_error = None
+
+class SnapshotStore:
+    def __init__(self, max_bytes: int = SNAPSHOT_CACHE_MAX_BYTES):
+        self.max_bytes = max_bytes
+        # scope key -> latest Snapshot
+        self.snapshots = {}
+        # Memory held by every snapshot, see Snapshot.size
+        self.bytes = 0
+        # scope key -> Scope, for every scope read within SNAPSHOT_IDLE_SECONDS
+        self.scopes = {}
+        # scope key -> asyncio task of the refresh in flight, so concurrent readers share one scan
+        self.in_flight = {}
+        self.scans = 0
+        self.failed_scans = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        # History store recording every scan of the collectors it tracks, set up by the app
+        self.history = None
+        # Coroutine functions called with (key, name, previous snapshot, new snapshot) after every new snapshot
+        self.listeners = []
+
+    # Latest snapshot of the scope, scanning only when there is none yet or when fresh is set
+    async def read(self, key, name: str, scan, fresh: bool = False) -> Snapshot:
+        scope = self.scopes.get(key)
+        if scope is None:
+            scope = Scope(name, scan)
+            self.scopes[key] = scope
+        scope.last_read = time.monotonic()
+
+        snapshot = self.snapshots.get(key)
+        if snapshot is not None and not fresh and snapshot.age_seconds() < snapshot.refresh_after(scope.interval):
+            self.hits += 1
+            return snapshot
+
+        self.misses += 1
+        return await self.refresh(key, deadlines.current.get())
+
+    # A scan started for a request gets the deadline of the request, the scheduler's have none
+    async def refresh(self, key, deadline: float = None) -> Snapshot:
+        task = self.in_flight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(self.take(key, self.scopes[key], deadline))
+            self.in_flight[key] = task
+            task.add_done_callback(lambda done: self.in_flight.get(key) is done and self.in_flight.pop(key))
+
+        return await asyncio.shield(task)
+
+    async def take(self, key, scope: Scope, deadline: float = None) -> Snapshot:
+        started = time.perf_counter()
+        self.scans += 1
+        try:
+            with deadlines.bounded(deadline) as refused:
+                data = await scope.scan()
+        except Exception as e:
+            self.failed_scans += 1
+            scope.last_error = f"Error collecting {scope.name}: {e}"
+            raise
+
+        if refused:
+            # Cut short by the deadline of the request it was started for (the fan-out keeps the targets that
+            # made it). Not kept, the scheduler scans the scope again without a deadline.
+            self.failed_scans += 1
+            scope.last_error = f"Error collecting {scope.name}: {refused[0]}"
+            raise deadlines.DeadlineExceeded(scope.last_error)
+
+        previous = self.snapshots.get(key)
+        if not succeeded(data):
+            self.failed_scans += 1
+            scope.last_error = data.get("message", data.get("error"))
+            # A failed refresh keeps serving the last good snapshot
+            if previous is not None and previous.succeeded:
+                return previous
+
+        taken_at = time.time()
+        version = None
+        if self.history is not None and self.history.tracks(scope.name):
+            # Recorded scans are numbered by the history, so versions survive a restart
+            if succeeded(data):
+                version = await asyncio.to_thread(self.history.append, key, scope.name, data, taken_at)
+            else:
+                version = await asyncio.to_thread(self.history.latest_version, key)
+        if version is None:
+            version = previous.version + 1 if previous else 1
+
+        snapshot = Snapshot(
+            version=version,
+            data=data,
+            taken_at=taken_at,
+            duration_ms=round((time.perf_counter() - started) * 1000, 1),
+        )
+        await asyncio.to_thread(snapshot.encode)
+        self.put(key, snapshot)
+        if succeeded(data):
+            scope.last_error = None
+
+        for listener in self.listeners:
+            try:
+                await listener(key, scope.name, previous, snapshot)
+            except Exception as e:
+                log.warning("Error publishing snapshot", extra={"service": scope.name, "error": str(e)})
+
+        return snapshot
+
+    # Keep a scope refreshed without reading it, e.g. while a client is subscribed to its changes
+    def touch(self, key):
+        scope = self.scopes.get(key)
+        if scope is not None:
+            scope.last_read = time.monotonic()
+
+    # Start a refresh of every scope that is due and forget the ones nobody reads anymore
+    def tick(self):
+        now = time.monotonic()
+        for key, scope in list(self.scopes.items()):
+            if now - scope.last_read > SNAPSHOT_IDLE_SECONDS:
+                del self.scopes[key]
+                self.drop(key)
+                continue
+
+            snapshot = self.snapshots.get(key)
+            if key not in self.in_flight and (snapshot is None or snapshot.age_seconds() >= snapshot.refresh_after(scope.interval)):
+                task = asyncio.ensure_future(self.refresh(key))
+                # Errors are kept on the scope, the task result is not needed
+                task.add_done_callback(lambda done: done.cancelled() or done.exception())
+
+    async def run(self):
+        while True:
+            await asyncio.sleep(SCHEDULER_TICK_SECONDS)
+            self.tick()
+
+    def put(self, key, snapshot: Snapshot):
+        self.drop(key)
+        self.snapshots[key] = snapshot
+        self.bytes += snapshot.size()
+        self.evict(keep=key)
+
+    def drop(self, key):
+        snapshot = self.snapshots.pop(key, None)
+        if snapshot is not None:
+            self.bytes -= snapshot.size()
+
+    # Forget the scopes read least recently until the snapshots fit, the one just stored is kept
+    def evict(self, keep=None):
+        if self.bytes <= self.max_bytes:
+            return
+
+        for key in sorted(self.snapshots, key=lambda key: self.scopes[key].last_read if key in self.scopes else 0):
+            if self.bytes <= self.max_bytes:
+                break
+            if key == keep:
+                continue
+            self.drop(key)
+            self.scopes.pop(key, None)
+            self.evictions += 1
+
+    # Drop the snapshots of an account (of some collectors only when names are given).
+    # Their scopes stay, the next read or scheduler tick scans them again.
+    def invalidate(self, account_id: str, names=None):
+        keys = [key for key in self.snapshots if key[1] == account_id and (names is None or key[0] in names)]
+        for key in keys:
+            self.drop(key)
+
+        return len(keys)
+
+    def clear(self):
+        self.snapshots.clear()
+        self.scopes.clear()
+        self.in_flight.clear()
+        self.bytes = 0
+
+    def stats(self):
+        return {
+            "scopes": len(self.scopes),
+            "snapshots": len(self.snapshots),
+            "bytes": self.bytes,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "refreshing": len(self.in_flight),
+            "scans": self.scans,
+            "failed_scans": self.failed_scans,
+            "errors": {
+                "/".join(str(part) for part in key if part): scope.last_error
+                for key, scope in self.scopes.items()
+                if scope.last_error
+            },
+        }
+
+store = SnapshotStore()
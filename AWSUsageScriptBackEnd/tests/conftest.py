@@ -0,0 +1,50 @@
+import boto3
+import pytest
+from botocore.stub import Stubber
+
+# AWSContext stand-in handing out stubbed clients per (service, region)
+class StubbedAWS:
+    def __init__(self, region="ap-southeast-2"):
+        self.account_id = "123456789012"
+        self.region = region
+        self.clients = {}
+        self.stubs = {}
+
+    def client(self, service, region=None):
+        key = (service, region or self.region)
+        if key not in self.clients:
+            client = boto3.client(
+                service,
+                region_name=key[1],
+                aws_access_key_id="testing",
+                aws_secret_access_key="testing",
+            )
+            self.clients[key] = client
+            self.stubs[key] = Stubber(client)
+            self.stubs[key].activate()
+        return self.clients[key]
+
+    # Shares the stubbed clients, only the default region changes
+    def for_region(self, region):
+        other = StubbedAWS(region)
+        other.account_id = self.account_id
+        other.clients = self.clients
+        other.stubs = self.stubs
+        return other
+
+    def for_account(self, account_id):
+        other = self.for_region(self.region)
+        other.account_id = account_id
+        return other
+
+    def stub(self, service, region=None):
+        self.client(service, region)
+        return self.stubs[(service, region or self.region)]
+
+    def assert_no_pending_responses(self):
+        for stub in self.stubs.values():
+            stub.assert_no_pending_responses()
+
+@pytest.fixture
+def aws():
+    return StubbedAWS()
@@ -0,0 +1,81 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+import pytest
+from botocore.stub import ANY
+import accounts
+import aws_clients
+
+ROLE = "arn:aws:iam::210987654321:role/ResourceMonitor"
+
+@pytest.fixture(autouse=True)
+def clean_accounts(monkeypatch):
+    monkeypatch.setattr(accounts, "member_roles", {})
+    monkeypatch.setattr(accounts, "assumed_credentials", {})
+    monkeypatch.setattr(accounts, "assume_role_calls", 0)
+    monkeypatch.setattr(aws_clients, "credentials_by_account", {})
+    monkeypatch.setattr(aws_clients, "session_pool", aws_clients.SessionPool(16, 60))
+
+def stub_assume_role(aws, expires_in):
+    aws.stub("sts").add_response("assume_role", {"Credentials": {
+        "AccessKeyId": "ASIAMEMBEREXAMPLE",
+        "SecretAccessKey": "secret",
+        "SessionToken": "token",
+        "Expiration": datetime.now(timezone.utc) + expires_in,
+    }}, {"RoleArn": ROLE, "RoleSessionName": ANY, "DurationSeconds": ANY})
+
+def test_account_id_comes_from_the_role_arn():
+    assert accounts.account_id_from_role_arn(ROLE) == "210987654321"
+
+    with pytest.raises(accounts.InvalidAccounts):
+        accounts.account_id_from_role_arn("arn:aws:iam::210987654321:user/someone")
+
+def test_cached_credentials_are_reused_until_they_near_expiry(aws):
+    stub_assume_role(aws, timedelta(hours=1))
+
+    first = accounts.assume_role(aws, ROLE)
+    second = accounts.assume_role(aws, ROLE)
+
+    aws.assert_no_pending_responses()
+    assert second is first
+    assert accounts.assume_role_calls == 1
+
+def test_credentials_close_to_expiry_are_renewed(aws):
+    stub_assume_role(aws, timedelta(minutes=5))
+    stub_assume_role(aws, timedelta(hours=1))
+
+    accounts.assume_role(aws, ROLE)
+    accounts.assume_role(aws, ROLE)
+
+    aws.assert_no_pending_responses()
+    assert accounts.assume_role_calls == 2
+
+def test_member_roles_are_assumed_and_resolved(aws):
+    stub_assume_role(aws, timedelta(hours=1))
+
+    accounts.register_member_roles(aws, [ROLE])
+    failed = asyncio.run(accounts.assume_all(aws))
+
+    assert failed == {}
+    assert ("123456789012", "210987654321") in aws_clients.credentials_by_account
+    assert [target.account_id for target in accounts.resolve_accounts(aws, "all")] == ["123456789012", "210987654321"]
+    assert [target.account_id for target in accounts.resolve_accounts(aws, None)] == ["123456789012"]
+
+    with pytest.raises(accounts.InvalidAccounts):
+        accounts.resolve_accounts(aws, "999999999999")
+
+def test_a_member_role_does_not_replace_another_login(aws):
+    member = "210987654321"
+    # Tenant B logs in with its own keys, tenant A registers a role into B's account
+    aws_clients.register_credentials(member, "AKIATENANTB", "secret-b")
+    b_session = aws_clients.session_pool.get(member, "ap-southeast-2")
+    accounts.register_member_roles(aws, [ROLE])
+
+    assert aws_clients.session_pool.get(member, "ap-southeast-2") is b_session
+    assert b_session.session.get_credentials().access_key == "AKIATENANTB"
+
+    a = aws_clients.AWSContext("123456789012", "ap-southeast-2")
+    [_, through_a] = accounts.resolve_accounts(a, "all")
+    assert through_a.source == "123456789012"
+    assert through_a.for_region("us-east-1").source == "123456789012"
+    assert "refresh" in aws_clients.get_credentials(member, through_a.source)
+    assert aws_clients.session_pool.get(member, "ap-southeast-2", through_a.source) is not b_session
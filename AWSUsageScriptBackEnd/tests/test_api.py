@@ -1,14 +1,23 @@
-import pytest
-from fastapi.testclient import TestCLient
-from usageScript import app
+from fastapi.testclient import TestClient
+import snapshots
+from app import app
 
-client = TestCLient(app)
+client = TestClient(app)
 
 def test_health_endpoint():
     response = client.get("/health")
-    assert response.status_Cide == 200
+    assert response.status_code == 200
     assert response.json()["success"] == True
-    
 
-    
+def test_pool_health_does_not_name_accounts():
+    scope = snapshots.Scope("ec2", None)
+    scope.last_error = "AccessDenied for arn:aws:iam::123456789012:user/admin"
+    snapshots.store.scopes[("ec2", "123456789012", "us-east-1", "", "")] = scope
+    try:
+        response = client.get("/health/pools")
+    finally:
+        snapshots.store.clear()
 
+    assert response.status_code == 200
+    assert response.json()["snapshots"]["errors"] == 1
+    assert "123456789012" not in response.text
@@ -0,0 +1,60 @@
+import pytest
+import aws_clients
+
+@pytest.fixture(autouse=True)
+def clean_pool(monkeypatch):
+    monkeypatch.setattr(aws_clients, "credentials_by_account", {})
+    monkeypatch.setattr(aws_clients, "session_pool", aws_clients.SessionPool(max_sessions=2, idle_seconds=60))
+    yield
+
+def test_clients_are_reused_per_account_and_region():
+    aws_clients.register_credentials("111111111111", "AKIAONE", "secret-one")
+    aws = aws_clients.AWSContext("111111111111", "ap-southeast-2")
+
+    first = aws.client("ec2")
+
+    assert aws.client("ec2") is first
+    assert aws.client("ec2", region="us-east-1") is not first
+    assert first.meta.config.max_pool_connections == aws_clients.MAX_POOL_CONNECTIONS
+    assert aws_clients.session_pool.stats()["hits"] == 1
+
+def test_accounts_do_not_share_credentials():
+    aws_clients.register_credentials("111111111111", "AKIAONE", "secret-one")
+    aws_clients.register_credentials("222222222222", "AKIATWO", "secret-two")
+
+    one = aws_clients.session_pool.get("111111111111", "ap-southeast-2")
+    two = aws_clients.session_pool.get("222222222222", "ap-southeast-2")
+
+    assert one.session.get_credentials().access_key == "AKIAONE"
+    assert two.session.get_credentials().access_key == "AKIATWO"
+
+def test_least_recently_used_session_is_evicted():
+    for account_id in ("111111111111", "222222222222", "333333333333"):
+        aws_clients.register_credentials(account_id, f"AKIA{account_id}", "secret")
+
+    first = aws_clients.session_pool.get("111111111111", "ap-southeast-2")
+    aws_clients.session_pool.get("222222222222", "ap-southeast-2")
+    # Touch the first session so the second one becomes the least recently used
+    aws_clients.session_pool.get("111111111111", "ap-southeast-2")
+    aws_clients.session_pool.get("333333333333", "ap-southeast-2")
+
+    assert list(aws_clients.session_pool.sessions) == [
+        ("111111111111", "ap-southeast-2"),
+        ("333333333333", "ap-southeast-2"),
+    ]
+    assert aws_clients.session_pool.get("111111111111", "ap-southeast-2") is first
+    assert aws_clients.session_pool.stats()["evictions"] == 1
+
+def test_new_credentials_replace_pooled_sessions():
+    aws_clients.register_credentials("111111111111", "AKIAOLD", "secret")
+    old = aws_clients.session_pool.get("111111111111", "ap-southeast-2")
+
+    aws_clients.register_credentials("111111111111", "AKIANEW", "secret")
+    new = aws_clients.session_pool.get("111111111111", "ap-southeast-2")
+
+    assert new is not old
+    assert new.session.get_credentials().access_key == "AKIANEW"
+
+def test_unknown_account_has_no_credentials():
+    with pytest.raises(aws_clients.CredentialsNotFound):
+        aws_clients.AWSContext("999999999999", "ap-southeast-2").client("ec2")
@@ -0,0 +1,49 @@
+import asyncio
+import threading
+import time
+import aws_executor
+
+def test_pool_size_can_be_set_per_service(monkeypatch):
+    monkeypatch.setenv("AWS_POOL_SIZE_CE", "3")
+
+    assert aws_executor.pool_size_for("ce") == 3
+    assert aws_executor.pool_size_for("ec2") == aws_executor.SERVICE_POOL_SIZES["ec2"]
+    assert aws_executor.pool_size_for("unknown") == aws_executor.DEFAULT_POOL_SIZE
+
+def test_pool_is_bounded_and_reports_saturation(monkeypatch):
+    monkeypatch.setitem(aws_executor.SERVICE_POOL_SIZES, "test-bounded", 2)
+    running = []
+    peak = []
+    lock = threading.Lock()
+
+    def call():
+        with lock:
+            running.append(1)
+            peak.append(len(running))
+        time.sleep(0.05)
+        with lock:
+            running.pop()
+        return "done"
+
+    async def main():
+        return await asyncio.gather(*(aws_executor.run("test-bounded", call) for _ in range(6)))
+
+    assert asyncio.run(main()) == ["done"] * 6
+    assert max(peak) == 2
+
+    stats = aws_executor.pool_stats()["test-bounded"]
+    assert stats["size"] == 2
+    assert stats["completed"] == 6
+    assert stats["saturated"] == 4
+    assert stats["queued"] == 0
+
+def test_event_loop_stays_free_while_pool_is_busy():
+    async def main():
+        slow = asyncio.ensure_future(aws_executor.run("test-free", time.sleep, 0.3))
+        started = time.perf_counter()
+        await asyncio.sleep(0.01)
+        responsive_after = time.perf_counter() - started
+        await slow
+        return responsive_after
+
+    assert asyncio.run(main()) < 0.1
@@ -0,0 +1,60 @@
+import boto3
+import pytest
+import collectors
+from benchmarks import run
+from benchmarks.fake_aws import FakeAWS
+
+# AWSContext stand-in whose clients are answered by the synthetic account
+class FakeContext:
+    def __init__(self, region="ap-southeast-2"):
+        self.account_id = "123456789012"
+        self.region = region
+
+    def client(self, service, region=None):
+        return boto3.client(
+            service,
+            region_name=region or self.region,
+            aws_access_key_id="testing",
+            aws_secret_access_key="testing",
+        )
+
+@pytest.fixture
+def fake():
+    fake = FakeAWS({"instances": 2500, "volumes": 1200, "buckets": 30, "functions": 120})
+    fake.install()
+    yield fake
+    fake.uninstall()
+
+def test_collectors_page_through_the_synthetic_account(fake):
+    aws = FakeContext()
+
+    assert collectors.collect_ec2(aws)["total_count"] == 2500
+    assert collectors.collect_ebs_volumes(aws)["total_count"] == 1200
+    assert collectors.collect_lambda(aws)["total_count"] == 120
+    assert fake.calls[("ec2", "DescribeInstances")] == 3
+    assert fake.calls[("ec2", "DescribeVolumes")] == 3
+    assert fake.calls[("lambda", "ListFunctions")] == 3
+
+def test_bucket_sizes_come_from_the_home_region(fake):
+    result = collectors.collect_s3(FakeContext())
+
+    assert result["total_count"] == 30
+    assert all(bucket["size"] is not None for bucket in result["s3Buckets"])
+    # No GetBucketLocation, ListBuckets already names the region of every bucket
+    assert ("s3", "GetBucketLocation") not in fake.calls
+
+def test_regressions_are_reported_against_the_baseline():
+    baseline = {"peak_rss_mb": 100, "endpoints": {
+        "GET /ec2": {"p95_ms": 10, "aws_calls": 0},
+        "GET /ebs": {"p95_ms": 2, "aws_calls": 0},
+    }}
+    report = {"peak_rss_mb": 110, "endpoints": {
+        "GET /ec2": {"p95_ms": 40, "aws_calls": 1},
+        # Three times slower but within the noise
+        "GET /ebs": {"p95_ms": 6, "aws_calls": 0},
+    }}
+
+    regressions = run.compare(report, baseline, 0.25)
+
+    assert len(regressions) == 2
+    assert all(regression.startswith("GET /ec2") for regression in regressions)
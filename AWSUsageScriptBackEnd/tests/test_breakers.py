@@ -0,0 +1,104 @@
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import boto3
+import pytest
+from botocore.exceptions import ClientError
+from botocore.retries.standard import ExponentialBackoff
+import aws_clients
+import breakers
+
+FAILED = b"<Response><Errors><Error><Code>InternalError</Code><Message>An internal error has occurred.</Message></Error></Errors><RequestID>1</RequestID></Response>"
+ADDRESSES = b'<DescribeAddressesResponse xmlns="http://ec2.amazonaws.com/doc/2016-11-15/"><requestId>1</requestId><addressesSet/></DescribeAddressesResponse>'
+
+# Local EC2 endpoint answering with server errors while it is down
+@pytest.fixture
+def ec2_endpoint(monkeypatch):
+    monkeypatch.setattr(ExponentialBackoff, "delay_amount", lambda self, context: 0)
+    state = {"requests": 0, "down": True}
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            self.rfile.read(int(self.headers["Content-Length"]))
+            state["requests"] += 1
+            body = FAILED if state["down"] else ADDRESSES
+            self.send_response(500 if state["down"] else 200)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield f"http://127.0.0.1:{server.server_address[1]}", state
+    server.shutdown()
+
+def ec2_client(endpoint, circuits):
+    client = boto3.client(
+        "ec2",
+        region_name="ap-southeast-2",
+        endpoint_url=endpoint,
+        aws_access_key_id="testing",
+        aws_secret_access_key="testing",
+        config=aws_clients.CLIENT_CONFIG,
+    )
+    circuits.attach(client, "123456789012")
+    return client
+
+def error_code(client):
+    with pytest.raises(ClientError) as error:
+        client.describe_addresses()
+    return error.value.response["Error"]["Code"]
+
+def test_failing_endpoints_fail_fast_until_a_probe_succeeds(ec2_endpoint, monkeypatch):
+    endpoint, state = ec2_endpoint
+    monkeypatch.setattr(breakers, "FAILURE_THRESHOLD", 5)
+    monkeypatch.setattr(breakers, "OPEN_SECONDS", 0.2)
+    circuits = breakers.CircuitBreakers(16)
+    client = ec2_client(endpoint, circuits)
+
+    # Three attempts each, the circuit opens during the retries of the second call
+    assert error_code(client) == "InternalError"
+    assert error_code(client) == "CircuitOpen"
+    assert state["requests"] == 5
+
+    # No request reaches the endpoint while the circuit is open
+    assert error_code(client) == "CircuitOpen"
+    assert state["requests"] == 5
+    stats = circuits.stats()
+    assert stats["open"]["123456789012/ap-southeast-2/ec2"]["state"] == "open"
+    assert stats["rejected"] == 2
+
+    # The first call after the pause is the probe, it closes the circuit again
+    state["down"] = False
+    time.sleep(0.25)
+    assert client.describe_addresses()["Addresses"] == []
+    assert circuits.stats()["open"] == {}
+
+def test_failed_probes_open_the_circuit_again():
+    breaker = breakers.Breaker()
+    for _ in range(breakers.FAILURE_THRESHOLD):
+        breaker.record(False, False, 100.0)
+    assert breaker.state == breakers.OPEN
+
+    later = 100.0 + breakers.OPEN_SECONDS
+    # Only one probe at a time
+    assert breaker.allow(later) == (True, True)
+    assert breaker.allow(later) == (False, False)
+
+    assert breaker.record(False, True, later)
+    assert breaker.state == breakers.OPEN
+    assert breaker.retry_in(later) == breakers.OPEN_SECONDS
+
+def test_client_errors_and_throttles_keep_the_circuit_closed():
+    breaker = breakers.Breaker()
+    denied = (None, {"Error": {"Code": "AccessDenied"}, "ResponseMetadata": {"HTTPStatusCode": 403}})
+    throttled = (None, {"Error": {"Code": "RequestLimitExceeded"}, "ResponseMetadata": {"HTTPStatusCode": 503}})
+
+    for _ in range(breakers.FAILURE_THRESHOLD * 2):
+        breaker.record(breakers.attempt_outcome(denied), False, 100.0)
+        breaker.record(breakers.attempt_outcome(throttled), False, 100.0)
+
+    assert breaker.state == breakers.CLOSED
@@ -0,0 +1,78 @@
+import threading
+import time
+import boto3
+from botocore.awsrequest import AWSResponse
+from botocore.exceptions import ClientError
+import coalescing
+
+# Client whose calls take a while and are counted, answered after the coalescing handlers
+def slow_client(flights, response, seconds=0.2):
+    client = boto3.client("ec2", region_name="ap-southeast-2", aws_access_key_id="testing", aws_secret_access_key="testing")
+    flights.attach(client, "123456789012")
+    calls = []
+
+    def respond(model, **kwargs):
+        calls.append(model.name)
+        time.sleep(seconds)
+        return AWSResponse(None, response.get("ResponseMetadata", {}).get("HTTPStatusCode", 200), {}, None), response
+
+    client.meta.events.register_last("before-call", respond)
+    return client, calls
+
+def concurrently(count, call):
+    results = [None] * count
+
+    def run(index):
+        try:
+            results[index] = call()
+        except Exception as e:
+            results[index] = e
+
+    threads = [threading.Thread(target=run, args=(index,)) for index in range(count)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
+
+def test_identical_calls_in_flight_share_one_upstream_call():
+    flights = coalescing.SingleFlight()
+    client, calls = slow_client(flights, {"Reservations": [{"Instances": [{"InstanceId": "i-1"}]}]})
+
+    results = concurrently(8, lambda: client.describe_instances(MaxResults=1000))
+
+    assert calls == ["DescribeInstances"]
+    assert all(result["Reservations"][0]["Instances"][0]["InstanceId"] == "i-1" for result in results)
+    # Every caller gets its own copy
+    assert len({id(result) for result in results}) == 8
+    assert flights.stats() == {"in_flight": 0, "upstream_calls": 1, "shared_calls": 7}
+
+def test_different_parameters_are_not_shared():
+    flights = coalescing.SingleFlight()
+    client, calls = slow_client(flights, {"Reservations": []}, seconds=0.1)
+
+    concurrently(2, lambda: client.describe_instances(MaxResults=1000))
+    concurrently(1, lambda: client.describe_instances(MaxResults=500))
+
+    assert len(calls) == 2
+
+def test_errors_are_shared_with_the_followers():
+    flights = coalescing.SingleFlight()
+    client, calls = slow_client(flights, {
+        "Error": {"Code": "UnauthorizedOperation", "Message": "Not allowed"},
+        "ResponseMetadata": {"HTTPStatusCode": 403},
+    })
+
+    results = concurrently(4, client.describe_addresses)
+
+    assert calls == ["DescribeAddresses"]
+    assert all(isinstance(result, ClientError) for result in results)
+    assert flights.stats()["in_flight"] == 0
+
+def test_calls_that_change_something_are_never_shared():
+    flights = coalescing.SingleFlight()
+    client, calls = slow_client(flights, {"Return": True}, seconds=0.1)
+
+    concurrently(3, lambda: client.delete_tags(Resources=["i-1"]))
+
+    assert calls == ["DeleteTags"] * 3
@@ -0,0 +1,63 @@
+import asyncio
+import pytest
+from fastapi.testclient import TestClient
+import app as backend
+import history
+import snapshots
+from aws_clients import AWSContext
+
+@pytest.fixture
+def ec2(tmp_path, monkeypatch):
+    snapshots.store.clear()
+    monkeypatch.setattr(history, "store", history.HistoryStore(str(tmp_path)))
+    monkeypatch.setattr(snapshots.store, "history", history.store)
+    backend.app.dependency_overrides[backend.get_aws_context] = lambda: AWSContext("123456789012", "us-east-1")
+
+    instances = [{"instance_id": "i-1", "state": "running"}, {"instance_id": "i-2", "state": "running"}]
+
+    def collect(aws):
+        return {"success": True, "ec2Instances": [dict(instance) for instance in instances], "total_count": len(instances)}
+
+    monkeypatch.setitem(backend.collectors.COLLECTORS["ec2"], "collect", collect)
+    yield instances
+    backend.app.dependency_overrides.clear()
+    snapshots.store.clear()
+
+def refresh(name):
+    key = backend.snapshot_key(name, AWSContext("123456789012", "us-east-1"))
+    asyncio.run(snapshots.store.refresh(key))
+
+def test_unchanged_snapshots_answer_304(ec2):
+    client = TestClient(backend.app)
+
+    first = client.get("/ec2")
+    assert first.status_code == 200
+    assert first.json()["total_count"] == 2
+    assert first.json()["snapshot"]["version"] == 1
+    etag = first.headers["etag"]
+
+    cached = client.get("/ec2", headers={"If-None-Match": etag})
+    assert cached.status_code == 304
+    assert cached.content == b""
+
+    ec2[0]["state"] = "stopped"
+    refresh("ec2")
+    changed = client.get("/ec2", headers={"If-None-Match": etag})
+    assert changed.status_code == 200
+    assert changed.headers["etag"] != etag
+
+def test_since_returns_only_the_changes(ec2):
+    client = TestClient(backend.app)
+    assert client.get("/ec2").json()["snapshot"]["version"] == 1
+
+    ec2[0]["state"] = "stopped"
+    ec2.pop()
+    refresh("ec2")
+
+    body = client.get("/ec2", params={"since": 1}).json()
+    assert body["snapshot"]["version"] == 2
+    assert body["upserts"] == [{"instance_id": "i-1", "state": "stopped", "account_id": "123456789012", "region": "us-east-1"}]
+    assert body["deletes"] == ["123456789012/us-east-1/i-2"]
+
+    assert client.get("/ec2", params={"since": 2}).json()["total_count"] == 0
+    assert client.get("/ec2", params={"since": 5}).status_code == 400
@@ -0,0 +1,100 @@
+from datetime import datetime, timezone
+from botocore.stub import ANY
+import collectors
+
+def s3_metric(metric_name, bucket, storage_type):
+    return {
+        "Namespace": "AWS/S3",
+        "MetricName": metric_name,
+        "Dimensions": [
+            {"Name": "BucketName", "Value": bucket},
+            {"Name": "StorageType", "Value": storage_type},
+        ],
+    }
+
+def test_s3_sizes_are_batched_per_region(aws):
+    sydney = [f"syd-{i}" for i in range(300)]
+    virginia = ["use-0", "use-1"]
+
+    aws.stub("s3").add_response("list_buckets", {
+        "Buckets": [{"Name": name, "BucketRegion": "ap-southeast-2"} for name in sydney]
+                 + [{"Name": name, "BucketRegion": "us-east-1"} for name in virginia],
+    }, {"MaxBuckets": 1000})
+
+    # Sydney: 300 standard + 300 glacier sizes + 300 object counts = 900 queries -> 2 GetMetricData calls
+    cloudwatch = aws.stub("cloudwatch", "ap-southeast-2")
+    cloudwatch.add_response("list_metrics", {"Metrics":
+        [s3_metric("BucketSizeBytes", name, "StandardStorage") for name in sydney]
+        + [s3_metric("BucketSizeBytes", name, "GlacierStorage") for name in sydney]
+        # Metrics of buckets from another account are ignored
+        + [s3_metric("BucketSizeBytes", "someone-else", "StandardStorage")]
+    }, {"Namespace": "AWS/S3", "MetricName": "BucketSizeBytes"})
+    cloudwatch.add_response("list_metrics", {"Metrics":
+        [s3_metric("NumberOfObjects", name, "AllStorageTypes") for name in sydney]
+    }, {"Namespace": "AWS/S3", "MetricName": "NumberOfObjects"})
+    for size in (500, 400):
+        cloudwatch.add_response("get_metric_data", {"MetricDataResults": [
+            {"Id": f"m{i}", "Values": [1024**3 * 2, 1.0]} for i in range(size)
+        ]}, {"MetricDataQueries": ANY, "StartTime": ANY, "EndTime": ANY, "ScanBy": "TimestampDescending"})
+
+    virginia_cloudwatch = aws.stub("cloudwatch", "us-east-1")
+    virginia_cloudwatch.add_response("list_metrics", {"Metrics": []}, {"Namespace": "AWS/S3", "MetricName": "BucketSizeBytes"})
+    virginia_cloudwatch.add_response("list_metrics", {"Metrics": []}, {"Namespace": "AWS/S3", "MetricName": "NumberOfObjects"})
+
+    result = collectors.collect_s3(aws)
+
+    aws.assert_no_pending_responses()
+    assert result["success"] == True
+    assert result["total_count"] == 302
+
+    buckets = {bucket["name"]: bucket for bucket in result["s3Buckets"]}
+    assert buckets["syd-7"]["region"] == "ap-southeast-2"
+    assert buckets["syd-7"]["storage"] == {"StandardStorage": 2.0, "GlacierStorage": 2.0}
+    assert buckets["syd-7"]["size"] == 4.0
+    assert buckets["syd-7"]["objects"] == 1024**3 * 2
+    assert buckets["use-1"]["size"] is None
+
+def test_s3_bucket_region_falls_back_to_location(aws):
+    stub = aws.stub("s3")
+    stub.add_response("get_bucket_location", {"LocationConstraint": "EU"}, {"Bucket": "old"})
+    stub.add_response("get_bucket_location", {}, {"Bucket": "virginia"})
+
+    assert collectors.s3_bucket_region(aws.client("s3"), {"Name": "old"}) == "eu-west-1"
+    assert collectors.s3_bucket_region(aws.client("s3"), {"Name": "virginia"}) == "us-east-1"
+
+def ec2_instance(instance_id, state="running"):
+    return {
+        "InstanceId": instance_id,
+        "InstanceType": "t3.micro",
+        "State": {"Code": 16, "Name": state},
+        "LaunchTime": datetime(2025, 1, 1, tzinfo=timezone.utc),
+    }
+
+def test_ec2_reads_every_page(aws):
+    stub = aws.stub("ec2")
+    stub.add_response("describe_instances", {
+        "Reservations": [{"Instances": [ec2_instance("i-1"), ec2_instance("i-2")]}],
+        "NextToken": "page-2",
+    }, {"MaxResults": 1000})
+    stub.add_response("describe_instances", {
+        "Reservations": [{"Instances": [ec2_instance("i-3", "stopped")]}],
+    }, {"MaxResults": 1000, "NextToken": "page-2"})
+
+    result = collectors.collect_ec2(aws)
+
+    aws.assert_no_pending_responses()
+    assert [instance["instance_id"] for instance in result["ec2Instances"]] == ["i-1", "i-2", "i-3"]
+    assert [instance["state"] for instance in result["ec2Instances"]] == ["running", "running", "stopped"]
+    assert result["total_count"] == 3
+
+def test_ebs_lists_each_volume_once(aws):
+    aws.stub("ec2").add_response("describe_volumes", {"Volumes": [
+        {"VolumeId": "vol-1", "Size": 8, "VolumeType": "gp3", "State": "in-use", "Attachments": [{"InstanceId": "i-1"}]},
+        {"VolumeId": "vol-2", "Size": 100, "VolumeType": "gp2", "State": "available", "Attachments": []},
+    ]}, {"MaxResults": 500})
+
+    result = collectors.collect_ebs_volumes(aws)
+
+    assert [volume["id"] for volume in result["ebsVolumes"]] == ["vol-1", "vol-2"]
+    assert result["ebsVolumes"][1]["attachedTo"] == "No attachment"
+    assert result["total_size"] == 108
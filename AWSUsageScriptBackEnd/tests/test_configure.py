@@ -0,0 +1,57 @@
+import time
+import pytest
+from fastapi.testclient import TestClient
+import app as backend
+import aws_clients
+import collectors
+import cost_ledger
+import history
+import snapshots
+from benchmarks.fake_aws import FakeAWS
+
+LOGIN = {"access_key": "AKIATESTING000000000", "secret_access_key": "testing"}
+
+@pytest.fixture
+def fake(tmp_path, monkeypatch):
+    snapshots.store.clear()
+    aws_clients.identity_cache.clear()
+    monkeypatch.setattr(snapshots.store, "history", history.HistoryStore(str(tmp_path)))
+    monkeypatch.setattr(cost_ledger.ledger, "data_dir", str(tmp_path))
+    fake = FakeAWS({"instances": 50, "volumes": 50, "buckets": 5, "functions": 10})
+    fake.install()
+    yield fake
+    fake.uninstall()
+    snapshots.store.clear()
+    aws_clients.identity_cache.clear()
+
+def test_repeated_logins_skip_sts(fake, monkeypatch):
+    monkeypatch.setattr(backend, "WARM_UP_ON_LOGIN", False)
+    client = TestClient(backend.app)
+
+    first = client.post("/configure", json=LOGIN).json()
+    second = client.post("/configure", json=LOGIN).json()
+
+    assert first["success"] and second["success"]
+    assert second["token"]["account_id"] == first["token"]["account_id"]
+    assert fake.calls[("sts", "GetCallerIdentity")] == 1
+    assert aws_clients.identity_cache.stats()["hits"] == 1
+
+    # A changed secret is checked again
+    client.post("/configure", json={**LOGIN, "secret_access_key": "rotated"})
+    assert fake.calls[("sts", "GetCallerIdentity")] == 2
+
+def test_login_warms_up_the_snapshots(fake):
+    with TestClient(backend.app) as client:
+        body = client.post("/configure", json=LOGIN).json()
+        assert body["warming_up"] == list(collectors.COLLECTORS)
+
+        # The scans run after the response, the snapshots fill in the background
+        deadline = time.monotonic() + 10
+        while len(snapshots.store.snapshots) < len(collectors.COLLECTORS) and time.monotonic() < deadline:
+            time.sleep(0.05)
+
+        assert {key[0] for key in snapshots.store.snapshots} == set(collectors.COLLECTORS)
+        started = time.perf_counter()
+        response = client.get("/ec2", headers={"Authorization": f"Bearer {body['token']['access_token']}"})
+        assert response.status_code == 200
+        assert time.perf_counter() - started < 1
@@ -0,0 +1,143 @@
+import asyncio
+import threading
+import time
+import pytest
+from botocore.stub import ANY
+import aws_executor
+import collectors
+import cost_cache
+import cost_ledger
+import deadlines
+from cost_cache import StaleWhileRevalidateCache
+
+def test_fresh_entries_are_served_from_the_cache():
+    cache = StaleWhileRevalidateCache(ttl=60, max_stale=60, max_entries=10)
+    calls = []
+
+    def fetch():
+        calls.append(1)
+        return len(calls)
+
+    assert cache.get(("acct", "q"), fetch) == (1, {"age_seconds": 0, "stale": False})
+    assert cache.get(("acct", "q"), fetch)[0] == 1
+    assert len(calls) == 1
+    assert cache.stats()["hits"] == 1
+
+def test_stale_entries_are_served_while_refreshing():
+    cache = StaleWhileRevalidateCache(ttl=0, max_stale=60, max_entries=10)
+    refreshed = threading.Event()
+    values = iter(["old", "new"])
+
+    def fetch():
+        value = next(values)
+        if value == "new":
+            refreshed.set()
+        return value
+
+    assert cache.get(("acct", "q"), fetch)[0] == "old"
+
+    value, meta = cache.get(("acct", "q"), fetch)
+    assert value == "old"
+    assert meta["stale"] is True
+
+    assert refreshed.wait(5)
+    deadline = time.monotonic() + 5
+    while cache.in_flight and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert cache.get(("acct", "q"), fetch)[0] == "new"
+    assert cache.stats()["refreshes"] >= 1
+
+def test_concurrent_misses_share_one_fetch():
+    cache = StaleWhileRevalidateCache(ttl=60, max_stale=60, max_entries=10)
+    started = threading.Event()
+    release = threading.Event()
+    calls = []
+
+    def fetch():
+        calls.append(1)
+        started.set()
+        release.wait(5)
+        return "value"
+
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(cache.get(("acct", "q"), fetch)[0])) for _ in range(5)]
+    threads[0].start()
+    assert started.wait(5)
+    for thread in threads[1:]:
+        thread.start()
+    time.sleep(0.05)
+    release.set()
+    for thread in threads:
+        thread.join(5)
+
+    assert results == ["value"] * 5
+    assert len(calls) == 1
+
+def test_callers_waiting_for_a_fetch_hold_no_worker():
+    aws_executor.define_pool("ce_waiters", 1)
+    cache = StaleWhileRevalidateCache(ttl=60, max_stale=60, max_entries=10, service="ce_waiters")
+    release = threading.Event()
+    calls = []
+
+    def fetch():
+        calls.append(1)
+        release.wait(5)
+        return "value"
+
+    async def main():
+        waiting = [asyncio.ensure_future(cache.get_async(("acct", "q"), fetch)) for _ in range(5)]
+        await asyncio.sleep(0.1)
+        stats = aws_executor.get_pool("ce_waiters").stats()
+        # A caller giving up does not cancel the fetch the others wait for
+        waiting[0].cancel()
+        await asyncio.sleep(0.05)
+        release.set()
+        return stats, await asyncio.gather(*waiting[1:])
+
+    stats, results = asyncio.run(main())
+
+    assert stats["running"] == 1
+    assert stats["queued"] == 0
+    assert [value for value, meta in results] == ["value"] * 4
+    assert len(calls) == 1
+
+def test_misses_are_fetched_within_the_deadline_of_the_request():
+    cache = StaleWhileRevalidateCache(ttl=60, max_stale=60, max_entries=10)
+
+    def fetch():
+        time.sleep(0.1)
+        deadlines.check("GetCostAndUsage")
+        return "value"
+
+    async def main():
+        token = deadlines.start(50)
+        try:
+            with pytest.raises(deadlines.DeadlineExceeded):
+                await cache.get_async(("acct", "q"), fetch)
+        finally:
+            deadlines.current.reset(token)
+        assert not cache.entries
+
+        return await cache.get_async(("acct", "q"), fetch)
+
+    assert asyncio.run(main())[0] == "value"
+
+def test_total_and_service_costs_share_one_query(aws, tmp_path, monkeypatch):
+    monkeypatch.setattr(cost_ledger, "ledger", cost_ledger.CostLedger(str(tmp_path), 3, 3600))
+    cost_cache.costs.invalidate()
+    today = cost_ledger.utc_today().isoformat()
+    ce = aws.stub("ce")
+    ce.add_response("get_cost_and_usage", {
+        "ResultsByTime": [{"TimePeriod": {"Start": today, "End": today}, "Groups": [
+            {"Keys": ["Amazon EC2", "us-east-1"], "Metrics": {"UnblendedCost": {"Amount": "12.5", "Unit": "USD"}}},
+            {"Keys": ["Amazon S3", "us-east-1"], "Metrics": {"UnblendedCost": {"Amount": "0.25", "Unit": "USD"}}},
+        ]}],
+    }, {"TimePeriod": ANY, "Granularity": "DAILY", "Metrics": ["UnblendedCost"], "GroupBy": ANY})
+
+    total = asyncio.run(collectors.collect_total_cost(aws))
+    services = asyncio.run(collectors.collect_service_costs(aws))
+
+    assert total["totalCost"] == 12.75
+    assert services["total_cost"] == 12.75
+    assert services["cache"]["stale"] is False
+    aws.assert_no_pending_responses()
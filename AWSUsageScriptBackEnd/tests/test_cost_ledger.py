@@ -0,0 +1,125 @@
+import gzip
+import json
+import threading
+from datetime import date
+import pytest
+from cost_ledger import CostLedger, InvalidDateRange
+
+TODAY = date(2024, 3, 10)
+
+def cost_group(first, second, amount):
+    return {"Keys": [first, second], "Metrics": {"UnblendedCost": {"Amount": str(amount), "Unit": "USD"}}}
+
+# One grouped GetCostAndUsage for the whole period
+def stub_period(aws, start, end, days, group_by=("SERVICE", "REGION")):
+    aws.stub("ce").add_response("get_cost_and_usage", {
+        "ResultsByTime": [
+            {"TimePeriod": {"Start": day, "End": day}, "Groups": groups} for day, groups in days.items()
+        ],
+    }, {
+        "TimePeriod": {"Start": start, "End": end},
+        "Granularity": "DAILY",
+        "Metrics": ["UnblendedCost"],
+        "GroupBy": [{"Type": "DIMENSION", "Key": key} for key in group_by],
+    })
+
+def test_ledger_groups_cells_by_any_dimension(aws, tmp_path):
+    ledger = CostLedger(str(tmp_path), 3, 3600)
+    stub_period(aws, "2024-03-01", "2024-03-03", {
+        "2024-03-01": [cost_group("Amazon EC2", "us-east-1", 2), cost_group("Amazon S3", "us-east-1", 1), cost_group("Amazon EC2", "eu-west-1", 4)],
+        "2024-03-02": [cost_group("Amazon EC2", "us-east-1", 3)],
+    })
+
+    rows, total = ledger.query(aws, date(2024, 3, 1), date(2024, 3, 3), ["service"], today=TODAY)
+    assert total == 10
+    assert rows == [{"service": "Amazon EC2", "cost": 9}, {"service": "Amazon S3", "cost": 1}]
+
+    # Already in the ledger, answered without Cost Explorer
+    rows, _ = ledger.query(aws, date(2024, 3, 1), date(2024, 3, 2), ["date", "region"], today=TODAY)
+    assert rows[0] == {"date": "2024-03-01", "region": "eu-west-1", "cost": 4}
+    aws.assert_no_pending_responses()
+    assert ledger.cost_explorer_calls == 1
+
+def test_usage_types_are_only_fetched_when_asked_for(aws, tmp_path):
+    ledger = CostLedger(str(tmp_path), 3, 3600)
+    stub_period(aws, "2024-03-01", "2024-03-02", {"2024-03-01": [cost_group("Amazon EC2", "us-east-1", 2)]})
+    ledger.query(aws, date(2024, 3, 1), date(2024, 3, 2), ["service", "region"], today=TODAY)
+
+    stub_period(aws, "2024-03-01", "2024-03-02", {
+        "2024-03-01": [cost_group("us-east-1", "BoxUsage", 1.5), cost_group("us-east-1", "DataTransfer-Out", 0.5)],
+    }, group_by=("REGION", "USAGE_TYPE"))
+    rows, total = ledger.query(aws, date(2024, 3, 1), date(2024, 3, 2), ["region", "usage_type"], today=TODAY)
+
+    assert rows[0] == {"region": "us-east-1", "usage_type": "BoxUsage", "cost": 1.5}
+    assert total == 2
+    aws.assert_no_pending_responses()
+
+    # Cost Explorer can not split a day by all three
+    with pytest.raises(InvalidDateRange):
+        ledger.query(aws, date(2024, 3, 1), date(2024, 3, 2), ["service", "region", "usage_type"], today=TODAY)
+
+def test_closed_days_are_never_fetched_again(aws, tmp_path):
+    stub_period(aws, "2024-03-01", "2024-03-10", {"2024-03-08": [cost_group("Amazon EC2", "us-east-1", 5)]})
+    CostLedger(str(tmp_path), 3, 3600).query(aws, date(2024, 3, 1), date(2024, 3, 10), ["date"], today=TODAY)
+    aws.assert_no_pending_responses()
+
+    # A new process reads the closed days from disk and only fetches the open ones
+    ledger = CostLedger(str(tmp_path), 3, 0)
+    stub_period(aws, "2024-03-07", "2024-03-11", {"2024-03-08": [cost_group("Amazon EC2", "us-east-1", 6)]})
+    rows, total = ledger.query(aws, date(2024, 3, 1), date(2024, 3, 11), ["date"], today=TODAY)
+
+    assert rows == [{"date": "2024-03-08", "cost": 6}]
+    assert total == 6
+    aws.assert_no_pending_responses()
+
+def test_months_in_another_format_are_fetched_again(aws, tmp_path):
+    path = tmp_path / "costs" / "123456789012" / "2024-02.json.gz"
+    path.parent.mkdir(parents=True)
+    with gzip.open(path, "wt", encoding="utf-8") as file:
+        json.dump({"version": 1, "strings": ["Amazon EC2", "us-east-1", "BoxUsage"], "days": {
+            "2024-02-01": {"fetched_at": 0, "closed": True, "cells": [[0, 1, 2, 2.0]]},
+        }}, file)
+    stub_period(aws, "2024-02-01", "2024-02-02", {"2024-02-01": [cost_group("Amazon EC2", "us-east-1", 4)]})
+
+    ledger = CostLedger(str(tmp_path), 3, 3600)
+    rows, _ = ledger.query(aws, date(2024, 2, 1), date(2024, 2, 2), ["service"], today=TODAY)
+
+    assert rows == [{"service": "Amazon EC2", "cost": 4.0}]
+    assert ledger.cost_explorer_calls == 1
+    aws.assert_no_pending_responses()
+
+# Cost Explorer stand-in whose calls wait until they are released
+class SlowCostExplorer:
+    def __init__(self):
+        self.account_id = "123456789012"
+        self.started = threading.Event()
+        self.release = threading.Event()
+
+    def client(self, service):
+        return self
+
+    def get_cost_and_usage(self, TimePeriod, **kwargs):
+        self.started.set()
+        self.release.wait(5)
+        return {"ResultsByTime": [{"TimePeriod": {"Start": TimePeriod["Start"]}, "Groups": [cost_group("Amazon EC2", "us-east-1", 1)]}]}
+
+def test_reads_are_not_held_up_by_a_fetch(tmp_path):
+    ledger = CostLedger(str(tmp_path), 3, 3600)
+    aws = SlowCostExplorer()
+    aws.release.set()
+    ledger.query(aws, date(2024, 3, 1), date(2024, 3, 2), ["service"], today=TODAY)
+
+    aws.started.clear()
+    aws.release.clear()
+    fetching = threading.Thread(target=ledger.query, args=(aws, date(2024, 3, 2), date(2024, 3, 3), ["service"]), kwargs={"today": TODAY})
+    fetching.start()
+    assert aws.started.wait(5)
+
+    # The day already in the ledger is answered while the other one is being fetched
+    rows, _ = ledger.query(aws, date(2024, 3, 1), date(2024, 3, 2), ["service"], today=TODAY)
+    assert fetching.is_alive()
+    aws.release.set()
+    fetching.join(5)
+
+    assert rows == [{"service": "Amazon EC2", "cost": 1.0}]
+    assert ledger.cost_explorer_calls == 2
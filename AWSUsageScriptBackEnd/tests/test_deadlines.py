@@ -0,0 +1,105 @@
+import time
+import boto3
+import pytest
+from fastapi.testclient import TestClient
+import app as backend
+import deadlines
+import history
+import rate_limits
+import snapshots
+from aws_clients import AWSContext
+
+@pytest.fixture
+def client(tmp_path, monkeypatch):
+    snapshots.store.clear()
+    monkeypatch.setattr(snapshots.store, "history", history.HistoryStore(str(tmp_path)))
+    backend.app.dependency_overrides[backend.get_aws_context] = lambda: AWSContext("123456789012", "ap-southeast-2")
+    # Kept open so scans outliving a request finish on the same event loop
+    with TestClient(backend.app) as client:
+        yield client
+    backend.app.dependency_overrides.clear()
+    snapshots.store.clear()
+
+@pytest.fixture
+def budget():
+    token = None
+
+    def start(budget_ms):
+        nonlocal token
+        token = deadlines.start(budget_ms)
+
+    yield start
+    if token is not None:
+        deadlines.current.reset(token)
+
+def slow_collector(seconds, result):
+    def collector(aws):
+        time.sleep(seconds)
+        return result
+    return collector
+
+def account_wide(service, collector, items=None):
+    return {"service": service, "collect": collector, "pages": None, "items": items, "regional": False, "totals": []}
+
+def test_late_collectors_answer_partial_and_finish_in_the_background(client, monkeypatch):
+    monkeypatch.setitem(backend.collectors.COLLECTORS, "ec2", account_wide("ec2", slow_collector(0.5, {
+        "success": True, "ec2Instances": [{"instance_id": "i-1"}], "total_count": 1,
+    }), items="ec2Instances"))
+
+    started = time.perf_counter()
+    body = client.get("/ec2?deadline_ms=100").json()
+
+    assert time.perf_counter() - started < 0.4
+    assert body["partial"] == True
+    assert body["ec2Instances"] == []
+
+    time.sleep(0.6)
+    body = client.get("/ec2?deadline_ms=100").json()
+    assert "partial" not in body
+    assert body["total_count"] == 1
+
+def test_inventory_keeps_the_services_that_made_it(client, monkeypatch):
+    monkeypatch.setattr(backend, "INVENTORY_COLLECTORS", {
+        "ec2": account_wide("ec2", slow_collector(0, {"success": True, "total_count": 3})),
+        "rds": account_wide("rds", slow_collector(1, {"success": True, "total_count": 1}), items="rdsInstances"),
+    })
+
+    started = time.perf_counter()
+    body = client.get("/inventory?deadline_ms=200").json()
+
+    assert time.perf_counter() - started < 0.8
+    assert body["success"] == False
+    assert body["partial"] == ["rds"]
+    assert body["failed"] == []
+    assert body["services"]["ec2"]["data"]["total_count"] == 3
+    assert body["services"]["rds"]["status"] == "partial"
+    assert body["services"]["rds"]["data"]["rdsInstances"] == []
+
+def test_invalid_deadlines_are_rejected(client):
+    response = client.get("/ec2?deadline_ms=soon")
+
+    assert response.status_code == 400
+
+def test_aws_calls_do_not_start_after_the_deadline(budget):
+    client = boto3.client("sts", region_name="ap-southeast-2", aws_access_key_id="testing", aws_secret_access_key="testing")
+    deadlines.attach(client)
+    budget(1)
+    time.sleep(0.01)
+
+    with pytest.raises(deadlines.DeadlineExceeded):
+        client.get_caller_identity()
+
+def test_rate_limited_calls_fail_instead_of_waiting_past_the_deadline(budget):
+    limiter = rate_limits.RateLimiter(16)
+    key = ("123456789012", "ap-southeast-2", "ce", "GetCostAndUsage")
+    for _ in range(5):
+        limiter.acquire(key)
+    budget(50)
+
+    started = time.perf_counter()
+    with pytest.raises(deadlines.DeadlineExceeded):
+        limiter.acquire(key)
+
+    assert time.perf_counter() - started < 0.05
+    # The token was given back for the next call
+    assert limiter.bucket(key).tokens == pytest.approx(0, abs=0.1)
@@ -0,0 +1,83 @@
+import json
+from datetime import datetime, timezone
+import pytest
+from fastapi.encoders import jsonable_encoder
+from fastapi.testclient import TestClient
+import app as backend
+import encoding
+import history
+import records
+import snapshots
+from aws_clients import AWSContext
+
+LAUNCHED = datetime(2024, 3, 1, 8, 30, tzinfo=timezone.utc)
+
+def ec2_result(count):
+    instances = [records.EC2Instance(instance_id=f"i-{index}", instance_type="t3.micro", state="running", launch_time=LAUNCHED) for index in range(count)]
+    return {"success": True, "message": f"Found {count} instances", "ec2Instances": instances, "total_count": count}
+
+@pytest.fixture
+def client(tmp_path, monkeypatch):
+    snapshots.store.clear()
+    monkeypatch.setattr(snapshots.store, "history", history.HistoryStore(str(tmp_path)))
+    monkeypatch.setitem(backend.collectors.COLLECTORS, "ec2", {
+        "service": "ec2", "collect": lambda aws: ec2_result(3), "pages": None, "items": "ec2Instances", "id": "instance_id", "regional": False, "totals": [],
+    })
+    backend.app.dependency_overrides[backend.get_aws_context] = lambda: AWSContext("123456789012", "ap-southeast-2")
+    yield TestClient(backend.app)
+    backend.app.dependency_overrides.clear()
+    snapshots.store.clear()
+
+def test_json_is_unchanged():
+    result = ec2_result(2)
+
+    expected = json.dumps(jsonable_encoder(result), ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+    assert encoding.dumps(result) == expected
+
+def test_the_preferred_available_encoding_is_picked(monkeypatch):
+    monkeypatch.setattr(encoding, "msgpack", object())
+
+    assert encoding.negotiate(None) == encoding.JSON
+    assert encoding.negotiate("text/html, */*;q=0.8") == encoding.JSON
+    assert encoding.negotiate("application/json;q=0.5, application/msgpack") == encoding.MSGPACK
+    assert encoding.negotiate("application/x-msgpack") == encoding.MSGPACK
+    # Arrow is only offered where the response is one table
+    assert encoding.negotiate("application/vnd.apache.arrow.stream", (encoding.JSON, encoding.MSGPACK)) == encoding.JSON
+
+def test_missing_libraries_are_not_acceptable(client, monkeypatch):
+    monkeypatch.setattr(encoding, "msgpack", None)
+
+    assert encoding.negotiate("application/msgpack, application/json") == encoding.JSON
+    response = client.get("/ec2", headers={"Accept": "application/msgpack"})
+    assert response.status_code == 406
+
+def test_collectors_answer_in_messagepack(client):
+    msgpack = pytest.importorskip("msgpack")
+
+    as_json = client.get("/ec2")
+    response = client.get("/ec2", headers={"Accept": "application/msgpack"})
+
+    assert response.headers["content-type"] == "application/msgpack"
+    assert response.headers["etag"] != as_json.headers["etag"]
+    body = msgpack.unpackb(response.content)
+    assert body["ec2Instances"] == as_json.json()["ec2Instances"]
+    assert body["snapshot"]["version"] == as_json.json()["snapshot"]["version"]
+
+def test_collectors_answer_in_arrow(client):
+    pyarrow = pytest.importorskip("pyarrow")
+    import pyarrow.ipc
+
+    response = client.get("/ec2", headers={"Accept": "application/vnd.apache.arrow.stream"})
+
+    table = pyarrow.ipc.open_stream(response.content).read_all()
+    assert table.column("instance_id").to_pylist() == ["i-0", "i-1", "i-2"]
+    assert table.column("launch_time").to_pylist()[0] == LAUNCHED
+    assert json.loads(table.schema.metadata[b"response"])["total_count"] == 3
+
+def test_mixed_columns_are_sent_as_json_text():
+    pyarrow = pytest.importorskip("pyarrow")
+
+    column = encoding.arrow_column(["No attachment", [{"InstanceId": "i-1"}], None])
+
+    assert column.type == pyarrow.string()
+    assert column.to_pylist() == ["\"No attachment\"", "[{\"InstanceId\":\"i-1\"}]", None]
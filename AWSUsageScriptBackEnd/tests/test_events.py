@@ -0,0 +1,101 @@
+import asyncio
+import json
+from fastapi.testclient import TestClient
+import app as backend
+import events
+import history
+from events import EventBroker
+from snapshots import SnapshotStore
+
+def scan_of(instances):
+    async def scan():
+        return {"success": True, "ec2Instances": [dict(instance) for instance in instances]}
+    return scan
+
+def parse(message):
+    fields = dict(line.split(": ", 1) for line in message.strip().split("\n"))
+    return fields["event"], json.loads(fields["data"])
+
+def test_changes_are_pushed_to_subscribers_of_the_account(tmp_path, monkeypatch):
+    monkeypatch.setattr(history, "store", history.HistoryStore(str(tmp_path)))
+    broker = EventBroker()
+    store = SnapshotStore()
+    store.history = history.store
+    store.listeners.append(broker.snapshot_taken)
+
+    mine = ("ec2", "111111111111", "us-east-1", "", "")
+    theirs = ("ec2", "222222222222", "us-east-1", "", "")
+    instances = [{"instance_id": "i-1", "state": "running"}, {"instance_id": "i-2", "state": "running"}]
+
+    async def main():
+        await store.read(mine, "ec2", scan_of(instances))
+        await store.read(theirs, "ec2", scan_of([]))
+        subscriber = broker.subscribe([mine])
+        other = broker.subscribe([theirs])
+
+        instances[0]["state"] = "stopped"
+        await store.refresh(mine)
+        # Nothing changed, nothing is sent
+        await store.refresh(mine)
+
+        return subscriber, other
+
+    subscriber, other = asyncio.run(main())
+
+    assert subscriber.queue.qsize() == 1
+    event, data = parse(subscriber.queue.get_nowait())
+    assert event == "ec2"
+    assert data["account_id"] == "111111111111"
+    assert data["upserts"] == [{"instance_id": "i-1", "state": "stopped"}]
+    assert data["deletes"] == []
+    assert other.queue.empty()
+
+def test_subscribers_resync_after_the_snapshots_are_dropped(tmp_path, monkeypatch):
+    monkeypatch.setattr(history, "store", history.HistoryStore(str(tmp_path)))
+    broker = EventBroker()
+    store = SnapshotStore()
+    store.history = history.store
+    store.listeners.append(broker.snapshot_taken)
+
+    key = ("ec2", "111111111111", "us-east-1", "", "")
+    instances = [{"instance_id": "i-1", "state": "running"}]
+
+    async def main():
+        await store.read(key, "ec2", scan_of(instances))
+        subscriber = broker.subscribe([key])
+        assert store.invalidate("111111111111") == 1
+        instances[0]["state"] = "stopped"
+        snapshot = await store.refresh(key)
+        return subscriber, snapshot
+
+    subscriber, snapshot = asyncio.run(main())
+
+    assert subscriber.queue.qsize() == 1
+    assert not subscriber.overflowed
+    event, data = parse(subscriber.queue.get_nowait())
+    assert event == "resync"
+    assert data["service"] == "ec2"
+    assert data["account_id"] == "111111111111"
+    assert data["version"] == snapshot.version
+
+def test_slow_subscribers_are_told_to_resync(monkeypatch):
+    monkeypatch.setattr(events, "EVENT_QUEUE_SIZE", 2)
+    broker = EventBroker()
+
+    async def main():
+        subscriber = broker.subscribe([("cost", "111111111111")])
+        for n in range(3):
+            subscriber.send(events.sse_message("cost", {"n": n}))
+        return [message async for message in broker.stream(subscriber, lambda: None)]
+
+    messages = asyncio.run(main())
+
+    assert parse(messages[0])[0] == "ready"
+    assert parse(messages[-1])[0] == "resync"
+    assert broker.stats()["subscribers"] == 0
+
+def test_events_need_a_token():
+    client = TestClient(backend.app)
+
+    assert client.get("/events").status_code == 401
+    assert client.get("/events", params={"access_token": "not-a-jwt"}).status_code == 401
@@ -0,0 +1,125 @@
+import asyncio
+import time
+import pytest
+import fanout
+
+@pytest.fixture(autouse=True)
+def empty_region_cache(monkeypatch):
+    monkeypatch.setattr(fanout, "enabled_regions_cache", {})
+
+REGIONS = ["ap-southeast-2", "eu-west-1", "us-east-1", "us-west-2"]
+
+def stub_regions(aws):
+    aws.stub("ec2").add_response("describe_regions", {
+        "Regions": [{"RegionName": region} for region in reversed(REGIONS)],
+    }, {})
+
+def test_enabled_regions_are_discovered_once(aws):
+    stub_regions(aws)
+
+    async def main():
+        return await fanout.resolve_regions(aws, "all"), await fanout.resolve_regions(aws, "us-east-1,eu-west-1,us-east-1")
+
+    everything, selected = asyncio.run(main())
+
+    aws.assert_no_pending_responses()
+    assert everything == REGIONS
+    assert selected == ["us-east-1", "eu-west-1"]
+
+def test_unknown_regions_are_rejected(aws):
+    stub_regions(aws)
+
+    with pytest.raises(fanout.InvalidRegions):
+        asyncio.run(fanout.resolve_regions(aws, "us-east-1,mars-north-1"))
+
+def test_no_regions_means_the_token_region(aws):
+    assert asyncio.run(fanout.resolve_regions(aws, None)) == ["ap-southeast-2"]
+
+def test_regions_are_scanned_in_parallel_and_merged(aws):
+    def collect(region_aws):
+        time.sleep(0.2)
+        if region_aws.region == "us-west-2":
+            return {"success": False, "message": "AccessDenied", "ebsVolumes": [], "total_size": 0}
+        return {"success": True, "ebsVolumes": [{"id": f"vol-{region_aws.region}", "size": 10}], "total_size": 10}
+
+    spec = {"service": "fanout-test", "collect": collect, "pages": None, "items": "ebsVolumes", "regional": True, "totals": ["total_size"]}
+    targets = [aws.for_region(region) for region in REGIONS]
+
+    started = time.perf_counter()
+    result = asyncio.run(fanout.scan_targets(spec, targets))
+    elapsed = time.perf_counter() - started
+
+    assert elapsed < 0.6
+    assert result["success"] == True
+    assert result["total_count"] == 3
+    assert result["total_size"] == 30
+    assert result["failed_regions"] == ["us-west-2"]
+    assert {volume["region"] for volume in result["ebsVolumes"]} == {"ap-southeast-2", "eu-west-1", "us-east-1"}
+    assert result["regions"]["eu-west-1"]["total_count"] == 1
+    assert result["errors"] == {"123456789012/us-west-2": "AccessDenied"}
+
+def test_every_region_of_an_account_is_scanned_at_once(aws):
+    regions = [f"region-{index}" for index in range(17)]
+
+    def collect(region_aws):
+        time.sleep(0.3)
+        return {"success": True, "elasticIPs": [{"ip": region_aws.region}]}
+
+    # The EC2, EBS and EIP collectors all run on EC2 workers
+    spec = {"service": "ec2", "collect": collect, "pages": None, "items": "elasticIPs", "regional": True, "totals": []}
+
+    started = time.perf_counter()
+    result = asyncio.run(fanout.scan_targets(spec, [aws.for_region(region) for region in regions]))
+
+    assert time.perf_counter() - started < 0.55
+    assert result["total_count"] == 17
+
+def test_accounts_and_regions_are_merged(aws):
+    def collect(target):
+        return {"success": True, "elasticIPs": [{"ip": f"{target.account_id}-{target.region}"}]}
+
+    spec = {"service": "fanout-test", "collect": collect, "pages": None, "items": "elasticIPs", "regional": True, "totals": []}
+    members = [aws, aws.for_region("us-east-1")]
+    member = aws.for_account("210987654321")
+    targets = members + [member, member.for_region("us-east-1")]
+
+    result = asyncio.run(fanout.scan_targets(spec, targets))
+
+    assert result["total_count"] == 4
+    assert result["accounts"] == {
+        "123456789012": {"success": True, "total_count": 2},
+        "210987654321": {"success": True, "total_count": 2},
+    }
+    assert {(ip["account_id"], ip["region"]) for ip in result["elasticIPs"]} == {
+        ("123456789012", "ap-southeast-2"), ("123456789012", "us-east-1"),
+        ("210987654321", "ap-southeast-2"), ("210987654321", "us-east-1"),
+    }
+
+def test_account_wide_totals_are_added_up(aws):
+    def collect(target):
+        return {"success": True, "total_cost": 1.25}
+
+    spec = {"service": "fanout-test", "collect": collect, "pages": None, "items": None, "regional": False, "totals": ["total_cost"]}
+
+    result = asyncio.run(fanout.scan_targets(spec, [aws, aws.for_account("210987654321")]))
+
+    assert result["total_cost"] == 2.5
+    assert "total_count" not in result
+
+def test_pumps_stop_when_the_stream_is_closed(aws):
+    def pages(region_aws):
+        while True:
+            yield [{"volume_id": "vol-1"}]
+
+    spec = {"service": "fanout-test", "pages": pages, "regional": True}
+
+    async def main():
+        stream = fanout.stream_targets(spec, [aws.for_region(region) for region in REGIONS[:2]])
+        await stream.__anext__()
+        # The client goes away while the pumps wait on a full queue
+        await asyncio.sleep(0.2)
+        await stream.aclose()
+        await asyncio.sleep(0.2)
+        return [task for task in asyncio.all_tasks() if task is not asyncio.current_task()]
+
+    assert asyncio.run(main()) == []
@@ -0,0 +1,155 @@
+import gzip
+import time
+from datetime import datetime, timezone
+from fastapi.testclient import TestClient
+import app as backend
+import collectors
+import history
+import records
+from aws_clients import AWSContext
+from history import HistoryStore, ScopeHistory
+
+LAUNCHED = datetime(2024, 1, 1, tzinfo=timezone.utc)
+
+def instance(instance_id, state="running", region="us-east-1"):
+    record = records.EC2Instance(instance_id=instance_id, instance_type="t3.micro", state=state, launch_time=LAUNCHED)
+    record["account_id"] = "123456789012"
+    record["region"] = region
+    return record
+
+# The instances of one region as the EC2 collector and the fan-out return them
+def scan(aws, states: dict):
+    aws.stub("ec2").add_response("describe_instances", {"Reservations": [{"Instances": [
+        {"InstanceId": instance_id, "InstanceType": "t3.micro", "State": {"Name": state}, "LaunchTime": LAUNCHED}
+        for instance_id, state in states.items()
+    ]}]}, {"MaxResults": 1000})
+
+    found = collectors.collect_ec2(aws)["ec2Instances"]
+    for record in found:
+        record["account_id"] = aws.account_id
+        record["region"] = aws.region
+
+    return found
+
+def test_unchanged_resources_are_stored_once(tmp_path):
+    scope = ScopeHistory(str(tmp_path))
+    scope.append([instance("i-1"), instance("i-2")], "instance_id", 1000)
+    scope.append([instance("i-1"), instance("i-2")], "instance_id", 2000)
+    scope.append([instance("i-1", "stopped"), instance("i-2")], "instance_id", 3000)
+
+    assert len(scope.objects) == 3
+    assert scope.scans[1]["upserts"] == {}
+    assert list(scope.scans[2]["upserts"]) == ["123456789012/us-east-1/i-1"]
+
+def test_diff_lists_added_removed_and_changed(aws, tmp_path):
+    scope = ScopeHistory(str(tmp_path))
+    scope.append(scan(aws, {"i-1": "running", "i-2": "running"}), "instance_id", 1000)
+    scope.append(scan(aws, {"i-1": "stopped", "i-3": "running"}), "instance_id", 2000)
+    # Changed back and forth between the two versions is not a change
+    scope.append(scan(aws, {"i-1": "stopped", "i-3": "running", "i-2": "running"}), "instance_id", 3000)
+    scope.append(scan(aws, {"i-1": "stopped", "i-3": "running"}), "instance_id", 4000)
+
+    diff = scope.diff(1, 4)
+
+    assert [resource["instance_id"] for resource in diff["added"]] == ["i-3"]
+    assert [resource["instance_id"] for resource in diff["removed"]] == ["i-2"]
+    assert diff["changed"][0]["fields"] == ["state"]
+    assert diff["changed"][0]["after"]["state"] == "stopped"
+
+def test_load_balancers_of_each_kind_are_kept_apart(tmp_path):
+    scope = ScopeHistory(str(tmp_path))
+    classic = records.LoadBalancer(name="web", type="Classic LB", scheme="internet-facing", state="")
+    application = records.LoadBalancer(name="web", type="APPLICATION", scheme="internal", state="active")
+    id_field = collectors.COLLECTORS["elb"]["id"]
+
+    scope.append([classic, application], id_field, 1000)
+    scope.append([classic], id_field, 2000)
+
+    assert len(scope.current) == 1
+    assert [resource["type"] for resource in scope.diff(1, 2)["removed"]] == ["APPLICATION"]
+
+def test_history_is_reloaded_from_disk(tmp_path):
+    ScopeHistory(str(tmp_path)).append([instance("i-1")], "instance_id", 1000)
+    ScopeHistory(str(tmp_path)).append([instance("i-1"), instance("i-2")], "instance_id", 2000)
+
+    scope = ScopeHistory(str(tmp_path))
+
+    assert scope.latest_version() == 2
+    assert scope.resolve(datetime.fromtimestamp(1500, timezone.utc).isoformat()) == 1
+    assert [resource["instance_id"] for resource in scope.diff(1, 2)["added"]] == ["i-2"]
+
+def test_cut_off_appends_are_dropped(tmp_path):
+    scope = ScopeHistory(str(tmp_path))
+    scope.append([instance("i-1")], "instance_id", 1000)
+    with open(scope.scans_path, "ab") as file:
+        file.write(gzip.compress(b'{"version": 2, "taken_at": 2000, "upserts": {}, "deletes": []}\n')[:20])
+
+    scope = ScopeHistory(str(tmp_path))
+
+    assert scope.latest_version() == 1
+    assert scope.append([instance("i-2")], "instance_id", 2000) == 2
+    assert ScopeHistory(str(tmp_path)).latest_version() == 2
+
+def test_diffs_start_from_the_nearest_checkpoint(tmp_path, monkeypatch):
+    monkeypatch.setattr(history, "HISTORY_CHECKPOINT_SCANS", 2)
+    scope = ScopeHistory(str(tmp_path))
+    for version in range(1, 6):
+        scope.append([instance(f"i-{n}", "stopped" if n == version else "running") for n in range(version + 1)], "instance_id", version * 1000)
+
+    assert sorted(scope.checkpoints) == [0, 2, 4]
+    # Read back from disk, the checkpoints are taken again
+    reloaded = ScopeHistory(str(tmp_path))
+    assert reloaded.latest_version() == 5
+    assert sorted(reloaded.checkpoints) == [0, 2, 4]
+
+    diff = reloaded.diff(3, 5)
+    assert [resource["instance_id"] for resource in diff["added"]] == ["i-4", "i-5"]
+    assert [change["id"] for change in diff["changed"]] == ["123456789012/us-east-1/i-3"]
+
+def test_idle_scopes_are_dropped_and_read_again(tmp_path):
+    store = HistoryStore(str(tmp_path), max_scopes=2)
+    keys = [("ec2", account, "us-east-1", "", "") for account in ("a", "b", "c")]
+    for key in keys:
+        store.append(key, "ec2", {"ec2Instances": [instance("i-1")]}, 1000)
+
+    assert list(store.scopes) == keys[1:]
+    assert store.evictions == 1
+
+    # Nothing is read from disk until the scope is used
+    scope = store.scope(keys[0])
+    assert not scope.loaded
+    assert scope.latest_version() == 1
+    assert list(store.scopes) == [keys[2], keys[0]]
+
+def test_diff_of_large_scans_is_fast(tmp_path):
+    scope = ScopeHistory(str(tmp_path))
+    resources = [instance(f"i-{n}") for n in range(50000)]
+    scope.append(resources, "instance_id", 1000)
+    resources[10] = instance("i-10", "stopped")
+    scope.append(resources[:-5], "instance_id", 2000)
+
+    started = time.perf_counter()
+    diff = scope.diff(1, 2)
+
+    assert time.perf_counter() - started < 1
+    assert len(diff["changed"]) == 1
+    assert len(diff["removed"]) == 5
+
+def test_diff_endpoint_compares_recorded_scans(tmp_path, monkeypatch):
+    monkeypatch.setattr(history, "store", HistoryStore(str(tmp_path)))
+    backend.app.dependency_overrides[backend.get_aws_context] = lambda: AWSContext("123456789012", "us-east-1")
+    try:
+        key = backend.snapshot_key("ec2", AWSContext("123456789012", "us-east-1"))
+        history.store.append(key, "ec2", {"ec2Instances": [instance("i-1")]}, 1000)
+        history.store.append(key, "ec2", {"ec2Instances": [instance("i-1"), instance("i-2")]}, 2000)
+
+        client = TestClient(backend.app)
+        body = client.get("/diff", params={"from": "1", "services": "ec2"}).json()
+        assert body["services"]["ec2"]["to_version"] == 2
+        assert [resource["instance_id"] for resource in body["services"]["ec2"]["added"]] == ["i-2"]
+        assert body["total_count"] == 1
+
+        assert client.get("/diff", params={"from": "9", "services": "ec2"}).status_code == 400
+        assert client.get("/diff", params={"services": "cost"}).status_code == 400
+    finally:
+        backend.app.dependency_overrides.clear()
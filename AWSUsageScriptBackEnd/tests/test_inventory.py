@@ -0,0 +1,131 @@
+import json
+import time
+import pytest
+from fastapi.testclient import TestClient
+import app as backend
+import history
+import snapshots
+from aws_clients import AWSContext
+
+@pytest.fixture
+def client(tmp_path, monkeypatch):
+    snapshots.store.clear()
+    monkeypatch.setattr(snapshots.store, "history", history.HistoryStore(str(tmp_path)))
+    backend.app.dependency_overrides[backend.get_aws_context] = lambda: AWSContext("123456789012", "ap-southeast-2")
+    yield TestClient(backend.app)
+    backend.app.dependency_overrides.clear()
+
+def slow_collector(seconds, result):
+    def collector(aws):
+        time.sleep(seconds)
+        return result
+    return collector
+
+def account_wide(service, collector):
+    return {"service": service, "collect": collector, "pages": None, "items": None, "regional": False, "totals": []}
+
+def test_inventory_runs_collectors_concurrently(client, monkeypatch):
+    collectors = {
+        f"service{i}": account_wide(f"service{i}", slow_collector(0.3, {"success": True, "total_count": i}))
+        for i in range(6)
+    }
+    monkeypatch.setattr(backend, "INVENTORY_COLLECTORS", collectors)
+
+    started = time.perf_counter()
+    response = client.get("/inventory")
+    elapsed = time.perf_counter() - started
+
+    assert response.status_code == 200
+    body = response.json()
+    assert body["success"] == True
+    assert set(body["services"]) == set(collectors)
+    assert body["services"]["service3"]["data"]["total_count"] == 3
+    # Six 0.3s collectors run side by side, not one after another
+    assert elapsed < 1.2
+
+def test_inventory_reports_status_per_service(client, monkeypatch):
+    def broken(aws):
+        raise KeyError("RunTime")
+
+    monkeypatch.setattr(backend, "INVENTORY_COLLECTORS", {
+        "ec2": account_wide("ec2", slow_collector(0, {"success": True})),
+        "lambda": account_wide("lambda", broken),
+        "elb": account_wide("elb", slow_collector(0, {"success": False, "message": "denied"})),
+    })
+
+    body = client.get("/inventory").json()
+
+    assert body["success"] == False
+    assert body["services"]["ec2"]["status"] == "ok"
+    assert body["services"]["lambda"]["status"] == "error"
+    assert body["services"]["elb"]["status"] == "error"
+    assert sorted(body["failed"]) == ["elb", "lambda"]
+
+def test_collectors_stream_ndjson_page_by_page(client, monkeypatch):
+    def pages(aws):
+        yield [{"instance_id": "i-1"}, {"instance_id": "i-2"}]
+        yield [{"instance_id": "i-3"}]
+
+    monkeypatch.setitem(backend.collectors.COLLECTORS["ec2"], "pages", pages)
+
+    response = client.get("/ec2", headers={"Accept": "application/x-ndjson"})
+
+    assert response.headers["content-type"].startswith("application/x-ndjson")
+    lines = [json.loads(line) for line in response.text.splitlines()]
+    assert [line["data"]["instance_id"] for line in lines[:-1]] == ["i-1", "i-2", "i-3"]
+    assert all(line["data"]["region"] == "ap-southeast-2" for line in lines[:-1])
+    assert lines[-1]["type"] == "summary"
+    assert lines[-1]["total_count"] == 3
+    assert lines[-1]["regions"] == {"ap-southeast-2": 3}
+
+def test_no_cache_requests_and_invalidation_scan_again(client, monkeypatch):
+    scans = []
+
+    def counting(aws):
+        scans.append(1)
+        return {"success": True, "ec2Instances": [], "total_count": len(scans)}
+
+    monkeypatch.setitem(backend.collectors.COLLECTORS, "ec2", account_wide("ec2", counting))
+
+    assert client.get("/ec2").json()["total_count"] == 1
+    assert client.get("/ec2").json()["total_count"] == 1
+    assert client.get("/ec2", headers={"Cache-Control": "no-cache"}).json()["total_count"] == 2
+
+    body = client.delete("/cache?services=ec2").json()
+    assert body["total_count"] == 1
+    assert client.get("/ec2").json()["total_count"] == 3
+    assert client.delete("/cache?services=nope").status_code == 400
+
+def test_inventory_joins_the_encoded_snapshots(client, monkeypatch):
+    collectors = {
+        "ec2": {**account_wide("ec2", slow_collector(0, {"success": True, "ec2Instances": [{"instance_id": "i-1"}], "total_count": 1})), "items": "ec2Instances"},
+        "s3": account_wide("s3", slow_collector(0, {"success": True, "total_count": 0})),
+    }
+    monkeypatch.setattr(backend, "INVENTORY_COLLECTORS", collectors)
+    monkeypatch.setitem(backend.collectors.COLLECTORS, "ec2", collectors["ec2"])
+
+    body = client.get("/inventory").json()
+    alone = client.get("/ec2").json()
+
+    assert list(body["services"]["ec2"]) == ["status", "duration_ms", "snapshot", "data"]
+    assert body["services"]["ec2"]["data"] == {key: value for key, value in alone.items() if key != "snapshot"}
+    assert body["services"]["s3"]["data"] == {"success": True, "total_count": 0}
+
+def test_slow_region_discovery_is_bounded_by_the_deadline(client, monkeypatch):
+    def slow_regions(aws):
+        time.sleep(1)
+        return ["ap-southeast-2"]
+
+    monkeypatch.setattr(backend.fanout, "describe_enabled_regions", slow_regions)
+    monkeypatch.setattr(backend.fanout, "enabled_regions_cache", {})
+    monkeypatch.setattr(backend, "INVENTORY_COLLECTORS", {
+        "ec2": {**account_wide("ec2", slow_collector(0, {"success": True})), "regional": True},
+        "s3": account_wide("s3", slow_collector(0, {"success": True})),
+    })
+
+    started = time.perf_counter()
+    body = client.get("/inventory", params={"regions": "all", "deadline_ms": 300}).json()
+
+    assert time.perf_counter() - started < 0.8
+    assert body["partial"] == ["ec2"]
+    assert body["services"]["s3"]["status"] == "ok"
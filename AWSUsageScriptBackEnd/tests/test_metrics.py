@@ -0,0 +1,75 @@
+import threading
+import pytest
+from botocore.exceptions import ClientError
+from fastapi.testclient import TestClient
+import app as backend
+import metrics
+import snapshots
+
+def test_counters_from_every_thread_are_added_up():
+    counter = metrics.Counter("test_total", "Test counter", ("kind",))
+
+    def count():
+        for _ in range(1000):
+            counter.inc("a")
+
+    threads = [threading.Thread(target=count) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert counter.totals() == {("a",): 4000}
+    assert 'test_total{kind="a"} 4000' in counter.render()
+
+def test_histogram_buckets_are_cumulative():
+    histogram = metrics.Histogram("test_seconds", "Test histogram", ("route",), buckets=(0.1, 1))
+    histogram.observe(0.05, "/a")
+    histogram.observe(0.5, "/a")
+    histogram.observe(5, "/a")
+
+    lines = histogram.render()
+    assert 'test_seconds_bucket{route="/a",le="0.1"} 1' in lines
+    assert 'test_seconds_bucket{route="/a",le="1"} 2' in lines
+    assert 'test_seconds_bucket{route="/a",le="+Inf"} 3' in lines
+    assert 'test_seconds_count{route="/a"} 3' in lines
+
+def test_aws_calls_are_counted_per_operation(aws):
+    ec2 = aws.client("ec2")
+    metrics.instrument_client(ec2)
+    before = metrics.aws_calls.totals().get(("ec2", "DescribeAddresses"), 0)
+    errors = metrics.aws_errors.totals().get(("ec2", "DescribeAddresses", "UnauthorizedOperation"), 0)
+
+    stub = aws.stub("ec2")
+    stub.add_response("describe_addresses", {"Addresses": []})
+    stub.add_client_error("describe_addresses", service_error_code="UnauthorizedOperation", http_status_code=403)
+    ec2.describe_addresses()
+    with pytest.raises(ClientError):
+        ec2.describe_addresses()
+
+    assert metrics.aws_calls.totals()[("ec2", "DescribeAddresses")] == before + 2
+    assert metrics.aws_errors.totals()[("ec2", "DescribeAddresses", "UnauthorizedOperation")] == errors + 1
+
+def test_throttled_attempts_are_counted(aws):
+    operation = aws.client("ce").meta.service_model.operation_model("GetCostAndUsage")
+    before = metrics.aws_throttles.totals().get(("ce", "GetCostAndUsage"), 0)
+
+    metrics.needs_retry(operation, response=(None, {"Error": {"Code": "ThrottlingException"}}))
+    metrics.needs_retry(operation, response=(None, {"Error": {"Code": "ValidationException"}}))
+
+    assert metrics.aws_throttles.totals()[("ce", "GetCostAndUsage")] == before + 1
+
+def test_metrics_endpoint_labels_requests_by_route():
+    snapshots.store.clear()
+    client = TestClient(backend.app)
+    client.get("/health")
+    client.get("/nothing/here")
+
+    response = client.get("/metrics")
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain; version=0.0.4")
+    assert 'http_requests_total{method="GET",route="/health",status="200"}' in response.text
+    # Unknown paths share one label instead of adding a series each
+    assert 'http_requests_total{method="GET",route="unmatched",status="404"}' in response.text
+    assert 'http_request_duration_seconds_bucket{method="GET",route="/health",le="+Inf"}' in response.text
+    assert "cache_requests_total" in response.text
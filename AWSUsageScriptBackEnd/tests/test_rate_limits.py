@@ -0,0 +1,103 @@
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import boto3
+import pytest
+from botocore.retries.standard import ExponentialBackoff
+import aws_clients
+import rate_limits
+
+THROTTLED = b"<Response><Errors><Error><Code>RequestLimitExceeded</Code><Message>Request limit exceeded.</Message></Error></Errors><RequestID>1</RequestID></Response>"
+ADDRESSES = b'<DescribeAddressesResponse xmlns="http://ec2.amazonaws.com/doc/2016-11-15/"><requestId>1</requestId><addressesSet/></DescribeAddressesResponse>'
+
+# Local EC2 endpoint throttling the first requests it gets
+@pytest.fixture
+def ec2_endpoint():
+    state = {"requests": 0, "throttle": 0}
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            self.rfile.read(int(self.headers["Content-Length"]))
+            state["requests"] += 1
+            throttled = state["requests"] <= state["throttle"]
+            body = THROTTLED if throttled else ADDRESSES
+            self.send_response(503 if throttled else 200)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield f"http://127.0.0.1:{server.server_address[1]}", state
+    server.shutdown()
+
+def ec2_client(endpoint, limiter):
+    client = boto3.client(
+        "ec2",
+        region_name="ap-southeast-2",
+        endpoint_url=endpoint,
+        aws_access_key_id="testing",
+        aws_secret_access_key="testing",
+        config=aws_clients.CLIENT_CONFIG,
+    )
+    limiter.attach(client, "123456789012")
+    return client
+
+def test_bursts_wait_for_tokens_instead_of_failing():
+    bucket = rate_limits.TokenBucket(2)
+
+    assert bucket.reserve() == 0
+    assert bucket.reserve() == 0
+    # The third caller queues behind the burst, the fourth one behind the third
+    assert bucket.reserve() == pytest.approx(0.5, abs=0.01)
+    assert bucket.reserve() == pytest.approx(1.0, abs=0.01)
+
+def test_throttling_halves_the_rate_and_successes_restore_it():
+    bucket = rate_limits.TokenBucket(10)
+
+    bucket.throttled()
+    bucket.throttled()
+    assert bucket.rate == 2.5
+    assert bucket.tokens <= 0
+
+    for _ in range(100):
+        bucket.succeeded()
+    assert bucket.rate == 10
+
+def test_throttled_calls_are_retried_after_botocore_gives_up(ec2_endpoint, monkeypatch):
+    endpoint, state = ec2_endpoint
+    monkeypatch.setattr(ExponentialBackoff, "delay_amount", lambda self, context: 0)
+    monkeypatch.setattr(rate_limits, "THROTTLE_BACKOFF_SECONDS", 0.001)
+    limiter = rate_limits.RateLimiter(16)
+    client = ec2_client(endpoint, limiter)
+    # Three attempts are what botocore makes on its own
+    state["throttle"] = 4
+
+    response = client.describe_addresses()
+
+    assert response["Addresses"] == []
+    assert state["requests"] == 5
+    stats = limiter.stats()
+    assert stats["throttles"] == 4
+    assert stats["slowed"] == {"123456789012/ap-southeast-2/ec2/DescribeAddresses": 1.65}
+
+def test_calls_are_spaced_to_the_rate_of_the_operation(ec2_endpoint, monkeypatch):
+    endpoint, state = ec2_endpoint
+    monkeypatch.setitem(rate_limits.SERVICE_RATE_LIMITS, "ec2", 10)
+    limiter = rate_limits.RateLimiter(16)
+    client = ec2_client(endpoint, limiter)
+
+    started = time.perf_counter()
+    threads = [threading.Thread(target=client.describe_addresses) for _ in range(15)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    # A burst of 10, the other 5 at 10 per second
+    assert time.perf_counter() - started >= 0.45
+    assert state["requests"] == 15
+    assert limiter.stats()["waits"] == 5
@@ -0,0 +1,63 @@
+import json
+import tracemalloc
+from datetime import datetime, timezone
+from fastapi.encoders import jsonable_encoder
+import history
+import records
+
+LAUNCHED = datetime(2024, 3, 1, tzinfo=timezone.utc)
+
+# Strings built at run time, like the ones botocore parses out of every response
+def fresh(text):
+    return "".join(list(text))
+
+def test_records_keep_the_json_shape_of_the_api():
+    volume = records.Volume(id="vol-1", size=8, type="gp3", state="in-use", attached_to="No attachment")
+    volume["account_id"] = "123456789012"
+    volume["region"] = "ap-southeast-2"
+
+    assert jsonable_encoder({"ebsVolumes": [volume]}) == {"ebsVolumes": [{
+        "id": "vol-1", "size": 8, "type": "gp3", "state": "in-use", "attachedTo": "No attachment",
+        "account_id": "123456789012", "region": "ap-southeast-2",
+    }]}
+    assert volume["attachedTo"] == "No attachment"
+    assert volume.get("missing") is None
+
+    database = records.DBInstance(identifier="db-1", engine="postgres", db_class="db.t3.micro", status="available", storage=20)
+    assert list(database) == ["identifier", "engine", "class", "status", "storage"]
+    assert "region" not in database
+
+def test_history_hashes_do_not_change():
+    instance = records.EC2Instance(instance_id="i-1", instance_type="t3.micro", state="running", launch_time=LAUNCHED)
+    as_dict = {"instance_id": "i-1", "instance_type": "t3.micro", "state": "running", "launch_time": LAUNCHED}
+
+    assert instance == as_dict
+    # Scans recorded before the records existed keep matching
+    assert history.record_hash(instance) == history.record_hash(as_dict)
+    assert json.loads(history.canonical(instance))["launch_time"] == str(LAUNCHED)
+
+def test_repeated_fields_are_shared():
+    first = records.LoadBalancer(name="a", type=fresh("APPLICATION"), scheme=fresh("internal"), state=fresh("active"))
+    second = records.LoadBalancer(name="b", type=fresh("APPLICATION"), scheme=fresh("internal"), state=fresh("active"))
+
+    assert first.scheme is second.scheme
+    assert first.state is second.state
+
+def test_records_take_a_fraction_of_the_memory_of_dicts():
+    def measure(make):
+        tracemalloc.start()
+        kept = [make(index) for index in range(5000)]
+        size = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        return size / len(kept)
+
+    def as_dict(index):
+        return {"instance_id": f"i-{index:017x}", "instance_type": fresh("t3.micro"), "state": fresh("running"), "launch_time": LAUNCHED, "account_id": fresh("123456789012"), "region": fresh("ap-southeast-2")}
+
+    def as_record(index):
+        record = records.EC2Instance(instance_id=f"i-{index:017x}", instance_type=fresh("t3.micro"), state=fresh("running"), launch_time=LAUNCHED)
+        record["account_id"] = fresh("123456789012")
+        record["region"] = fresh("ap-southeast-2")
+        return record
+
+    assert measure(as_record) < measure(as_dict) / 2
@@ -0,0 +1,185 @@
+import asyncio
+import sys
+import pytest
+import deadlines
+import snapshots
+from snapshots import SnapshotStore
+
+def counting_scan(results):
+    calls = []
+
+    async def scan():
+        calls.append(1)
+        await asyncio.sleep(0.05)
+        return results[min(len(calls), len(results)) - 1]
+
+    return scan, calls
+
+def test_concurrent_readers_share_one_scan():
+    store = SnapshotStore()
+    scan, calls = counting_scan([{"success": True, "total_count": 3}])
+
+    async def main():
+        return await asyncio.gather(*(store.read(("ec2", "acct"), "ec2", scan) for _ in range(20)))
+
+    results = asyncio.run(main())
+
+    assert len(calls) == 1
+    assert {snapshot.version for snapshot in results} == {1}
+    # Later readers get the snapshot without scanning
+    assert asyncio.run(store.read(("ec2", "acct"), "ec2", scan)).data["total_count"] == 3
+    assert len(calls) == 1
+
+def test_scheduler_refreshes_due_scopes(monkeypatch):
+    monkeypatch.setenv("SNAPSHOT_INTERVAL_EC2", "1")
+    store = SnapshotStore()
+    scan, calls = counting_scan([{"success": True, "total_count": 1}, {"success": True, "total_count": 2}])
+
+    async def main():
+        await store.read(("ec2", "acct"), "ec2", scan)
+        store.snapshots[("ec2", "acct")].taken_monotonic -= 5
+        store.tick()
+        await asyncio.sleep(0.2)
+        return await store.read(("ec2", "acct"), "ec2", scan)
+
+    snapshot = asyncio.run(main())
+
+    assert len(calls) == 2
+    assert snapshot.version == 2
+    assert snapshot.data["total_count"] == 2
+    assert snapshot.info()["age_seconds"] < 1
+
+def test_failed_refresh_keeps_the_last_good_snapshot():
+    store = SnapshotStore()
+    scan, calls = counting_scan([{"success": True, "total_count": 1}, {"success": False, "message": "throttled"}])
+
+    async def main():
+        await store.read(("rds", "acct"), "rds", scan)
+        return await store.refresh(("rds", "acct"))
+
+    snapshot = asyncio.run(main())
+
+    assert snapshot.version == 1
+    assert snapshot.data["total_count"] == 1
+    assert store.stats()["errors"] == {"rds/acct": "throttled"}
+
+def test_idle_scopes_are_dropped(monkeypatch):
+    store = SnapshotStore()
+    scan, calls = counting_scan([{"success": True}])
+    asyncio.run(store.read(("s3", "acct"), "s3", scan))
+
+    monkeypatch.setattr(snapshots, "SNAPSHOT_IDLE_SECONDS", -1)
+    store.tick()
+
+    assert store.stats()["scopes"] == 0
+    assert store.stats()["snapshots"] == 0
+
+def test_a_failed_first_scan_is_retried_soon():
+    store = SnapshotStore()
+    key = ("s3", "acct")
+    scan, calls = counting_scan([{"success": False, "message": "Throttling"}, {"success": True, "total_count": 2}, {"success": True, "total_count": 3}])
+
+    async def main():
+        failed = await store.read(key, "s3", scan)
+        # Served until the retry is due, not for the day of the S3 interval
+        assert await store.read(key, "s3", scan) is failed
+        store.snapshots[key].taken_monotonic -= snapshots.SNAPSHOT_RETRY_SECONDS
+        store.tick()
+        await asyncio.sleep(0.2)
+        return failed, await store.read(key, "s3", scan)
+
+    failed, retried = asyncio.run(main())
+
+    assert failed.data["message"] == "Throttling"
+    assert retried.data["total_count"] == 2
+    assert len(calls) == 2
+
+def test_reads_retry_a_failed_scan_once_it_is_due():
+    store = SnapshotStore()
+    key = ("cost", "acct")
+    scan, calls = counting_scan([{"success": False, "message": "CircuitOpen"}, {"success": True, "total_cost": 1.5}])
+
+    async def main():
+        await store.read(key, "cost", scan)
+        store.snapshots[key].taken_monotonic -= snapshots.SNAPSHOT_RETRY_SECONDS
+        return await store.read(key, "cost", scan)
+
+    assert asyncio.run(main()).data["total_cost"] == 1.5
+    assert len(calls) == 2
+
+def test_scans_stop_at_the_deadline_of_the_request_that_started_them():
+    store = SnapshotStore()
+    key = ("ec2", "acct")
+
+    async def scan():
+        await asyncio.sleep(0.1)
+        try:
+            deadlines.check("DescribeInstances")
+        except deadlines.DeadlineExceeded as error:
+            # The fan-out keeps the targets that made it
+            return {"success": True, "total_count": 0, "errors": {"acct/us-east-1": str(error)}}
+        return {"success": True, "total_count": 1}
+
+    async def main():
+        token = deadlines.start(50)
+        try:
+            with pytest.raises(deadlines.DeadlineExceeded):
+                await store.read(key, "ec2", scan)
+        finally:
+            deadlines.current.reset(token)
+        assert key not in store.snapshots
+
+        # The scheduler scans again without a deadline
+        store.tick()
+        await asyncio.sleep(0.2)
+        return store.snapshots[key]
+
+    assert asyncio.run(main()).data["total_count"] == 1
+
+def test_least_recently_read_scopes_are_evicted_by_size():
+    result = {"success": True, "names": ["x" * 60]}
+    size = snapshots.Snapshot(1, result, 0, 0).size()
+    # Room for three of the snapshots
+    store = SnapshotStore(max_bytes=size * 3 + 10)
+    scan, calls = counting_scan([result])
+
+    async def main():
+        for account in ("a", "b", "c"):
+            await store.read(("ec2", account), "ec2", scan)
+        # Reading "a" again keeps it, "b" is now the oldest
+        await store.read(("ec2", "a"), "ec2", scan)
+        await store.read(("ec2", "d"), "ec2", scan)
+
+    asyncio.run(main())
+
+    assert set(store.snapshots) == {("ec2", "a"), ("ec2", "c"), ("ec2", "d")}
+    stats = store.stats()
+    assert stats["bytes"] == size * 3
+    assert stats["evictions"] == 1
+    assert stats["hits"] == 1
+    assert stats["misses"] == 4
+
+def test_the_parsed_data_counts_towards_the_size():
+    names = ["x" * 60] * 100
+    snapshot = snapshots.Snapshot(1, {"success": True, "names": names}, 0, 0)
+
+    assert snapshot.size() == len(snapshot.encode()) + snapshots.retained_size(snapshot.data)
+    # The shared string is counted once
+    assert snapshots.retained_size(names) == sys.getsizeof(names) + sys.getsizeof(names[0])
+
+def test_fresh_reads_and_invalidation_scan_again():
+    store = SnapshotStore()
+    scan, calls = counting_scan([{"success": True, "total_count": 1}, {"success": True, "total_count": 2}, {"success": True, "total_count": 3}])
+
+    async def main():
+        await store.read(("ec2", "acct"), "ec2", scan)
+        fresh = await store.read(("ec2", "acct"), "ec2", scan, fresh=True)
+        assert store.invalidate("acct", {"ebs"}) == 0
+        assert store.invalidate("acct") == 1
+        return fresh, await store.read(("ec2", "acct"), "ec2", scan)
+
+    fresh, rescanned = asyncio.run(main())
+
+    assert fresh.data["total_count"] == 2
+    assert rescanned.data["total_count"] == 3
+    assert len(calls) == 3
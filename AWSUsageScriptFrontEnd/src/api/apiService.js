@@ -3,6 +3,9 @@ import { getAuthToken, setAuthToken, clearAuthToken } from "../JWT/jwtService"
 
 let API_BASE_URL = process.env.REACT_APP_API_BASE_URL || 'http://localhost:5001';
 
+// Time budget of the dashboard requests, services that are slower come back as partial and keep loading in the backend
+const DASHBOARD_DEADLINE_MS = process.env.REACT_APP_DEADLINE_MS || 3000;
+
 const findURL = async () => {
     let check = false;
     try {
@@ -152,6 +155,22 @@ const awsResourceApi = {
     // Get Elastic IPs
     getEIP: async () => {
         return await apiCall('/eip');
+    },
+
+    // Get every service in one call
+    getInventory: async () => {
+        return await apiCall(`/inventory?deadline_ms=${DASHBOARD_DEADLINE_MS}`);
+    },
+
+    // Live changes pushed by the backend, one event per service (e.g. "ec2") holding the changed records.
+    // EventSource cannot send headers, so the token goes in the query string.
+    openEventStream: (services = []) => {
+        const params = new URLSearchParams({ access_token: getAuthToken() || '' });
+        if (services.length) {
+            params.set('services', services.join(','));
+        }
+
+        return new EventSource(`${API_BASE_URL}/events?${params}`);
     }
 }
 export { findURL };
@@ -1,7 +1,10 @@
-import { use, useEffect, useState } from "react"
+import { use, useEffect, useRef, useState } from "react"
 import mockData from "../constants/MockData";
 import apiService from "./apiService";
 
+// Delay before the inventory is requested again while some of its services are partial
+const PARTIAL_RETRY_MS = process.env.REACT_APP_PARTIAL_RETRY_MS || 5000;
+
 const useMockOrRealData = (isAuthenticated = false) => {
     // const[data, setData] = useState(null);
     // Region
@@ -59,6 +62,52 @@ const useMockOrRealData = (isAuthenticated = false) => {
     // Loading state
     const[isLoading, setIsLoading] = useState(true);
 
+    // Pending inventory retry while some services are still loading in the backend
+    const inventoryRetry = useRef(null);
+
+    // INVENTORY API calls ==========================
+
+    const applyInventory = (responseInventory) => {
+        // Each service carries its own status, so one failing service only falls back to mock data for itself
+        const services = responseInventory.error ? {} : responseInventory.data.services;
+        let partial = false;
+
+        const applyService = (name, setData, setIsMock) => {
+            const service = services[name];
+
+            if(service && service.status === 'partial'){
+                // Still loading in the backend: keep what is shown if it is real, else show the (empty) partial result
+                partial = true;
+                setData((current) => (current && current !== mockData ? current : service.data));
+                setIsMock(false);
+            } else if(!service || service.status !== 'ok'){
+                // Use mock data
+                setData(mockData);
+                setIsMock(true);
+            } else {
+                // else use the real data
+                setData(service.data);
+                setIsMock(false);
+            }
+        };
+
+        applyService('ec2', setEC2Data, setIsEC2DataMock);
+        applyService('rds', setRDSData, setIsRDSDataMock);
+        applyService('s3', sets3Data, setIsS3DataMock);
+        applyService('lambda', setLambdaData, setIsLambdaDataMock);
+        applyService('elb', setLoadBalancersData, setIsLBDataMock);
+        applyService('ebs', setEBSData, setIsEBSDataMock);
+        applyService('eip', setEIPsData, setIsEIPsDataMock);
+
+        // The backend keeps loading the partial services, ask again once their snapshots are likely ready
+        clearTimeout(inventoryRetry.current);
+        if(partial){
+            inventoryRetry.current = setTimeout(async () => {
+                applyInventory(await apiService.getInventory());
+            }, PARTIAL_RETRY_MS);
+        }
+    };
+
     const fetchAWSData = async () => {
         const FORCE_MOCK_TESTING = false; // Set to false to disable testing
     
@@ -104,12 +153,16 @@ const useMockOrRealData = (isAuthenticated = false) => {
         setErrorCost(null);
         setErrorEBS(null);
 
-        // EC2 API calls
+        // Region, cost and the inventory of every other service are requested at the same time
         try {
 
-            // REGION API calls ============================
+            const [responseRegion, reponseCOST, responseInventory] = await Promise.all([
+                apiService.getAWSRegion(),
+                apiService.getAWSCosts(),
+                apiService.getInventory(),
+            ]);
 
-            const responseRegion = await apiService.getAWSRegion();
+            // REGION API calls ============================
 
             // If threre is error in the returned call
             if(responseRegion.error){
@@ -122,41 +175,8 @@ const useMockOrRealData = (isAuthenticated = false) => {
                 setIsRegionDataMock(false);
             }
 
-
-            // EC2 API calls ===============================
-
-            const responseEC2 = await apiService.getEC2();
-            
-            // If threre is error in the returned call
-            if(responseEC2.error){
-                // Use mock data
-                setEC2Data(mockData);
-                setIsEC2DataMock(true);
-            } else {
-                // else use the real data
-                setEC2Data(responseEC2.data);
-                setIsEC2DataMock(false);
-            }
-
-            // RDS API calls ============================
-
-            const responseRDS = await apiService.getRDS();
-
-            // If threre is error in the returned call
-            if(responseRDS.error){
-                // Use mock data
-                setRDSData(mockData);
-                setIsRDSDataMock(true);
-            } else {
-                // else use the real data
-                setRDSData(responseRDS.data);
-                setIsRDSDataMock(false);
-            }
-
             // COST API calls ===============================
 
-            const reponseCOST = await apiService.getAWSCosts();
-
             // If threre is error in the returned call
             if(reponseCOST.error){
                 // Use mock data
@@ -168,66 +188,9 @@ const useMockOrRealData = (isAuthenticated = false) => {
                 setIsCostDataMock(false);
             }
 
-            // S3 API calls ====================
+            // INVENTORY API calls ==========================
 
-            const responseS3 = await apiService.getS3();
-
-            // If there is error in the returned call
-            if(responseS3.error){
-                // Use mock data
-                sets3Data(mockData);
-                setIsS3DataMock(true);
-            } else {
-                sets3Data(responseS3.data);
-                setIsS3DataMock(false);
-            }
-
-            // LAMBDA API calls ===================
-            const responseLambda = await apiService.getLambda();
-
-            if(responseLambda.error) {
-                setLambdaData(mockData);
-                setIsLambdaDataMock(true);
-            } else {
-                setLambdaData(responseLambda.data);
-                setIsLambdaDataMock(false);
-            }
-
-            // ELB API calls ===================
-
-            const responseELB = await apiService.getELB();
-
-            if(responseELB.error) {
-                setLoadBalancersData(mockData);
-                setIsLBDataMock(true);
-            } else {
-                setLoadBalancersData(responseELB.data);
-                setIsLBDataMock(false);
-            }
-
-            // EBS API calls ===================
-
-            const responseEBS = await apiService.getEBS();
-
-            if(responseEBS.error) {
-                setEBSData(mockData);
-                setIsEBSDataMock(true);
-            } else {
-                setEBSData(responseEBS.data);
-                setIsEBSDataMock(false);
-            }
-
-            // EIPs API calls ===================
-
-            const responseEIPs = await apiService.getEIP();
-
-            if(responseEIPs.error) {
-                setEIPsData(mockData);
-                setIsEIPsDataMock(true);
-            } else {
-                setEIPsData(responseEIPs.data);
-                setIsEIPsDataMock(false);
-            }
+            applyInventory(responseInventory);
 
         } catch (err) {
 
@@ -241,13 +204,84 @@ const useMockOrRealData = (isAuthenticated = false) => {
         }
     }
 
-    // Call fetchAWSData on mount
+    // Call fetchAWSData on mount, a pending retry is dropped on logout
     useEffect(() => {
         if(isAuthenticated){
             fetchAWSData();
         }
+
+        return () => clearTimeout(inventoryRetry.current);
     }, [isAuthenticated]);
 
+    // LIVE UPDATES ====================================
+
+    // Services kept up to date by the backend event stream: the field holding their resources
+    // and the fields telling one resource apart, the same as the backend collectors use
+    const liveServices = {
+        ec2: { items: 'ec2Instances', id: ['instance_id'], setData: setEC2Data },
+        rds: { items: 'rdsInstances', id: ['identifier'], setData: setRDSData },
+        s3: { items: 's3Buckets', id: ['name'], setData: sets3Data },
+        lambda: { items: 'lambdaFunctions', id: ['name'], setData: setLambdaData },
+        elb: { items: 'loadBalancers', id: ['type', 'name'], setData: setLoadBalancersData },
+        ebs: { items: 'ebsVolumes', id: ['id'], setData: setEBSData },
+        eip: { items: 'elasticIPs', id: ['ip'], setData: setEIPsData },
+    };
+
+    // "<account>/<region>/<id>", the resource ids of the deletes sent by the backend
+    const resourceId = (record, idFields) => (
+        `${record.account_id || ''}/${record.region || ''}/${idFields.map((field) => record[field]).join('/')}`
+    );
+
+    // Apply the changed records of one event to the data of its service
+    const applyChanges = (current, service, change) => {
+        // Mock data is only replaced by a real fetch
+        if(!current || current === mockData || !current[service.items]){
+            return current;
+        }
+
+        const deleted = new Set(change.deletes);
+        const upserts = new Map(change.upserts.map((record) => [resourceId(record, service.id), record]));
+
+        const items = current[service.items]
+            .filter((record) => !deleted.has(resourceId(record, service.id)))
+            .map((record) => {
+                const id = resourceId(record, service.id);
+                if(!upserts.has(id)){
+                    return record;
+                }
+                const updated = upserts.get(id);
+                upserts.delete(id);
+                return updated;
+            });
+        // What is left are new resources
+        items.push(...upserts.values());
+
+        return { ...current, [service.items]: items, total_count: items.length };
+    };
+
+    // Open the event stream once the first load is done, closed again on logout
+    useEffect(() => {
+        if(!isAuthenticated || isLoading){
+            return;
+        }
+
+        const stream = apiService.openEventStream(Object.keys(liveServices));
+
+        Object.entries(liveServices).forEach(([name, service]) => {
+            stream.addEventListener(name, (event) => {
+                const change = JSON.parse(event.data);
+                service.setData((current) => applyChanges(current, service, change));
+            });
+        });
+
+        // The backend cannot tell what changed (its snapshots were dropped, or this dashboard fell too far behind)
+        stream.addEventListener('resync', () => {
+            fetchAWSData();
+        });
+
+        return () => stream.close();
+    }, [isAuthenticated, isLoading]);
+
     return [
         regionData, errorRegion, isRegionDataMock,
         ec2Data, errorEC2, isEC2DataMock, 